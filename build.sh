@@ -128,6 +128,8 @@ create_server_distribution() {
     
     # Common server files
     cp server/server.py "$BUILD_DIR/server-common/"
+    cp server/codec.py "$BUILD_DIR/server-common/"
+    cp server/keymap.py "$BUILD_DIR/server-common/"
     cp server/config.json "$BUILD_DIR/server-common/"
     cp server/requirements.txt "$BUILD_DIR/server-common/"
     cp server/test_server.py "$BUILD_DIR/server-common/"
@@ -205,6 +207,8 @@ EOF
 
 - **run-server.bat** - One-click server runner (auto venv setup)
 - **server.py** - Main server application
+- **codec.py** - Binary command encoding used by the server
+- **keymap.py** - Key names and shortcut parsing used by the server
 - **config.json** - Server configuration (EDIT THIS!)
 - **requirements.txt** - Python dependencies
 - **test_server.py** - Test script to verify server functionality
@@ -245,6 +249,8 @@ EOF
 
 - **run-server.sh** - One-click server runner (auto venv setup)
 - **server.py** - Main server application
+- **codec.py** - Binary command encoding used by the server
+- **keymap.py** - Key names and shortcut parsing used by the server
 - **config.json** - Server configuration (EDIT THIS!)
 - **requirements.txt** - Python dependencies
 - **test_server.py** - Test script to verify server functionality
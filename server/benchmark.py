@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+"""
+Load and latency benchmark for Android PC Controller Server
+
+Runs server.py's Flask app in-process with the recording input backend and
+the null audio backend, so nothing is typed and no display or sound card is
+needed. Drives configurable workloads and reports throughput and latency
+percentiles for each server thread count and transport.
+
+Examples:
+    python benchmark.py
+    python benchmark.py --workload clients --clients 16 --threads 4 8 16
+    python benchmark.py --workload hold --transport http ws --json results.json
+    python benchmark.py --core waitress asyncio --threads 4
+    python benchmark.py --workload trace --trace journal.bin --trace-scale 0.5
+    python benchmark.py --transport http binary ws ws-binary
+    python benchmark.py --codec
+    python benchmark.py --workload pointer --pointer-rate 120 --transport http ws
+"""
+
+import argparse
+import base64
+import http.client
+import io
+import itertools
+import json
+import logging
+import os
+import random
+import socket
+import struct
+import threading
+import time
+
+from werkzeug.test import EnvironBuilder
+
+import codec
+import server
+
+TOKEN = 'benchmark-token'
+WORKLOADS = ('gestures', 'hold', 'type', 'clients', 'pointer')
+TRANSPORTS = ('http', 'ws', 'batch', 'binary', 'ws-binary')
+CORES = ('waitress', 'asyncio')
+# /batch only takes dispatcher commands; pointer frames have their own endpoint
+UNSUPPORTED = {('pointer', 'batch')}
+# Each HTTP client gets its own dispatch queue on the server
+CLIENT_IDS = itertools.count(1)
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def gesture_commands(count, rng):
+    """A burst of swipes, taps and the odd volume press"""
+    commands = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.7:
+            commands.append({"cmd": "arrow", "direction": rng.choice(('up', 'down', 'left', 'right'))})
+        elif roll < 0.9:
+            commands.append({"cmd": "key", "key": rng.choice(('enter', 'escape'))})
+        else:
+            commands.append({"cmd": "volume", "action": rng.choice(('up', 'down'))})
+    return commands
+
+def hold_commands(count, rng):
+    """A hold-to-repeat stream of one arrow direction"""
+    direction = rng.choice(('up', 'down', 'left', 'right'))
+    return [{"cmd": "arrow", "direction": direction} for _ in range(count)]
+
+def pointer_commands(count, rng, rate, per_message):
+    """Touchpad motion sampled at `rate` Hz, sent `per_message` samples at a time
+
+    Returns the messages and their send offsets in seconds.
+    """
+    interval_ms = 1000.0 / rate
+    messages, offsets = [], []
+    for index in range(0, count, per_message):
+        samples = [[round((index + i) * interval_ms, 3), rng.randint(-8, 8), rng.randint(-8, 8)]
+                   for i in range(per_message)]
+        messages.append({"cmd": "pointer", "samples": samples})
+        offsets.append(samples[-1][0] / 1000.0)
+    return messages, offsets
+
+def trace_commands(path, scale):
+    """Commands recorded in a server command journal, with their send offsets in seconds"""
+    entries = [e for e in server.read_journal(path) if e['command'] is not None and not e['redacted']]
+    if not entries:
+        return [], []
+    first = entries[0]['time']
+    return [e['command'] for e in entries], [(e['time'] - first) * scale for e in entries]
+
+def type_commands(count, rng, text_size):
+    """Large /type payloads"""
+    alphabet = 'abcdefghijklmnopqrstuvwxyz ABCDEFGHIJKLMNOPQRSTUVWXYZ.,'
+    return [{"cmd": "type", "text": ''.join(rng.choice(alphabet) for _ in range(text_size))}
+            for _ in range(count)]
+
+def outcome(command, result):
+    """'ok', 'dropped' or 'error' for the JSON result of one command
+
+    Commands the server answered without injecting (dropped by the
+    coalescer, expired or duplicate, or pointer samples beyond the
+    pending limit) count as dropped rather than delivered.
+    """
+    if not isinstance(result, dict) or 'error' in result:
+        return 'error'
+    if result.get('status') in ('dropped', 'expired') or result.get('duplicate'):
+        return 'dropped'
+    if command['cmd'] == 'pointer' and result.get('accepted', 0) < len(command['samples']):
+        return 'dropped'
+    return 'ok'
+
+def binary_outcome(status):
+    """outcome() for a binary result frame status"""
+    if status == 'error':
+        return 'error'
+    return 'ok' if status == 'ok' else 'dropped'
+
+def binary_outcomes(commands, data):
+    results = codec.decode_results(data)
+    if len(results) != len(commands):
+        return ['error'] * len(commands)
+    return [binary_outcome(status) for status, _ in results]
+
+class HttpClient:
+    """Keep-alive HTTP client posting to the per-command endpoints
+
+    With binary=True bodies use the compact codec instead of JSON.
+    """
+
+    def __init__(self, port, new_connections=False, ticket=False, binary=False):
+        self.port = port
+        self.new_connections = new_connections
+        self.binary = binary
+        self.client_id = f"bench-{next(CLIENT_IDS)}"
+        content_type = codec.CONTENT_TYPE if binary else "application/json"
+        self.headers = {"Content-Type": content_type, "Authorization": f"Bearer {TOKEN}",
+                        "X-Client-Id": self.client_id}
+        self.connection = None
+        if ticket:
+            self._connect()
+            self.connection.request('POST', '/auth/ticket', headers=self.headers)
+            ticket = json.loads(self.connection.getresponse().read())['ticket']
+            self.headers = {"Content-Type": content_type, "X-Ticket": ticket,
+                            "X-Client-Id": self.client_id}
+
+    def _connect(self):
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=10)
+
+    def _request(self, path, body):
+        """POST body; returns the response body, or None unless the status is 200"""
+        if self.connection is None or self.new_connections:
+            self._connect()
+        self.connection.request('POST', path, body=body, headers=self.headers)
+        response = self.connection.getresponse()
+        data = response.read()
+        return data if response.status == 200 else None
+
+    def send(self, command, wait):
+        """Send one command; returns its outcome() in a list"""
+        if self.binary:
+            data = self._request('/' + command['cmd'], codec.encode_command(dict(command, wait=wait)))
+            return ['error'] if data is None else binary_outcomes([command], data)
+        payload = dict(command, wait=wait)
+        data = self._request('/' + payload.pop('cmd'), json.dumps(payload))
+        return ['error'] if data is None else [outcome(command, json.loads(data))]
+
+    def send_batch(self, commands, wait):
+        """Send commands through /batch; returns one outcome() per command"""
+        if self.binary:
+            data = self._request('/batch', codec.encode([dict(c, wait=wait) for c in commands]))
+            return ['error'] * len(commands) if data is None else binary_outcomes(commands, data)
+        data = self._request('/batch', json.dumps({"commands": commands, "wait": wait}))
+        results = [] if data is None else json.loads(data).get('results', [])
+        if len(results) != len(commands):
+            return ['error'] * len(commands)
+        return [outcome(command, result) for command, result in zip(commands, results)]
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+class WebSocketClient:
+    """Minimal WebSocket client that waits for an ack per command
+
+    With binary=True commands are sent as codec frames in binary messages.
+    """
+
+    def __init__(self, port, binary=False):
+        self.binary = binary
+        self.sock = socket.create_connection(('127.0.0.1', port), timeout=10)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        key = base64.b64encode(os.urandom(16)).decode('ascii')
+        self.sock.sendall((
+            "GET / HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n"
+            f"Authorization: Bearer {TOKEN}\r\n\r\n"
+        ).encode('ascii'))
+        self.reader = self.sock.makefile('rb')
+        status = self.reader.readline()
+        if b' 101 ' not in status:
+            raise ConnectionError(f"WebSocket handshake failed: {status!r}")
+        while self.reader.readline() not in (b'\r\n', b''):
+            pass
+        self.next_id = 0
+
+    def _send_frame(self, payload, opcode=0x1):
+        mask = os.urandom(4)
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, 0x80 | length)
+        else:
+            header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, length)
+        masked = server._ws_unmask(payload, mask)
+        self.sock.sendall(header + mask + masked)
+
+    def _recv_frame(self):
+        _, second = self.reader.read(2)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', self.reader.read(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self.reader.read(8))[0]
+        return self.reader.read(length)
+
+    def _roundtrip(self, message):
+        self.next_id += 1
+        message['id'] = self.next_id
+        self._send_frame(json.dumps(message, separators=(',', ':')).encode('utf-8'))
+        while True:
+            reply = json.loads(self._recv_frame())
+            if reply.get('id') == self.next_id:
+                return reply
+
+    def _binary_roundtrip(self, commands, wait):
+        # Replies arrive in order on the channel, so no ids are needed
+        self._send_frame(codec.encode([dict(c, wait=wait, ack=True) for c in commands]), 0x2)
+        return binary_outcomes(commands, self._recv_frame())
+
+    def send(self, command, wait):
+        if self.binary:
+            return self._binary_roundtrip([command], wait)
+        return [outcome(command, self._roundtrip(dict(command, wait=wait)))]
+
+    def send_batch(self, commands, wait):
+        if self.binary:
+            return self._binary_roundtrip(commands, wait)
+        reply = self._roundtrip({"cmd": "batch", "commands": commands, "wait": wait})
+        results = reply.get('results', [])
+        if len(results) != len(commands):
+            return ['error'] * len(commands)
+        return [outcome(command, result) for command, result in zip(commands, results)]
+
+    def close(self):
+        self.sock.close()
+
+class BenchmarkServer:
+    """The Flask app served by one of the server cores on an ephemeral port, plus the WebSocket channel"""
+
+    def __init__(self, threads, core='waitress'):
+        self.ws = server.start_websocket_server()
+        self.ws_port = self.ws.server_address[1]
+        self.http = server.HttpListener(core, '127.0.0.1', 0, threads)
+        self.port = self.http.port
+
+    def close(self):
+        self.http.close()
+        self.ws.close()
+
+def configure_server(queue_size, overflow, metrics_enabled=True, repeat_backlog=3, max_age_ms=0,
+                     pointer_jitter_ms=30):
+    """Configure server.py for headless benchmarking
+
+    Every setting that decides whether a command is dropped is set here
+    rather than taken from the defaults, so results are comparable.
+    """
+    server.config = {
+        "api_token": TOKEN,
+        "host": "127.0.0.1",
+        "port": 0,
+        "websocket": {"enabled": True, "port": 0},
+        "dispatch": {"queue_size": queue_size, "overflow": overflow},
+        "coalesce": {"event_window": 256, "max_repeat_backlog": repeat_backlog, "max_age_ms": max_age_ms},
+        "pointer": {"rate_hz": 120, "jitter_ms": pointer_jitter_ms, "sensitivity": 1.0,
+                    "acceleration": 0.0, "max_gain": 4.0},
+    }
+    server.authenticator.configure(TOKEN, {})
+    # Waitress warns about task queue depth, which is expected under load
+    logging.getLogger('waitress').setLevel(logging.ERROR)
+    server.set_input_backend('recording')
+    server.volume_controller.backend_name = 'null'
+    server.metrics.enabled = metrics_enabled
+    server.dispatcher.configure(queue_size, overflow)
+    server.coalescer.configure(server.config['coalesce'])
+    server.pointer_streamer.configure(server.config['pointer'])
+
+def run_client(make_client, commands, transport, batch_size, wait, offsets, latencies, outcomes):
+    """Send commands one by one (or in batches) and record latency per request
+
+    `offsets`, if given, holds the send time of each command in seconds
+    from the start; otherwise commands are sent back to back. The
+    outcome() of every command is appended to `outcomes`.
+    """
+    client = make_client()
+    try:
+        step = batch_size if transport == 'batch' else 1
+        if transport == 'batch':
+            units = [commands[i:i + batch_size] for i in range(0, len(commands), batch_size)]
+        else:
+            units = commands
+        started = time.perf_counter()
+        for index, unit in enumerate(units):
+            if offsets:
+                delay = started + offsets[index * step] - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            start = time.perf_counter()
+            try:
+                if transport == 'batch':
+                    results = client.send_batch(unit, wait)
+                else:
+                    results = client.send(unit, wait)
+            except (OSError, http.client.HTTPException, ValueError):
+                results = ['error'] * (len(unit) if transport == 'batch' else 1)
+            latencies.append(time.perf_counter() - start)
+            outcomes.extend(results)
+    finally:
+        client.close()
+
+def run_case(args, workload, core, threads, transport):
+    """Run one workload against one server configuration"""
+    rng = random.Random(args.seed)
+    bench = BenchmarkServer(threads, core)
+    try:
+        clients = args.clients if workload == 'clients' else 1
+        offsets = None
+        if workload == 'type':
+            command_sets = [type_commands(args.requests, rng, args.text_size) for _ in range(clients)]
+        elif workload == 'hold':
+            command_sets = [hold_commands(args.requests, rng) for _ in range(clients)]
+            offsets = [i / args.hold_rate for i in range(args.requests)]
+        elif workload == 'trace':
+            commands, offsets = trace_commands(args.trace, args.trace_scale)
+            command_sets = [commands]
+        elif workload == 'pointer':
+            commands, offsets = pointer_commands(args.requests, rng, args.pointer_rate, args.pointer_batch)
+            command_sets = [commands]
+        else:
+            command_sets = [gesture_commands(args.requests, rng) for _ in range(clients)]
+
+        if transport in ('ws', 'ws-binary'):
+            make_client = lambda: WebSocketClient(bench.ws_port, transport == 'ws-binary')
+        else:
+            make_client = lambda: HttpClient(bench.port, args.new_connections, args.ticket,
+                                             transport == 'binary')
+
+        latencies, outcomes = [], []
+        workers = [
+            threading.Thread(target=run_client, args=(make_client, commands, transport, args.batch_size,
+                                                      args.wait, offsets, latencies, outcomes))
+            for commands in command_sets
+        ]
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+    finally:
+        bench.close()
+
+    latencies.sort()
+    commands_sent = sum(len(c) for c in command_sets)
+    errors = outcomes.count('error')
+    dropped = outcomes.count('dropped')
+    # Requests that never completed count as errors for all their commands
+    errors += commands_sent - len(outcomes)
+    delivered = commands_sent - errors - dropped
+    return {
+        "workload": workload,
+        "core": core,
+        "transport": transport,
+        "threads": threads,
+        "clients": clients,
+        "requests": len(latencies),
+        "commands": commands_sent,
+        "delivered": delivered,
+        "dropped": dropped,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        # Only delivered commands count towards throughput
+        "commands_per_sec": round(delivered / elapsed, 1) if elapsed else 0.0,
+        "cpu_percent": round(cpu / elapsed * 100, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+def codec_samples(count, rng):
+    """Gestures plus the less common fields, for the codec round-trip check"""
+    commands = gesture_commands(count, rng)
+    commands += type_commands(2, rng, 40)
+    commands.append({"cmd": "type", "text": "h\u00e9llo \u2713", "mode": "clipboard"})
+    commands.append({"cmd": "volume", "action": "set", "level": 40})
+    commands.append({"cmd": "pointer", "samples": [[1000, 4, -3], [1008, -12, 7]],
+                     "buttons": [[1010, "left", "click"]], "scroll": [[1012, 0, -1]]})
+    commands.append({"cmd": "key", "key": "enter", "event_id": 7, "sent_ms": 1700000000000,
+                     "max_age_ms": 250, "wait": True, "ack": True})
+    return commands
+
+def time_per_call(function, items, rounds):
+    """Microseconds per call of function over items, best of several rounds"""
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for item in items:
+            function(item)
+        elapsed = (time.perf_counter() - start) / len(items) * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def wsgi_post(path, content_type, body):
+    """A WSGI environ for a POST to the app, minus the socket layer"""
+    return EnvironBuilder(path=path, method='POST', data=body, headers={
+        "Authorization": f"Bearer {TOKEN}", "Content-Type": content_type}).get_environ()
+
+def call_app(request):
+    environ, body = request
+    environ = dict(environ)
+    environ['wsgi.input'] = io.BytesIO(body)
+    for _ in server.app(environ, lambda status, headers, exc_info=None: None):
+        pass
+
+def run_codec_benchmark(args):
+    """Check that every command survives an encode/decode round trip, then
+    compare the per-request cost of JSON and binary bodies"""
+    rng = random.Random(args.seed)
+    commands = codec_samples(args.requests, rng)
+    for command in commands:
+        if codec.decode(codec.encode_command(command)) != [command]:
+            raise SystemExit(f"Round trip failed for {command}")
+    if codec.decode(codec.encode(commands)) != commands:
+        raise SystemExit("Round trip failed for a batch")
+    print(f"Round trip OK for {len(commands)} commands")
+
+    gestures = gesture_commands(args.requests, rng)
+    result = {"status": "ok", "action": "arrow_up"}
+    json_bodies = [json.dumps({k: v for k, v in c.items() if k != 'cmd'}).encode('utf-8') for c in gestures]
+    binary_bodies = [codec.encode_command(c) for c in gestures]
+    rows = [(
+        "codec only",
+        time_per_call(lambda body: json.dumps(json.loads(body)), json_bodies, 20),
+        time_per_call(lambda body: codec.encode_result(codec.decode(body)[0]), binary_bodies, 20),
+    )]
+
+    # Whole Flask requests, called through WSGI without sockets
+    json_requests = [(wsgi_post('/' + c['cmd'], "application/json", body), body)
+                     for c, body in zip(gestures, json_bodies)]
+    binary_requests = [(wsgi_post('/' + c['cmd'], codec.CONTENT_TYPE, body), body)
+                       for c, body in zip(gestures, binary_bodies)]
+    json_us = binary_us = None
+    for _ in range(5):
+        # Alternate, so both see the same background load
+        json_round = time_per_call(call_app, json_requests, 1)
+        binary_round = time_per_call(call_app, binary_requests, 1)
+        json_us = json_round if json_us is None else min(json_us, json_round)
+        binary_us = binary_round if binary_us is None else min(binary_us, binary_round)
+    rows.append(("request", json_us, binary_us))
+
+    print(f"{'stage':<11} {'json us':>9} {'binary us':>9} {'saving':>7}")
+    for stage, json_us, binary_us in rows:
+        print(f"{stage:<11} {json_us:>9.1f} {binary_us:>9.1f} {(1 - binary_us / json_us) * 100:>6.1f}%")
+    print(f"Body size: {sum(map(len, json_bodies)) / len(json_bodies):.1f} bytes JSON, "
+          f"{sum(map(len, binary_bodies)) / len(binary_bodies):.1f} bytes binary")
+
+def print_results(results):
+    """Print results as a table"""
+    header = f"{'workload':<9} {'core':<8} {'transport':<9} {'threads':>7} {'clients':>7} {'cmds/s':>9} " \
+             f"{'cpu %':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'dropped':>7} {'errors':>6}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['workload']:<9} {r['core']:<8} {r['transport']:<9} {r['threads']:>7} {r['clients']:>7} "
+              f"{r['commands_per_sec']:>9} {r['cpu_percent']:>6} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {r['dropped']:>7} {r['errors']:>6}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the controller server headlessly")
+    parser.add_argument('--workload', nargs='+', choices=WORKLOADS + ('trace', 'all'), default=['all'])
+    parser.add_argument('--transport', nargs='+', choices=TRANSPORTS, default=['http', 'ws'])
+    parser.add_argument('--core', nargs='+', choices=CORES, default=['waitress'])
+    parser.add_argument('--threads', nargs='+', type=int, default=[4])
+    parser.add_argument('--requests', type=int, default=500, help="Commands per client")
+    parser.add_argument('--clients', type=int, default=8, help="Concurrent clients for the clients workload")
+    parser.add_argument('--text-size', type=int, default=5000, help="Characters per /type payload")
+    parser.add_argument('--hold-rate', type=float, default=20.0, help="Repeats per second for the hold workload")
+    parser.add_argument('--pointer-rate', type=float, default=120.0, help="Samples per second for the pointer workload")
+    parser.add_argument('--pointer-batch', type=int, default=4, help="Samples per message for the pointer workload")
+    parser.add_argument('--trace', metavar='PATH', help="Command journal to replay for the trace workload")
+    parser.add_argument('--trace-scale', type=float, default=1.0,
+                        help="Multiplier for the recorded gaps in the trace workload (0 for back to back)")
+    parser.add_argument('--batch-size', type=int, default=10, help="Commands per request for the batch transport")
+    parser.add_argument('--wait', action='store_true', help="Respond after injection instead of after queueing")
+    parser.add_argument('--ticket', action='store_true', help="Authenticate HTTP requests with a session ticket")
+    parser.add_argument('--new-connections', action='store_true', help="Open a new HTTP connection per request")
+    parser.add_argument('--queue-size', type=int, default=256)
+    parser.add_argument('--overflow', choices=server.InputDispatcher.OVERFLOW_POLICIES, default='reject')
+    parser.add_argument('--repeat-backlog', type=int, default=3,
+                        help="Queued repeats of one arrow per client before the coalescer drops more (0 for no limit)")
+    parser.add_argument('--max-age-ms', type=float, default=0,
+                        help="Age after which queued commands expire (0 for never)")
+    parser.add_argument('--pointer-jitter-ms', type=float, default=30, help="Pointer playout delay")
+    parser.add_argument('--no-metrics', action='store_true', help="Disable server metrics collection")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', metavar='PATH', help="Also write the results as JSON")
+    parser.add_argument('--codec', action='store_true',
+                        help="Check the binary codec and compare its per-request cost with JSON, then exit")
+    args = parser.parse_args()
+
+    if args.codec:
+        configure_server(args.queue_size, 'drop_oldest', not args.no_metrics)
+        run_codec_benchmark(args)
+        return
+
+    workloads = WORKLOADS if 'all' in args.workload else args.workload
+    if 'trace' in workloads and not args.trace:
+        parser.error("the trace workload needs --trace")
+    pairs = [(w, t) for w in workloads for t in args.transport if (w, t) in UNSUPPORTED]
+    if pairs and 'all' not in args.workload:
+        parser.error("the server cannot serve " + ", ".join(f"{w} over {t}" for w, t in pairs))
+    for workload, transport in pairs:
+        print(f"Skipping {workload} over {transport}: not supported by the server")
+    configure_server(args.queue_size, args.overflow, not args.no_metrics,
+                     args.repeat_backlog, args.max_age_ms, args.pointer_jitter_ms)
+
+    results = []
+    for workload in workloads:
+        for core in args.core:
+            for threads in args.threads:
+                for transport in args.transport:
+                    if (workload, transport) not in UNSUPPORTED:
+                        results.append(run_case(args, workload, core, threads, transport))
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
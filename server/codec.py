@@ -0,0 +1,280 @@
+"""
+Compact binary encoding for controller commands
+
+An alternative to JSON bodies for clients that send many tiny commands.
+A message is one or more command frames back to back; more than one frame
+makes a batch. Each frame (network byte order) is:
+
+  opcode u8 | flags u8 | [event id u32] | [sent ms u64 | max age ms u32] | payload
+
+The bracketed fields are present when FLAG_EVENT_ID and FLAG_DEADLINE are
+set. Payloads:
+
+  arrow  - direction u8 (index into DIRECTIONS)
+  key    - length u8 | UTF-8 key name
+  volume - action u8 (index into VOLUME_ACTIONS) | level u8, only for "set"
+  type   - mode u8 (index into TEXT_MODES) | length u32 | UTF-8 text
+  pointer - base time ms u64
+            | count u8 | count x (time offset ms i16 | dx i16 | dy i16)
+            | count u8 | count x (time offset ms i16 | button u8 | action u8)
+            | count u8 | count x (time offset ms i16 | dx i16 | dy i16)
+
+Pointer frames carry motion samples, button events (indexes into BUTTONS
+and BUTTON_ACTIONS) and scroll steps, timed relative to the base time.
+
+Replies are one result frame per command:
+
+  status u8 (index into RESULT_STATUSES) | length u8 | UTF-8 detail
+
+where the detail is the job id of a type command or the error message.
+Commands decode to the same dicts a JSON client would send, so both paths
+share one validation step.
+"""
+
+import struct
+
+CONTENT_TYPE = 'application/x-flow-command'
+
+OPCODES = {1: 'arrow', 2: 'key', 3: 'volume', 4: 'type', 5: 'pointer'}
+OPCODE_NUMBERS = {name: opcode for opcode, name in OPCODES.items()}
+DIRECTIONS = ('up', 'down', 'left', 'right')
+VOLUME_ACTIONS = ('up', 'down', 'mute', 'unmute', 'toggle_mute', 'set')
+# Index 0 leaves the choice to the server
+TEXT_MODES = ('auto', 'keys', 'chunked', 'clipboard')
+BUTTONS = ('left', 'right', 'middle')
+BUTTON_ACTIONS = ('click', 'down', 'up', 'double')
+RESULT_STATUSES = ('ok', 'dropped', 'expired', 'duplicate', 'error')
+
+FLAG_WAIT = 0x01
+FLAG_EVENT_ID = 0x02
+FLAG_DEADLINE = 0x04
+# Asks a persistent channel to reply with the results
+FLAG_ACK = 0x08
+
+FRAME_HEADER = struct.Struct('!BB')
+EVENT_ID = struct.Struct('!I')
+DEADLINE = struct.Struct('!QI')
+TEXT_HEADER = struct.Struct('!BI')
+RESULT_HEADER = struct.Struct('!BB')
+POINTER_BASE = struct.Struct('!Q')
+POINTER_MOTION = struct.Struct('!hhh')
+POINTER_BUTTON = struct.Struct('!hBB')
+
+class CodecError(ValueError):
+    """Raised for truncated or malformed binary messages"""
+
+def _index(table, value, field):
+    try:
+        return table.index(str(value).lower())
+    except ValueError:
+        raise CodecError(f"Invalid {field}") from None
+
+def _short_string(value, field):
+    data = str(value).encode('utf-8')
+    if len(data) > 255:
+        raise CodecError(f"{field} too long")
+    return bytes((len(data),)) + data
+
+def _offset(time_ms, base):
+    offset = int(time_ms) - base
+    if not -0x8000 <= offset < 0x8000:
+        raise CodecError("Pointer events too far apart")
+    return offset
+
+def _delta(value):
+    return max(-0x8000, min(0x7FFF, int(round(value))))
+
+def encode_pointer(command):
+    """Payload of a pointer frame"""
+    samples = command.get('samples') or []
+    buttons = command.get('buttons') or []
+    scroll = command.get('scroll') or []
+    if max(len(samples), len(buttons), len(scroll)) > 255:
+        raise CodecError("Too many pointer events")
+    times = [int(entry[0]) for entries in (samples, buttons, scroll) for entry in entries]
+    base = min(times) if times else 0
+    parts = [POINTER_BASE.pack(base), bytes((len(samples),))]
+    parts += [POINTER_MOTION.pack(_offset(t, base), _delta(dx), _delta(dy)) for t, dx, dy in samples]
+    parts.append(bytes((len(buttons),)))
+    parts += [POINTER_BUTTON.pack(_offset(t, base), _index(BUTTONS, button, 'button'),
+                                  _index(BUTTON_ACTIONS, action, 'button action'))
+              for t, button, action in buttons]
+    parts.append(bytes((len(scroll),)))
+    parts += [POINTER_MOTION.pack(_offset(t, base), _delta(dx), _delta(dy)) for t, dx, dy in scroll]
+    return b''.join(parts)
+
+def decode_pointer(data, offset=0):
+    """Decode a pointer payload, returning (fields dict, next offset)
+
+    Raises IndexError or struct.error if the payload is truncated.
+    """
+    base = POINTER_BASE.unpack_from(data, offset)[0]
+    offset += POINTER_BASE.size
+    command = {}
+    for field, layout in (('samples', POINTER_MOTION), ('buttons', POINTER_BUTTON), ('scroll', POINTER_MOTION)):
+        count = data[offset]
+        offset += 1
+        entries = []
+        for _ in range(count):
+            time_offset, first, second = layout.unpack_from(data, offset)
+            offset += layout.size
+            if layout is POINTER_BUTTON:
+                entries.append([base + time_offset, BUTTONS[first], BUTTON_ACTIONS[second]])
+            else:
+                entries.append([base + time_offset, first, second])
+        if entries:
+            command[field] = entries
+    return command, offset
+
+def encode_command(command):
+    """Encode one command dict (as sent to the JSON API) as a frame"""
+    opcode = OPCODE_NUMBERS.get(command.get('cmd'))
+    if opcode is None:
+        raise CodecError("Unknown command")
+    name = OPCODES[opcode]
+
+    flags = 0
+    extra = b''
+    if command.get('wait'):
+        flags |= FLAG_WAIT
+    if command.get('ack'):
+        flags |= FLAG_ACK
+    if command.get('event_id') is not None:
+        flags |= FLAG_EVENT_ID
+        extra += EVENT_ID.pack(int(command['event_id']))
+    if command.get('sent_ms') is not None or command.get('max_age_ms') is not None:
+        flags |= FLAG_DEADLINE
+        extra += DEADLINE.pack(int(command.get('sent_ms') or 0), int(command.get('max_age_ms') or 0))
+
+    if name == 'arrow':
+        payload = bytes((_index(DIRECTIONS, command.get('direction'), 'direction'),))
+    elif name == 'key':
+        payload = _short_string(command.get('key', ''), 'key')
+    elif name == 'volume':
+        action = _index(VOLUME_ACTIONS, command.get('action'), 'action')
+        payload = bytes((action,))
+        if VOLUME_ACTIONS[action] == 'set':
+            payload += bytes((max(0, min(100, int(command.get('level', 0)))),))
+    elif name == 'pointer':
+        payload = encode_pointer(command)
+    else:
+        text = str(command.get('text', '')).encode('utf-8')
+        mode = _index(TEXT_MODES, command.get('mode') or 'auto', 'mode')
+        payload = TEXT_HEADER.pack(mode, len(text)) + text
+    return FRAME_HEADER.pack(opcode, flags) + extra + payload
+
+def encode(commands):
+    """Encode a list of command dicts as one message"""
+    return b''.join(encode_command(command) for command in commands)
+
+def _decode_frame(data, offset):
+    """Decode the frame at offset, returning (command dict, next offset)"""
+    try:
+        opcode, flags = FRAME_HEADER.unpack_from(data, offset)
+        offset += FRAME_HEADER.size
+        name = OPCODES.get(opcode)
+        if name is None:
+            raise CodecError("Unknown opcode")
+        command = {'cmd': name}
+        if flags & FLAG_WAIT:
+            command['wait'] = True
+        if flags & FLAG_ACK:
+            command['ack'] = True
+        if flags & FLAG_EVENT_ID:
+            command['event_id'] = EVENT_ID.unpack_from(data, offset)[0]
+            offset += EVENT_ID.size
+        if flags & FLAG_DEADLINE:
+            sent_ms, max_age_ms = DEADLINE.unpack_from(data, offset)
+            offset += DEADLINE.size
+            if sent_ms:
+                command['sent_ms'] = sent_ms
+            command['max_age_ms'] = max_age_ms
+
+        if name == 'arrow':
+            command['direction'] = DIRECTIONS[data[offset]]
+            offset += 1
+        elif name == 'key':
+            length = data[offset]
+            end = offset + 1 + length
+            if end > len(data):
+                raise CodecError("Truncated key")
+            command['key'] = data[offset + 1:end].decode('utf-8')
+            offset = end
+        elif name == 'volume':
+            action = VOLUME_ACTIONS[data[offset]]
+            command['action'] = action
+            offset += 1
+            if action == 'set':
+                command['level'] = data[offset]
+                offset += 1
+        elif name == 'pointer':
+            fields, offset = decode_pointer(data, offset)
+            command.update(fields)
+        else:
+            mode, length = TEXT_HEADER.unpack_from(data, offset)
+            offset += TEXT_HEADER.size
+            end = offset + length
+            if end > len(data):
+                raise CodecError("Truncated text")
+            command['text'] = data[offset:end].decode('utf-8')
+            if mode:
+                command['mode'] = TEXT_MODES[mode]
+            offset = end
+    except (IndexError, struct.error):
+        raise CodecError("Truncated or invalid frame") from None
+    except UnicodeDecodeError:
+        raise CodecError("Invalid UTF-8") from None
+    return command, offset
+
+def decode(data, limit=None):
+    """Decode a message into a list of command dicts
+
+    Raises CodecError for malformed input, or if it holds more than
+    `limit` frames.
+    """
+    data = bytes(data)
+    commands = []
+    offset = 0
+    while offset < len(data):
+        if limit is not None and len(commands) >= limit:
+            raise CodecError("Too many commands")
+        command, offset = _decode_frame(data, offset)
+        commands.append(command)
+    if not commands:
+        raise CodecError("Empty message")
+    return commands
+
+def encode_result(result):
+    """Encode a command result dict (or {"error": ...}) as a result frame"""
+    if 'error' in result:
+        status, detail = 'error', result['error']
+    elif result.get('duplicate'):
+        status, detail = 'duplicate', ''
+    else:
+        status = result.get('status', 'ok')
+        if status not in RESULT_STATUSES:
+            status = 'ok'
+        detail = result.get('job', '')
+    detail = str(detail).encode('utf-8')[:255]
+    return RESULT_HEADER.pack(RESULT_STATUSES.index(status), len(detail)) + detail
+
+def encode_results(results):
+    return b''.join(encode_result(result) for result in results)
+
+def decode_results(data):
+    """Decode a reply into a list of (status, detail) pairs"""
+    data = bytes(data)
+    results = []
+    offset = 0
+    try:
+        while offset < len(data):
+            status, length = RESULT_HEADER.unpack_from(data, offset)
+            offset += RESULT_HEADER.size
+            end = offset + length
+            if end > len(data):
+                raise CodecError("Truncated result")
+            results.append((RESULT_STATUSES[status], data[offset:end].decode('utf-8')))
+            offset = end
+    except (IndexError, struct.error, UnicodeDecodeError):
+        raise CodecError("Truncated or invalid result") from None
+    return results
@@ -0,0 +1,2 @@
+# test_server.py is a manual script that needs a running server
+collect_ignore = ['test_server.py']
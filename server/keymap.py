@@ -0,0 +1,88 @@
+"""
+Key names, aliases and chord parsing for the /key command
+
+Every key pynput knows as a `Key` member, plus single characters, resolves
+through KEYMAP, a table built once at import (pynput itself is not needed).
+A chord joins keys with '+' and is pressed in order, then released in
+reverse: 'ctrl+shift+t', 'alt+tab', 'f5'. A shortcut is one or more chords
+separated by spaces, injected one after another: 'ctrl+k ctrl+c'.
+
+Parsing is cached per distinct string, so a client sending the same
+shortcut again costs one dict lookup.
+"""
+
+import functools
+
+# pynput.keyboard.Key members
+KEY_NAMES = (
+    'alt', 'alt_l', 'alt_r', 'alt_gr', 'backspace', 'caps_lock', 'cmd', 'cmd_l', 'cmd_r',
+    'ctrl', 'ctrl_l', 'ctrl_r', 'delete', 'down', 'end', 'enter', 'esc', 'home', 'insert',
+    'left', 'menu', 'num_lock', 'page_down', 'page_up', 'pause', 'print_screen', 'right',
+    'scroll_lock', 'shift', 'shift_l', 'shift_r', 'space', 'tab', 'up',
+    'media_play_pause', 'media_volume_mute', 'media_volume_down', 'media_volume_up',
+    'media_previous', 'media_next',
+) + tuple(f'f{n}' for n in range(1, 21))
+
+MODIFIERS = frozenset((
+    'alt', 'alt_l', 'alt_r', 'alt_gr', 'cmd', 'cmd_l', 'cmd_r',
+    'ctrl', 'ctrl_l', 'ctrl_r', 'shift', 'shift_l', 'shift_r',
+))
+
+ALIASES = {
+    'escape': 'esc', 'return': 'enter', 'del': 'delete', 'ins': 'insert',
+    'control': 'ctrl', 'option': 'alt', 'altgr': 'alt_gr',
+    'win': 'cmd', 'windows': 'cmd', 'super': 'cmd', 'meta': 'cmd', 'command': 'cmd',
+    'pgup': 'page_up', 'pageup': 'page_up', 'pgdn': 'page_down', 'pagedown': 'page_down',
+    'prtsc': 'print_screen', 'printscreen': 'print_screen', 'capslock': 'caps_lock',
+    'arrow_up': 'up', 'arrow_down': 'down', 'arrow_left': 'left', 'arrow_right': 'right',
+    'volume_up': 'media_volume_up', 'volume_down': 'media_volume_down', 'mute': 'media_volume_mute',
+    'play_pause': 'media_play_pause', 'next': 'media_next', 'previous': 'media_previous',
+    'prev': 'media_previous', 'plus': '+', 'minus': '-',
+}
+
+# Any accepted name, alias or printable character -> the name the input backends use
+KEYMAP = {name: name for name in KEY_NAMES}
+KEYMAP.update(ALIASES)
+KEYMAP.update((chr(code), chr(code)) for code in range(33, 127))
+
+# Upper bounds that keep a single request from holding keys down for long
+MAX_CHORD_KEYS = 8
+MAX_SHORTCUT_CHORDS = 8
+
+class KeymapError(ValueError):
+    """Raised for unknown key names and malformed chords"""
+
+def resolve(name):
+    """Backend name of a single key"""
+    key = KEYMAP.get(name)
+    if key is None:
+        key = KEYMAP.get(name.lower())
+    if key is None:
+        raise KeymapError(f"Unsupported key: {name}")
+    return key
+
+def _parse_chord(text):
+    if text == '+':
+        return ('+',)
+    parts = text.split('+')
+    if '' in parts or len(parts) > MAX_CHORD_KEYS:
+        raise KeymapError(f"Invalid chord: {text}")
+    keys = tuple(resolve(part) for part in parts)
+    if len(keys) > 1:
+        # Shift is explicit in a chord, so ctrl+T means ctrl+t
+        keys = tuple(key.lower() if len(key) == 1 else key for key in keys)
+        if len(set(keys)) != len(keys):
+            raise KeymapError(f"Repeated key in chord: {text}")
+    return keys
+
+@functools.lru_cache(maxsize=1024)
+def parse_shortcut(text):
+    """Parse 'ctrl+shift+t' or 'ctrl+k ctrl+c' into a tuple of key tuples"""
+    chords = text.split()
+    if not chords or len(chords) > MAX_SHORTCUT_CHORDS:
+        raise KeymapError(f"Invalid shortcut: {text!r}")
+    return tuple(_parse_chord(chord) for chord in chords)
+
+def format_shortcut(chords):
+    """The canonical string for parsed chords"""
+    return ' '.join('+'.join(chord) for chord in chords)
@@ -4,191 +4,1465 @@ Android PC Controller Server
 Cross-platform server for receiving remote control commands from Android app
 """
 
+import time
+
+# Start of the startup clock, reported by main() and /metrics
+IMPORT_STARTED = time.perf_counter()
+
 import json
 import os
 import sys
-import time
 import threading
 import subprocess
 import re
-from flask import Flask, request, jsonify
-from pynput import keyboard
-from pynput.keyboard import Key, Listener
+import collections
+import queue
+import base64
+import hashlib
+import hmac
+import http.client
+import ipaddress
+import socket
+import socketserver
+import struct
+import bisect
+import math
+import secrets
+import shutil
+import io
+import mmap
+import types
+import argparse
+import asyncio
+import concurrent.futures
+from urllib.parse import urlsplit, parse_qs, unquote_to_bytes
+from flask import Flask, Response, request, jsonify
 import platform
-import qrcode
 
-# Platform-specific imports
-if platform.system() == "Windows":
-    try:
-        from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
-        from ctypes import cast, POINTER
-        from comtypes import CLSCTX_ALL, CoInitialize, CoUninitialize
-        WINDOWS_AUDIO = True
-    except ImportError:
-        WINDOWS_AUDIO = False
-        print("Warning: Windows audio control not available")
-elif platform.system() == "Linux":
-    import subprocess
-    LINUX_AUDIO = True
-else:
+import codec
+import keymap
+
+# qrcode, pynput and the Windows audio modules are slow to import, so they
+# are loaded when first needed rather than here
+if platform.system() not in ("Windows", "Linux"):
     print(f"Warning: Unsupported platform {platform.system()}")
-    WINDOWS_AUDIO = False
-    LINUX_AUDIO = False
 
 app = Flask(__name__)
 
-# Global configuration
+# Global configuration: an immutable snapshot, replaced wholesale on reload
+# so request handlers can read it without locking
 config = {}
-keyboard_controller = keyboard.Controller()
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.json')
+
+# Upper bound on commands accepted in a single /batch request
+MAX_BATCH_COMMANDS = 100
+
+def _choice(*values):
+    def check(value):
+        if value not in values:
+            return f"must be one of {', '.join(values)}"
+    return check
+
+def _number(low, high=None, integer=False):
+    def check(value):
+        kinds = (int,) if integer else (int, float)
+        if isinstance(value, bool) or not isinstance(value, kinds):
+            return "must be an integer" if integer else "must be a number"
+        if value < low or (high is not None and value > high):
+            return f"must be between {low} and {high}" if high is not None else f"must be at least {low}"
+    return check
+
+_port = _number(1, 65535, integer=True)
+
+def _ip_address(value):
+    try:
+        ipaddress.IPv4Address(value)
+    except (ipaddress.AddressValueError, TypeError):
+        return "must be an IPv4 address"
+
+def _shortcut_map(value):
+    if not isinstance(value, dict):
+        return "must be an object mapping names to chords"
+    for name, chord in value.items():
+        if not isinstance(chord, str):
+            return f"entry '{name}' must be a chord string"
+        try:
+            keymap.parse_shortcut(chord)
+        except keymap.KeymapError as e:
+            return f"entry '{name}' is invalid ({e})"
+
+def _target_map(value):
+    if not isinstance(value, dict):
+        return "must be an object mapping target ids to {\"url\": ..., \"token\": ...}"
+    for target_id, entry in value.items():
+        if target_id in HUB_RESERVED or ',' in target_id:
+            return f"target id '{target_id}' is reserved or contains a comma"
+        if not isinstance(entry, dict) or not isinstance(entry.get('url'), str):
+            return f"target '{target_id}' needs a url"
+        if urlsplit(entry['url']).scheme not in ('http', 'https') or not urlsplit(entry['url']).hostname:
+            return f"target '{target_id}' url must be http:// or https://"
+        if not isinstance(entry.get('token', ''), str):
+            return f"target '{target_id}' token must be a string"
+
+# Known settings: a type, a check returning an error message, or a section
+CONFIG_SCHEMA = {
+    'api_token': str,
+    'host': str,
+    'port': _port,
+    'input_backend': _choice('pynput', 'uinput', 'recording'),
+    'audio_backend': _choice('auto', 'keys', 'null'),
+    'auth': {
+        'ticket_ttl_s': _number(1),
+        'failure_burst': _number(1),
+        'failure_rate': _number(0),
+    },
+    'server': {
+        'core': _choice('waitress', 'asyncio'),
+        'threads': _number(1, 256, integer=True),
+    },
+    'websocket': {'enabled': bool, 'port': _port},
+    'udp': {
+        'enabled': bool,
+        'port': _port,
+        'window': _number(1, 64, integer=True),
+        'max_age_ms': _number(1),
+    },
+    'dispatch': {
+        'queue_size': _number(1, integer=True),
+        'overflow': _choice('drop_oldest', 'coalesce', 'reject'),
+        'wait': bool,
+        'client_rate': _number(0),
+        'client_burst': _number(1),
+        'max_lease_ms': _number(0),
+    },
+    'coalesce': {
+        'event_window': _number(1, integer=True),
+        'max_repeat_backlog': _number(0, integer=True),
+        'max_age_ms': _number(0),
+    },
+    'pointer': {
+        'rate_hz': _number(10, 1000),
+        'jitter_ms': _number(0, 1000),
+        'sensitivity': _number(0.01, 100),
+        'acceleration': _number(0),
+        'max_gain': _number(1),
+    },
+    'repeat': {
+        'delay_ms': _number(0),
+        'interval_ms': _number(1),
+        'min_interval_ms': _number(1),
+        'acceleration': _number(0.1, 1.0),
+        'heartbeat_timeout_ms': _number(1),
+        'max_sessions': _number(1, integer=True),
+    },
+    'network': {'refresh_interval_s': _number(1)},
+    'hub': {
+        'enabled': bool,
+        'local': bool,
+        'default_target': str,
+        'targets': _target_map,
+        'timeout_ms': _number(1),
+        'health_interval_s': _number(0.5),
+        'connections': _number(1, 64, integer=True),
+    },
+    'announce': {
+        'enabled': bool,
+        'address': _ip_address,
+        'port': _port,
+        'repeat': _number(1, 4, integer=True),
+        'check_interval_s': _number(0.5, 60),
+    },
+    'text': {
+        'mode': _choice('auto', 'keys', 'chunked', 'clipboard'),
+        'clipboard_threshold': _number(0, integer=True),
+        'chunk_size': _number(1, integer=True),
+        'restore_delay_ms': _number(0),
+    },
+    'journal': {
+        'enabled': bool,
+        'path': str,
+        'entries': _number(16, integer=True),
+        'record_text': bool,
+    },
+    'shortcuts': _shortcut_map,
+    'metrics': {'enabled': bool},
+}
+
+def validate_config(data, schema=CONFIG_SCHEMA, prefix=''):
+    """Return a list of problems with a parsed config; unknown keys only warn"""
+    if not isinstance(data, dict):
+        return [f"{prefix.rstrip('.') or 'config'} must be an object"]
+    errors = []
+    if not prefix and not data.get('api_token'):
+        errors.append("api_token must be set")
+    for key, value in data.items():
+        name = prefix + key
+        rule = schema.get(key)
+        if rule is None:
+            print(f"Warning: unknown config setting '{name}'")
+        elif isinstance(rule, dict):
+            errors.extend(validate_config(value, rule, name + '.'))
+        elif isinstance(rule, type):
+            if not isinstance(value, rule):
+                errors.append(f"{name} must be a {rule.__name__}")
+        else:
+            problem = rule(value)
+            if problem:
+                errors.append(f"{name} {problem}")
+    return errors
+
+def freeze_config(value):
+    """Deep read-only copy of parsed JSON"""
+    if isinstance(value, dict):
+        return types.MappingProxyType({k: freeze_config(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze_config(v) for v in value)
+    return value
+
+def read_config():
+    """Parse and validate config.json; returns (snapshot, errors)"""
+    with open(CONFIG_PATH, 'r') as f:
+        data = json.load(f)
+    errors = validate_config(data)
+    return (None if errors else freeze_config(data)), errors
 
 def load_config():
     """Load configuration from config.json"""
     global config
-    config_path = os.path.join(os.path.dirname(__file__), 'config.json')
     try:
-        with open(config_path, 'r') as f:
-            config = json.load(f)
+        snapshot, errors = read_config()
     except FileNotFoundError:
-        print(f"Config file not found at {config_path}")
+        print(f"Config file not found at {CONFIG_PATH}")
         print("Please create config.json with your API token")
         sys.exit(1)
     except json.JSONDecodeError:
         print("Invalid JSON in config.json")
         sys.exit(1)
+    if errors:
+        for error in errors:
+            print(f"Invalid config: {error}")
+        sys.exit(1)
+    config = snapshot
 
-def authenticate_request():
-    """Check if request has valid authentication"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
+def reload_config():
+    """Re-read config.json and apply it to the running server"""
+    global config
+    try:
+        snapshot, errors = read_config()
+    except (OSError, ValueError) as e:
+        print(f"Config reload failed, keeping the current settings: {e}")
         return False
-    
-    if not auth_header.startswith('Bearer '):
+    if errors:
+        for error in errors:
+            print(f"Invalid config: {error}")
+        print("Config reload rejected, keeping the current settings")
         return False
+    if snapshot == config:
+        return False
+    previous, config = config, snapshot
+    try:
+        configure_runtime(previous)
+        listeners.update()
+    except Exception as e:
+        print(f"Error applying config: {e}")
+    print("Config reloaded")
+    if any(previous.get(k) != config.get(k) for k in ('api_token', 'host', 'port')):
+        generate_config_qr()
+    return True
+
+class ConfigWatcher:
+    """Reloads config.json when it changes: inotify on Linux, polling elsewhere"""
+    
+    POLL_INTERVAL = 1.0
+    # Editors write in several steps; wait for the file to settle
+    SETTLE_DELAY = 0.1
+    
+    # inotify(7) event masks
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    
+    def __init__(self, path):
+        self.path = path
+        self.thread = None
+    
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='config-watch', daemon=True)
+            self.thread.start()
+    
+    def _run(self):
+        fd = self._inotify() if platform.system() == "Linux" else None
+        if fd is not None:
+            self._watch_inotify(fd)
+        else:
+            self._watch_polling()
+    
+    def _inotify(self):
+        """Watch the config directory (editors often replace the file)"""
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+            directory = os.path.dirname(os.path.abspath(self.path))
+            if libc.inotify_add_watch(fd, directory.encode(), mask) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+    
+    def _watch_inotify(self, fd):
+        name = os.path.basename(self.path).encode()
+        header = struct.Struct('iIII')  # wd, mask, cookie, name length
+        while True:
+            data = os.read(fd, 4096)
+            offset, changed = 0, False
+            while offset + header.size <= len(data):
+                _, _, _, length = header.unpack_from(data, offset)
+                event_name = data[offset + header.size:offset + header.size + length].rstrip(b'\0')
+                changed = changed or event_name == name
+                offset += header.size + length
+            if changed:
+                time.sleep(self.SETTLE_DELAY)
+                reload_config()
+    
+    def _watch_polling(self):
+        stamp = self._stamp()
+        while True:
+            time.sleep(self.POLL_INTERVAL)
+            current = self._stamp()
+            if current != stamp:
+                stamp = current
+                time.sleep(self.SETTLE_DELAY)
+                reload_config()
+    
+    def _stamp(self):
+        try:
+            info = os.stat(self.path)
+            return info.st_mtime_ns, info.st_size
+        except OSError:
+            return None
+
+config_watcher = ConfigWatcher(CONFIG_PATH)
+
+# Metrics
+
+# Histogram bucket upper bounds in seconds, shared by every latency histogram
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
+
+class Histogram:
+    """Fixed-bucket latency histogram; observing allocates nothing new"""
+    __slots__ = ('counts', 'total', 'count', 'lock')
+    
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+    
+    def observe(self, seconds):
+        index = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.total += seconds
+            self.count += 1
+    
+    def render(self, name, labels, lines):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_sum{{{labels}}} {self.total:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+
+class Metrics:
+    """Prometheus-style counters and latency histograms
+    
+    Every counter and histogram is created up front, so recording a
+    sample is a dict lookup plus an increment. Disabling metrics turns
+    every recording call into an early return.
+    """
+    
+    STAGES = ('auth', 'parse', 'queue_wait', 'injection', 'audio')
+    ERRORS = ('auth_failed', 'auth_limited', 'bad_request', 'queue_full', 'rate_limited',
+              'lease_held', 'injection_failed', 'not_found', 'internal_error', 'udp_stale', 'udp_replayed')
+    FALLBACKS = ('pactl', 'media_keys')
+    COALESCED = ('duplicate', 'backlog', 'expired')
+    
+    def __init__(self):
+        self.enabled = True
+        self.stages = {stage: Histogram() for stage in self.STAGES}
+        self.errors = dict.fromkeys(self.ERRORS, 0)
+        self.fallbacks = dict.fromkeys(self.FALLBACKS, 0)
+        self.coalesced_counts = dict.fromkeys(self.COALESCED, 0)
+        self.requests = {}
+        self.request_latency = {}
+        # Seconds from import to each startup milestone; always recorded
+        self.startup = {}
+    
+    def mark_startup(self, phase):
+        seconds = time.perf_counter() - IMPORT_STARTED
+        self.startup.setdefault(phase, seconds)
+        return seconds
+    
+    def register_endpoints(self, endpoints):
+        """Preallocate per-endpoint counters"""
+        for endpoint in endpoints:
+            self.requests.setdefault(endpoint, 0)
+            self.request_latency.setdefault(endpoint, Histogram())
+    
+    def observe(self, stage, seconds):
+        if self.enabled:
+            self.stages[stage].observe(seconds)
     
-    token = auth_header[7:]  # Remove 'Bearer ' prefix
-    return token == config.get('api_token')
+    def observe_request(self, endpoint, seconds):
+        if self.enabled and endpoint in self.requests:
+            self.requests[endpoint] += 1
+            self.request_latency[endpoint].observe(seconds)
+    
+    def error(self, kind):
+        if self.enabled:
+            self.errors[kind] += 1
+    
+    def fallback(self, kind):
+        if self.enabled:
+            self.fallbacks[kind] += 1
+    
+    def coalesced(self, kind):
+        if self.enabled:
+            self.coalesced_counts[kind] += 1
+    
+    def render(self):
+        """Metrics in the Prometheus text exposition format"""
+        lines = [
+            '# HELP flow_requests_total Requests handled per endpoint',
+            '# TYPE flow_requests_total counter',
+        ]
+        for endpoint, count in self.requests.items():
+            lines.append(f'flow_requests_total{{endpoint="{endpoint}"}} {count}')
+        
+        lines.append('# HELP flow_request_seconds Request handling time per endpoint')
+        lines.append('# TYPE flow_request_seconds histogram')
+        for endpoint, histogram in self.request_latency.items():
+            histogram.render('flow_request_seconds', f'endpoint="{endpoint}"', lines)
+        
+        lines.append('# HELP flow_stage_seconds Time spent per processing stage')
+        lines.append('# TYPE flow_stage_seconds histogram')
+        for stage, histogram in self.stages.items():
+            histogram.render('flow_stage_seconds', f'stage="{stage}"', lines)
+        
+        lines.append('# HELP flow_dispatch_queue_depth Commands waiting to be injected')
+        lines.append('# TYPE flow_dispatch_queue_depth gauge')
+        lines.append(f'flow_dispatch_queue_depth {dispatcher.depth}')
+        
+        lines.append('# HELP flow_volume_fallbacks_total Volume changes served by a fallback path')
+        lines.append('# TYPE flow_volume_fallbacks_total counter')
+        for kind, count in self.fallbacks.items():
+            lines.append(f'flow_volume_fallbacks_total{{kind="{kind}"}} {count}')
+        
+        lines.append('# HELP flow_coalesced_total Commands answered without being injected')
+        lines.append('# TYPE flow_coalesced_total counter')
+        for kind, count in self.coalesced_counts.items():
+            lines.append(f'flow_coalesced_total{{kind="{kind}"}} {count}')
+        
+        lines.append('# HELP flow_startup_seconds Time from import to each startup milestone')
+        lines.append('# TYPE flow_startup_seconds gauge')
+        for phase, seconds in self.startup.items():
+            lines.append(f'flow_startup_seconds{{phase="{phase}"}} {seconds:.6f}')
+        
+        lines.append('# HELP flow_errors_total Failures, including those answered with an empty 204')
+        lines.append('# TYPE flow_errors_total counter')
+        for kind, count in self.errors.items():
+            lines.append(f'flow_errors_total{{kind="{kind}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+class Authenticator:
+    """Token checks against state precomputed when the config is loaded
+    
+    Bearer tokens are compared in constant time. Clients that send many
+    requests can trade the token for a short-lived session ticket
+    (POST /auth/ticket, then `X-Ticket: <ticket>`). Failed attempts drain a
+    per-address token bucket; once it is empty, requests from that address
+    are dropped before any token is looked at.
+    """
+    
+    MAX_TICKETS = 1024
+    MAX_BUCKETS = 4096
+    
+    def __init__(self):
+        self.token = None
+        self.bearer = None
+        self.ticket_ttl = 300.0
+        self.failure_burst = 10.0
+        self.failure_rate = 0.5
+        self.tickets = {}
+        self.buckets = collections.OrderedDict()
+        self.lock = threading.Lock()
+    
+    def configure(self, api_token, auth_config):
+        token = api_token.encode('utf-8') if api_token else None
+        if token != self.token:
+            self.tickets = {}
+        self.token = token
+        self.bearer = b'Bearer ' + token if token else None
+        self.ticket_ttl = float(auth_config.get('ticket_ttl_s', self.ticket_ttl))
+        self.failure_burst = float(auth_config.get('failure_burst', self.failure_burst))
+        self.failure_rate = float(auth_config.get('failure_rate', self.failure_rate))
+    
+    def check_token(self, token):
+        """Check a bare token, e.g. from a WebSocket handshake"""
+        if not token or self.token is None:
+            return False
+        return hmac.compare_digest(token.encode('utf-8'), self.token)
+    
+    def check_header(self, header):
+        """Check a raw Authorization header value"""
+        if not header or self.bearer is None:
+            return False
+        return hmac.compare_digest(header.encode('latin-1'), self.bearer)
+    
+    def issue_ticket(self):
+        now = time.monotonic()
+        with self.lock:
+            if len(self.tickets) >= self.MAX_TICKETS:
+                self.tickets = {t: exp for t, exp in self.tickets.items() if exp > now}
+                while len(self.tickets) >= self.MAX_TICKETS:
+                    del self.tickets[next(iter(self.tickets))]
+            ticket = secrets.token_urlsafe(24)
+            self.tickets[ticket] = now + self.ticket_ttl
+        return ticket
+    
+    def check_ticket(self, ticket):
+        expires = self.tickets.get(ticket)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            self.tickets.pop(ticket, None)
+            return False
+        return True
+    
+    def allow(self, address):
+        """False while the address has used up its failed attempts"""
+        bucket = self.buckets.get(address)
+        if bucket is None:
+            return True
+        with self.lock:
+            self._refill(bucket)
+            return bucket[0] >= 1.0
+    
+    def failed(self, address):
+        """Charge one failed attempt to the address"""
+        with self.lock:
+            bucket = self.buckets.get(address)
+            if bucket is None:
+                bucket = self.buckets[address] = [self.failure_burst, time.monotonic()]
+                if len(self.buckets) > self.MAX_BUCKETS:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(address)
+                self._refill(bucket)
+            bucket[0] = max(bucket[0] - 1.0, 0.0)
+    
+    def _refill(self, bucket):
+        now = time.monotonic()
+        bucket[0] = min(self.failure_burst, bucket[0] + (now - bucket[1]) * self.failure_rate)
+        bucket[1] = now
+
+authenticator = Authenticator()
+
+def authenticate_request():
+    """Check if request has valid authentication"""
+    # Read the WSGI environ directly rather than building request.headers
+    environ = request.environ
+    ticket = environ.get('HTTP_X_TICKET')
+    if ticket is not None:
+        return authenticator.check_ticket(ticket)
+    return authenticator.check_header(environ.get('HTTP_AUTHORIZATION'))
+
+def authorize(check):
+    """Run an auth check for the current request under the failure rate limit"""
+    start = time.perf_counter()
+    address = request.remote_addr
+    if not authenticator.allow(address):
+        metrics.error('auth_limited')
+        return False
+    authenticated = check()
+    metrics.observe('auth', time.perf_counter() - start)
+    if not authenticated:
+        authenticator.failed(address)
+        metrics.error('auth_failed')
+    return authenticated
 
 def require_auth(f):
     """Decorator to require authentication"""
     def decorated_function(*args, **kwargs):
-        if not authenticate_request():
+        if not authorize(authenticate_request):
             # Drop the request silently as per requirements
             return '', 204
         return f(*args, **kwargs)
     decorated_function.__name__ = f.__name__
     return decorated_function
 
+# Input backends
+#
+# Keys are named the way pynput names them ('up', 'enter', 'esc',
+# 'media_volume_up', 'ctrl', ...) or given as single characters. Mouse
+# buttons are 'left', 'right' and 'middle'; scrolling up is a positive dy.
+
+class PynputInputBackend:
+    """Key injection through pynput (X11/Windows/macOS), the default"""
+    
+    name = 'pynput'
+    
+    def __init__(self):
+        self._controller = None
+        self._mouse = None
+        self._keys = {}
+        self._lock = threading.Lock()
+    
+    def open(self):
+        # pynput connects to the display server on import, so defer it
+        with self._lock:
+            if self._controller is not None:
+                return
+            from pynput import keyboard, mouse
+            self._key_class = keyboard.Key
+            self._button_class = mouse.Button
+            self._mouse = mouse.Controller()
+            self._controller = keyboard.Controller()
+    
+    def _resolve(self, key):
+        resolved = self._keys.get(key)
+        if resolved is None:
+            resolved = key if len(key) == 1 else getattr(self._key_class, key)
+            self._keys[key] = resolved
+        return resolved
+    
+    def press(self, key):
+        if self._controller is None:
+            self.open()
+        self._controller.press(self._resolve(key))
+    
+    def release(self, key):
+        if self._controller is None:
+            self.open()
+        self._controller.release(self._resolve(key))
+    
+    def tap(self, key):
+        self.press(key)
+        self.release(key)
+    
+    def chord(self, keys):
+        """Press keys in order and release them in reverse, even if a press fails"""
+        pressed = []
+        try:
+            for key in keys:
+                self.press(key)
+                pressed.append(key)
+        finally:
+            for key in reversed(pressed):
+                self.release(key)
+    
+    def type(self, text):
+        if self._controller is None:
+            self.open()
+        self._controller.type(text)
+    
+    def move(self, dx, dy):
+        if self._controller is None:
+            self.open()
+        self._mouse.move(dx, dy)
+    
+    def button(self, button, pressed):
+        if self._controller is None:
+            self.open()
+        if pressed:
+            self._mouse.press(getattr(self._button_class, button))
+        else:
+            self._mouse.release(getattr(self._button_class, button))
+    
+    def scroll(self, dx, dy):
+        if self._controller is None:
+            self.open()
+        self._mouse.scroll(dx, dy)
+    
+    def close(self):
+        self._controller = None
+        self._mouse = None
+
+# Linux input event codes (linux/input-event-codes.h)
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_REL = 0x02
+SYN_REPORT = 0
+REL_X = 0x00
+REL_Y = 0x01
+REL_HWHEEL = 0x06
+REL_WHEEL = 0x08
+
+UINPUT_BUTTONS = {'left': 0x110, 'right': 0x111, 'middle': 0x112}
+
+UINPUT_KEYS = {
+    'esc': 1, 'backspace': 14, 'tab': 15, 'enter': 28, 'ctrl': 29, 'ctrl_l': 29,
+    'shift': 42, 'shift_l': 42, 'shift_r': 54, 'alt': 56, 'alt_l': 56, 'space': 57,
+    'caps_lock': 58, 'f1': 59, 'f2': 60, 'f3': 61, 'f4': 62, 'f5': 63, 'f6': 64,
+    'f7': 65, 'f8': 66, 'f9': 67, 'f10': 68, 'num_lock': 69, 'scroll_lock': 70,
+    'f11': 87, 'f12': 88, 'ctrl_r': 97, 'print_screen': 99, 'alt_r': 100, 'alt_gr': 100,
+    'home': 102, 'up': 103, 'page_up': 104, 'left': 105, 'right': 106, 'end': 107,
+    'down': 108, 'page_down': 109, 'insert': 110, 'delete': 111,
+    'media_volume_mute': 113, 'media_volume_down': 114, 'media_volume_up': 115,
+    'pause': 119, 'cmd': 125, 'cmd_l': 125, 'cmd_r': 126, 'menu': 127,
+    'media_next': 163, 'media_play_pause': 164, 'media_previous': 165,
+    'f13': 183, 'f14': 184, 'f15': 185, 'f16': 186, 'f17': 187, 'f18': 188, 'f19': 189, 'f20': 190,
+}
+
+# Characters on a US keyboard layout: char -> (code, needs shift)
+UINPUT_CHARS = {}
+for _row, _codes in (('1234567890-=', range(2, 14)), ('qwertyuiop[]', range(16, 28)),
+                     ("asdfghjkl;'`", range(30, 42)), ('\\zxcvbnm,./', [43] + list(range(44, 54)))):
+    for _char, _code in zip(_row, _codes):
+        UINPUT_CHARS[_char] = (_code, False)
+for _row, _shifted in (('1234567890-=', '!@#$%^&*()_+'), ('[];\'`\\,./', '{}:"~|<>?')):
+    for _char, _shift_char in zip(_row, _shifted):
+        UINPUT_CHARS[_shift_char] = (UINPUT_CHARS[_char][0], True)
+for _char in 'abcdefghijklmnopqrstuvwxyz':
+    UINPUT_CHARS[_char.upper()] = (UINPUT_CHARS[_char][0], True)
+UINPUT_CHARS.update({' ': (57, False), '\n': (28, False), '\t': (15, False)})
+
+class UinputInputBackend:
+    """Linux /dev/uinput virtual keyboard and relative pointer
+    
+    Works under X11 and Wayland alike. Each key tap, run of typed text or
+    pointer move is written to the device as one batch of input_event
+    structs in a single write() call, which costs microseconds instead of
+    an X round trip per event. Text is typed assuming a US keyboard layout.
+    """
+    
+    name = 'uinput'
+    
+    # ioctl requests from linux/uinput.h
+    UI_SET_EVBIT = 0x40045564
+    UI_SET_KEYBIT = 0x40045565
+    UI_SET_RELBIT = 0x40045566
+    UI_DEV_SETUP = 0x405C5503
+    UI_DEV_CREATE = 0x5501
+    UI_DEV_DESTROY = 0x5502
+    BUS_VIRTUAL = 0x06
+    EVENT_FORMAT = 'llHHi'
+    TYPE_BATCH = 32
+    
+    def __init__(self, device='/dev/uinput'):
+        self.device = device
+        self._fd = None
+        self._lock = threading.Lock()
+        self._shift = UINPUT_KEYS['shift']
+        self._syn = struct.pack(self.EVENT_FORMAT, 0, 0, EV_SYN, SYN_REPORT, 0)
+    
+    def open(self):
+        import fcntl
+        fd = os.open(self.device, os.O_WRONLY | os.O_NONBLOCK)
+        try:
+            fcntl.ioctl(fd, self.UI_SET_EVBIT, EV_SYN)
+            fcntl.ioctl(fd, self.UI_SET_EVBIT, EV_KEY)
+            fcntl.ioctl(fd, self.UI_SET_EVBIT, EV_REL)
+            keys = set(UINPUT_KEYS.values()) | {c for c, _ in UINPUT_CHARS.values()}
+            for code in sorted(keys | set(UINPUT_BUTTONS.values())):
+                fcntl.ioctl(fd, self.UI_SET_KEYBIT, code)
+            for code in (REL_X, REL_Y, REL_HWHEEL, REL_WHEEL):
+                fcntl.ioctl(fd, self.UI_SET_RELBIT, code)
+            # struct uinput_setup: input_id, name[80], ff_effects_max
+            setup = struct.pack('HHHH80sI', self.BUS_VIRTUAL, 0x1209, 0xF10C, 1,
+                                b'Flow Controller Keyboard', 0)
+            fcntl.ioctl(fd, self.UI_DEV_SETUP, setup)
+            fcntl.ioctl(fd, self.UI_DEV_CREATE)
+        except OSError:
+            os.close(fd)
+            raise
+        self._fd = fd
+        # Give udev and the compositor a moment to pick up the new device
+        time.sleep(0.2)
+    
+    def _event(self, code, value):
+        return struct.pack(self.EVENT_FORMAT, 0, 0, EV_KEY, code, value) + self._syn
+    
+    def _relative(self, pairs):
+        """One report moving the given (axis, value) pairs together"""
+        return b''.join(struct.pack(self.EVENT_FORMAT, 0, 0, EV_REL, axis, value)
+                        for axis, value in pairs if value) + self._syn
+    
+    def _code(self, key):
+        """(key code, whether shift is needed) for a key name or character"""
+        code = UINPUT_KEYS.get(key)
+        if code is not None:
+            return code, False
+        char = UINPUT_CHARS.get(key)
+        if char is None:
+            raise ValueError(f"Key not supported by uinput backend: {key}")
+        return char
+    
+    def _down(self, code, shift):
+        return (self._event(self._shift, 1) if shift else b'') + self._event(code, 1)
+    
+    def _up(self, code, shift):
+        return self._event(code, 0) + (self._event(self._shift, 0) if shift else b'')
+    
+    def _write(self, events):
+        with self._lock:
+            if self._fd is None:
+                self.open()
+            os.write(self._fd, events)
+    
+    # Shifted characters ('A', '!') are wrapped in shift, as pynput does
+    
+    def press(self, key):
+        self._write(self._down(*self._code(key)))
+    
+    def release(self, key):
+        self._write(self._up(*self._code(key)))
+    
+    def tap(self, key):
+        code = self._code(key)
+        self._write(self._down(*code) + self._up(*code))
+    
+    def chord(self, keys):
+        # Every code is looked up before anything is written, and presses and
+        # releases go out in one write, so no key can be left held down
+        codes = [self._code(key) for key in keys]
+        if any(code == self._shift for code, _ in codes):
+            # Shift is already held for the whole chord
+            codes = [(code, False) for code, _ in codes]
+        self._write(b''.join(self._down(*code) for code in codes)
+                    + b''.join(self._up(*code) for code in reversed(codes)))
+    
+    def type(self, text):
+        # Write in batches so the evdev client buffers never overflow
+        for start in range(0, len(text), self.TYPE_BATCH):
+            events = []
+            for char in text[start:start + self.TYPE_BATCH]:
+                mapping = UINPUT_CHARS.get(char)
+                if mapping is None:
+                    print(f"Warning: uinput backend cannot type {char!r}, skipped")
+                    continue
+                code, shift = mapping
+                if shift:
+                    events.append(self._event(self._shift, 1))
+                events.append(self._event(code, 1) + self._event(code, 0))
+                if shift:
+                    events.append(self._event(self._shift, 0))
+            if events:
+                self._write(b''.join(events))
+    
+    def move(self, dx, dy):
+        self._write(self._relative(((REL_X, dx), (REL_Y, dy))))
+    
+    def button(self, button, pressed):
+        self._write(self._event(UINPUT_BUTTONS[button], 1 if pressed else 0))
+    
+    def scroll(self, dx, dy):
+        self._write(self._relative(((REL_HWHEEL, dx), (REL_WHEEL, dy))))
+    
+    def close(self):
+        import fcntl
+        with self._lock:
+            if self._fd is not None:
+                try:
+                    fcntl.ioctl(self._fd, self.UI_DEV_DESTROY)
+                finally:
+                    os.close(self._fd)
+                    self._fd = None
+
+class RecordingInputBackend:
+    """Records injected events instead of sending them, for tests and benchmarks"""
+    
+    name = 'recording'
+    
+    def __init__(self, max_events=10000):
+        self.events = collections.deque(maxlen=max_events)
+    
+    def open(self):
+        pass
+    
+    def press(self, key):
+        self.events.append(('press', key))
+    
+    def release(self, key):
+        self.events.append(('release', key))
+    
+    def tap(self, key):
+        self.events.append(('tap', key))
+    
+    def chord(self, keys):
+        self.events.append(('chord', tuple(keys)))
+    
+    def type(self, text):
+        self.events.append(('type', text))
+    
+    def move(self, dx, dy):
+        self.events.append(('move', dx, dy))
+    
+    def button(self, button, pressed):
+        self.events.append(('button', button, pressed))
+    
+    def scroll(self, dx, dy):
+        self.events.append(('scroll', dx, dy))
+    
+    def close(self):
+        pass
+
+INPUT_BACKENDS = {
+    'pynput': PynputInputBackend,
+    'uinput': UinputInputBackend,
+    'recording': RecordingInputBackend,
+}
+
+# Active input backend; main() replaces it according to config.json
+input_backend = PynputInputBackend()
+
+def set_input_backend(name, lazy=False):
+    """Switch the active input backend, falling back to pynput if it fails
+    
+    With lazy=True pynput is left to open on first use, since importing it
+    can take a while; the other backends always open right away.
+    """
+    global input_backend
+    backend_class = INPUT_BACKENDS.get(name)
+    if backend_class is None:
+        print(f"Warning: unknown input backend '{name}', using pynput")
+        backend_class = PynputInputBackend
+    backend = backend_class()
+    try:
+        if not (lazy and backend_class is PynputInputBackend):
+            backend.open()
+    except Exception as e:
+        if backend_class is PynputInputBackend:
+            raise
+        print(f"Input backend '{name}' unavailable, using pynput: {e}")
+        backend = PynputInputBackend()
+    previous, input_backend = input_backend, backend
+    if previous is not backend:
+        previous.close()
+    return backend
+
+class VolumeUnsupportedError(Exception):
+    """Raised when the audio backend cannot read or set absolute volume"""
+
+class KeyboardAudioBackend:
+    """Volume control through the media keys, used when nothing else works"""
+    
+    def open(self):
+        pass
+    
+    def change(self, steps):
+        metrics.fallback('media_keys')
+        key = 'media_volume_up' if steps > 0 else 'media_volume_down'
+        for _ in range(abs(steps)):
+            input_backend.tap(key)
+    
+    def get(self):
+        raise VolumeUnsupportedError("Volume readback not available")
+    
+    def set(self, level):
+        raise VolumeUnsupportedError("Absolute volume not available")
+    
+    def set_mute(self, muted):
+        # The mute key only toggles and the state cannot be read back
+        if muted != 'toggle':
+            raise VolumeUnsupportedError("Mute state not available, only toggle_mute")
+        input_backend.tap('media_volume_mute')
+    
+    def monitor_command(self):
+        return None
+    
+    def close(self):
+        pass
+
+class NullAudioBackend:
+    """In-memory volume that touches no audio device, for tests and benchmarks"""
+    
+    STEP = 5
+    
+    def __init__(self):
+        self.level = 50
+        self.muted = False
+    
+    def open(self):
+        pass
+    
+    def change(self, steps):
+        self.level = min(100, max(0, self.level + steps * self.STEP))
+    
+    def get(self):
+        return self.level, self.muted
+    
+    def set(self, level):
+        self.level = level
+    
+    def set_mute(self, muted):
+        self.muted = not self.muted if muted == 'toggle' else muted
+    
+    def monitor_command(self):
+        return None
+    
+    def close(self):
+        pass
+
+class WindowsAudioBackend:
+    """Windows volume control holding one IAudioEndpointVolume interface
+    
+    COM is initialized once on the volume worker thread, which owns the
+    interface for its whole lifetime.
+    """
+    
+    STEP = 0.1
+    
+    def __init__(self):
+        self._volume = None
+    
+    def open(self):
+        from ctypes import cast, POINTER
+        from comtypes import CLSCTX_ALL, CoInitialize
+        from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
+        CoInitialize()
+        devices = AudioUtilities.GetSpeakers()
+        interface = devices.Activate(IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
+        self._volume = cast(interface, POINTER(IAudioEndpointVolume))
+    
+    def change(self, steps):
+        current_volume = self._volume.GetMasterVolumeLevelScalar()
+        new_volume = min(1.0, max(0.0, current_volume + steps * self.STEP))
+        self._volume.SetMasterVolumeLevelScalar(new_volume, None)
+    
+    def get(self):
+        level = round(self._volume.GetMasterVolumeLevelScalar() * 100)
+        return level, bool(self._volume.GetMute())
+    
+    def set(self, level):
+        self._volume.SetMasterVolumeLevelScalar(level / 100.0, None)
+    
+    def set_mute(self, muted):
+        if muted == 'toggle':
+            muted = not self._volume.GetMute()
+        self._volume.SetMute(1 if muted else 0, None)
+    
+    def monitor_command(self):
+        # Reading the held interface is cheap, so local changes are polled
+        return None
+    
+    def close(self):
+        from comtypes import CoUninitialize
+        self._volume = None
+        CoUninitialize()
+
+class LinuxAudioBackend:
+    """Linux volume control through one long-running `amixer -s` process
+    
+    amixer reads commands from stdin in that mode, so a change costs a pipe
+    write instead of a fork. If amixer has no Master control, each change
+    runs pactl instead.
+    """
+    
+    STEP = 5
+    
+    def __init__(self):
+        self._amixer = None
+        self._use_pactl = False
+    
+    def open(self):
+        try:
+            subprocess.run(['amixer', 'sget', 'Master'], capture_output=True, check=True)
+            self._amixer = subprocess.Popen(
+                ['amixer', '-q', '-s'], stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, text=True
+            )
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            # Fallback to pactl if amixer fails
+            subprocess.run(['pactl', 'info'], capture_output=True, check=True)
+            self._use_pactl = True
+    
+    def _amixer_command(self, command):
+        if self._amixer.poll() is not None:
+            raise RuntimeError("amixer exited")
+        self._amixer.stdin.write(command + '\n')
+        self._amixer.stdin.flush()
+    
+    def change(self, steps):
+        percent = abs(steps) * self.STEP
+        sign = '+' if steps > 0 else '-'
+        if self._use_pactl:
+            metrics.fallback('pactl')
+            subprocess.run(['pactl', 'set-sink-volume', '@DEFAULT_SINK@', f'{sign}{percent}%'],
+                           capture_output=True, check=True)
+        else:
+            self._amixer_command(f'sset Master {percent}%{sign}')
+    
+    def get(self):
+        if self._use_pactl:
+            volume = subprocess.run(['pactl', 'get-sink-volume', '@DEFAULT_SINK@'],
+                                    capture_output=True, text=True, check=True).stdout
+            mute = subprocess.run(['pactl', 'get-sink-mute', '@DEFAULT_SINK@'],
+                                  capture_output=True, text=True, check=True).stdout
+            level_match = re.search(r'(\d+)%', volume)
+            muted = 'yes' in mute.lower()
+        else:
+            output = subprocess.run(['amixer', 'sget', 'Master'],
+                                    capture_output=True, text=True, check=True).stdout
+            level_match = re.search(r'\[(\d+)%\]', output)
+            muted = '[off]' in output
+        if not level_match:
+            raise VolumeUnsupportedError("Could not read volume")
+        return int(level_match.group(1)), muted
+    
+    def set(self, level):
+        if self._use_pactl:
+            subprocess.run(['pactl', 'set-sink-volume', '@DEFAULT_SINK@', f'{level}%'],
+                           capture_output=True, check=True)
+        else:
+            self._amixer_command(f'sset Master {level}%')
+    
+    def set_mute(self, muted):
+        state = 'toggle' if muted == 'toggle' else ('mute' if muted else 'unmute')
+        if self._use_pactl:
+            value = {'toggle': 'toggle', 'mute': '1', 'unmute': '0'}[state]
+            subprocess.run(['pactl', 'set-sink-mute', '@DEFAULT_SINK@', value],
+                           capture_output=True, check=True)
+        else:
+            self._amixer_command(f'sset Master {state}')
+    
+    def monitor_command(self):
+        """Long-running command that prints a line on every mixer change"""
+        if self._use_pactl:
+            return ['pactl', 'subscribe']
+        return ['amixer', 'events']
+    
+    def close(self):
+        if self._amixer is not None:
+            try:
+                self._amixer.stdin.close()
+                self._amixer.wait(timeout=1)
+            except (OSError, subprocess.TimeoutExpired):
+                self._amixer.kill()
+            self._amixer = None
+
 class VolumeController:
-    """Cross-platform volume controller"""
+    """Cross-platform volume controller
+    
+    Changes are applied by a worker thread that keeps a platform audio
+    backend open. Presses that arrive while a change is being applied are
+    merged, so a burst of up/down presses becomes one net change. The
+    worker also tracks the current level and mute state, including changes
+    made locally on the PC, and wakes up listeners when they change.
+    """
+    
+    POLL_INTERVAL = 0.5
     
     def __init__(self):
         self.platform = platform.system()
+        # 'auto' picks the platform backend; 'keys' and 'null' force one
+        self.backend_name = 'auto'
+        self._pending = 0
+        self._target = None
+        self._mute = None
+        self._read_requested = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self._monitor = None
+        self._can_monitor = False
+        self.level = None
+        self.muted = None
+        self.version = 0
+        self._reads = 0
+        self.subscribers = 0
+        self._listeners = []
+        self._reopen = False
+    
+    def warm_up(self):
+        """Open the backend and read the level now instead of on the first press"""
+        with self._cond:
+            self._read_requested = True
+            self._ensure_worker()
+            self._cond.notify_all()
+    
+    def set_backend(self, name):
+        """Switch backends; the worker reopens before its next change"""
+        with self._cond:
+            if name != self.backend_name:
+                self.backend_name = name
+                self._reopen = self._thread is not None
+                self._read_requested = self._reopen
+                self._cond.notify_all()
+    
+    def reopen(self):
+        """Reopen the backend now, e.g. after the machine resumed from suspend"""
+        with self._cond:
+            self._reopen = self._thread is not None
+            self._read_requested = True
+            self._ensure_worker()
+            self._cond.notify_all()
     
     def volume_up(self):
         """Increase system volume"""
-        if self.platform == "Windows" and WINDOWS_AUDIO:
-            self._windows_volume_up()
-        elif self.platform == "Linux":
-            self._linux_volume_up()
-        else:
-            # Fallback to keyboard shortcut
-            keyboard_controller.press(Key.media_volume_up)
-            keyboard_controller.release(Key.media_volume_up)
+        self._queue(steps=1)
     
     def volume_down(self):
         """Decrease system volume"""
-        if self.platform == "Windows" and WINDOWS_AUDIO:
-            self._windows_volume_down()
-        elif self.platform == "Linux":
-            self._linux_volume_down()
-        else:
-            # Fallback to keyboard shortcut
-            keyboard_controller.press(Key.media_volume_down)
-            keyboard_controller.release(Key.media_volume_down)
+        self._queue(steps=-1)
     
-    def _windows_volume_up(self):
-        """Windows-specific volume up"""
-        try:
-            # Initialize COM
-            CoInitialize()
+    def set_volume(self, level):
+        """Set an absolute volume level in percent"""
+        self._queue(target=min(100, max(0, int(level))))
+    
+    def set_mute(self, muted):
+        """Mute or unmute; muted=None toggles the current state"""
+        self._queue(mute=muted if muted is not None else 'toggle')
+    
+    def get_volume(self, timeout=1.0):
+        """Read the current (level, muted, version), refreshing from the backend"""
+        with self._cond:
+            reads = self._reads
+            self._read_requested = True
+            self._ensure_worker()
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: self._reads != reads, timeout)
+            return self.level, self.muted, self.version
+    
+    def wait_for_change(self, version, timeout):
+        """Block until the state differs from `version`; returns the new state"""
+        with self._cond:
+            # Count as a listener so local changes are picked up while waiting
+            self.subscribers += 1
+            self._ensure_worker()
+            self._cond.notify_all()
             try:
-                devices = AudioUtilities.GetSpeakers()
-                interface = devices.Activate(IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
-                volume = cast(interface, POINTER(IAudioEndpointVolume))
-                current_volume = volume.GetMasterVolumeLevelScalar()
-                new_volume = min(1.0, current_volume + 0.1)
-                volume.SetMasterVolumeLevelScalar(new_volume, None)
+                self._cond.wait_for(lambda: self.version != version, timeout)
             finally:
-                # Always uninitialize COM
-                CoUninitialize()
-        except Exception as e:
-            print(f"Windows volume control error: {e}")
-            # Fallback
-            keyboard_controller.press(Key.media_volume_up)
-            keyboard_controller.release(Key.media_volume_up)
+                self.subscribers -= 1
+            return self.level, self.muted, self.version
+    
+    def add_listener(self, callback):
+        """Call callback(level, muted, version) on every state change"""
+        with self._cond:
+            self._listeners.append(callback)
+            self.subscribers += 1
+            self._ensure_worker()
+            self._cond.notify_all()
+    
+    def remove_listener(self, callback):
+        with self._cond:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+                self.subscribers -= 1
+    
+    def _queue(self, steps=0, target=None, mute=None):
+        with self._cond:
+            if target is not None:
+                # An absolute set supersedes any steps still pending
+                self._target = target
+                self._pending = 0
+            self._pending += steps
+            if mute is not None:
+                self._mute = mute
+            self._ensure_worker()
+            self._cond.notify_all()
     
-    def _windows_volume_down(self):
-        """Windows-specific volume down"""
+    def _ensure_worker(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='volume', daemon=True)
+            self._thread.start()
+    
+    def _create_backend(self):
+        if self.backend_name == 'null':
+            return NullAudioBackend()
+        elif self.backend_name == 'keys':
+            return KeyboardAudioBackend()
+        elif self.platform == "Windows":
+            return WindowsAudioBackend()
+        elif self.platform == "Linux":
+            return LinuxAudioBackend()
+        # Fallback to keyboard shortcut
+        return KeyboardAudioBackend()
+    
+    def _open_backend(self):
+        backend = self._create_backend()
         try:
-            # Initialize COM
-            CoInitialize()
-            try:
-                devices = AudioUtilities.GetSpeakers()
-                interface = devices.Activate(IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
-                volume = cast(interface, POINTER(IAudioEndpointVolume))
-                current_volume = volume.GetMasterVolumeLevelScalar()
-                new_volume = max(0.0, current_volume - 0.1)
-                volume.SetMasterVolumeLevelScalar(new_volume, None)
-            finally:
-                # Always uninitialize COM
-                CoUninitialize()
+            backend.open()
         except Exception as e:
-            print(f"Windows volume control error: {e}")
-            # Fallback
-            keyboard_controller.press(Key.media_volume_down)
-            keyboard_controller.release(Key.media_volume_down)
+            print(f"Volume control backend unavailable, using media keys: {e}")
+            backend = KeyboardAudioBackend()
+        self._start_monitor(backend.monitor_command())
+        return backend
     
-    def _linux_volume_up(self):
-        """Linux-specific volume up using amixer"""
+    def _start_monitor(self, command):
+        """Watch for volume changes made locally on the PC"""
+        self._can_monitor = False
+        if not command or self._monitor is not None:
+            self._can_monitor = self._monitor is not None
+            return
         try:
-            subprocess.run(['amixer', 'sset', 'Master', '5%+'], 
-                         capture_output=True, check=True)
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            # Fallback to pactl if amixer fails
-            try:
-                subprocess.run(['pactl', 'set-sink-volume', '@DEFAULT_SINK@', '+5%'], 
-                             capture_output=True, check=True)
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                # Final fallback
-                keyboard_controller.press(Key.media_volume_up)
-                keyboard_controller.release(Key.media_volume_up)
-    
-    def _linux_volume_down(self):
-        """Linux-specific volume down using amixer"""
-        try:
-            subprocess.run(['amixer', 'sset', 'Master', '5%-'], 
-                         capture_output=True, check=True)
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            # Fallback to pactl if amixer fails
+            self._monitor = subprocess.Popen(command, stdout=subprocess.PIPE,
+                                             stderr=subprocess.DEVNULL, text=True)
+        except OSError:
+            return
+        self._can_monitor = True
+        threading.Thread(target=self._read_monitor, name='volume-monitor', daemon=True).start()
+    
+    def _read_monitor(self):
+        for _ in self._monitor.stdout:
+            with self._cond:
+                if self.subscribers:
+                    self._read_requested = True
+                    self._cond.notify_all()
+        with self._cond:
+            self._monitor = None
+            self._can_monitor = False
+    
+    def _has_work(self):
+        return (self._pending or self._target is not None or self._mute is not None
+                or self._read_requested)
+    
+    def _run(self):
+        backend = None
+        while True:
+            with self._cond:
+                while not self._has_work():
+                    # Without a change monitor, poll while anyone is listening
+                    poll = self.POLL_INTERVAL if self.subscribers and not self._can_monitor else None
+                    if not self._cond.wait(poll):
+                        self._read_requested = True
+                steps, target, mute = self._pending, self._target, self._mute
+                self._pending, self._target, self._mute = 0, None, None
+                # Plain steps with nobody watching skip the readback
+                read = (self._read_requested or self.subscribers > 0
+                        or target is not None or mute is not None)
+                self._read_requested = False
+                reopen, self._reopen = self._reopen, False
+            
+            if reopen and backend is not None:
+                backend.close()
+                backend = None
+            if backend is None:
+                backend = self._open_backend()
+            start = time.perf_counter()
             try:
-                subprocess.run(['pactl', 'set-sink-volume', '@DEFAULT_SINK@', '-5%'], 
-                             capture_output=True, check=True)
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                # Final fallback
-                keyboard_controller.press(Key.media_volume_down)
-                keyboard_controller.release(Key.media_volume_down)
+                if target is not None:
+                    backend.set(target)
+                if steps:
+                    backend.change(steps)
+                if mute == 'toggle' and self.muted is not None:
+                    mute = not self.muted
+                # 'toggle' is passed on when the current state is unknown
+                if mute is not None:
+                    try:
+                        backend.set_mute(mute)
+                    except VolumeUnsupportedError as e:
+                        print(f"Volume control error: {e}")
+                if read:
+                    self._update_state(*backend.get())
+                metrics.observe('audio', time.perf_counter() - start)
+            except VolumeUnsupportedError as e:
+                if target is not None:
+                    print(f"Volume control error: {e}")
+                self._update_state(None, None)
+            except Exception as e:
+                print(f"Volume control error: {e}")
+                # Fallback, then reopen the backend on the next change
+                if steps:
+                    metrics.fallback('media_keys')
+                    KeyboardAudioBackend().change(steps)
+                try:
+                    backend.close()
+                except Exception:
+                    pass
+                backend = None
+                self._update_state(self.level, self.muted)
+    
+    def _update_state(self, level, muted):
+        with self._cond:
+            self._reads += 1
+            changed = (level, muted) != (self.level, self.muted)
+            self.level, self.muted = level, muted
+            if changed:
+                self.version += 1
+            listeners = list(self._listeners)
+            version = self.version
+            self._cond.notify_all()
+        if changed:
+            for callback in listeners:
+                try:
+                    callback(level, muted, version)
+                except Exception as e:
+                    print(f"Volume listener error: {e}")
 
 # Initialize volume controller
 volume_controller = VolumeController()
 
-def get_system_mac_address():
-    """Get the primary network interface MAC address"""
+SYS_CLASS_NET = '/sys/class/net'
+
+def _read_sysfs(interface, attribute):
+    """Read one attribute of a network interface from /sys/class/net"""
     try:
-        if platform.system() == "Windows":
-            # Windows: Try multiple methods for better compatibility
-            try:
-                # Method 1: getmac with table format (most compatible)
-                result = subprocess.run(['getmac', '/fo', 'table', '/nh'], 
+        with open(f'{SYS_CLASS_NET}/{interface}/{attribute}', 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return ''
+
+def _linux_primary_interface():
+    """Name of the Linux interface carrying the default route
+    
+    Falls back to the first interface that is up and has a hardware address.
+    """
+    try:
+        with open('/proc/net/route', 'r') as f:
+            next(f, None)  # Skip header
+            for line in f:
+                fields = line.split()
+                # Destination 00000000 is the default route
+                if len(fields) > 1 and fields[1] == '00000000' and fields[0] != 'lo':
+                    return fields[0]
+    except OSError:
+        pass
+    
+    try:
+        interfaces = sorted(os.listdir(SYS_CLASS_NET))
+    except OSError:
+        return None
+    for interface in interfaces:
+        if interface == 'lo':
+            continue
+        mac = _read_sysfs(interface, 'address')
+        if mac and mac != '00:00:00:00:00:00' and _read_sysfs(interface, 'operstate') == 'up':
+            return interface
+    return None
+
+def get_primary_ip():
+    """IP address of the interface used for outbound traffic"""
+    try:
+        # Connecting a UDP socket only selects a route, no packets are sent
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(('8.8.8.8', 80))
+            return s.getsockname()[0]
+    except OSError:
+        return None
+
+def get_system_mac_address():
+    """Get the primary network interface MAC address
+    
+    This probes the system directly and can be slow; request paths should
+    use the cached network_identity instead.
+    """
+    try:
+        if platform.system() == "Windows":
+            # Windows: Try multiple methods for better compatibility
+            try:
+                # Method 1: getmac with table format (most compatible)
+                result = subprocess.run(['getmac', '/fo', 'table', '/nh'], 
                                       capture_output=True, text=True, check=True)
                 lines = result.stdout.strip().split('\n')
                 
@@ -251,29 +1525,12 @@ def get_system_mac_address():
                     except subprocess.CalledProcessError:
                         pass
         elif platform.system() == "Linux":
-            # Linux: Read from /sys/class/net or use ip command
-            try:
-                # Try ip command first
-                result = subprocess.run(['ip', 'link', 'show'], 
-                                      capture_output=True, text=True, check=True)
-                lines = result.stdout.split('\n')
-                for line in lines:
-                    if 'link/ether' in line and 'state UP' in lines[lines.index(line)-1]:
-                        mac_match = re.search(r'link/ether\s+([0-9a-f]{2}:[0-9a-f]{2}:[0-9a-f]{2}:[0-9a-f]{2}:[0-9a-f]{2}:[0-9a-f]{2})', line)
-                        if mac_match:
-                            return mac_match.group(1).upper()
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                # Fallback: check /sys/class/net
-                net_dir = '/sys/class/net'
-                if os.path.exists(net_dir):
-                    for interface in os.listdir(net_dir):
-                        if interface != 'lo':  # Skip loopback
-                            mac_file = f'{net_dir}/{interface}/address'
-                            if os.path.exists(mac_file):
-                                with open(mac_file, 'r') as f:
-                                    mac = f.read().strip().upper()
-                                    if mac and mac != '00:00:00:00:00:00':
-                                        return mac
+            # Linux: Read straight from /sys/class/net, no subprocess needed
+            interface = _linux_primary_interface()
+            if interface:
+                mac = _read_sysfs(interface, 'address').upper()
+                if mac and mac != '00:00:00:00:00:00':
+                    return mac
         elif platform.system() == "Darwin":  # macOS
             result = subprocess.run(['ifconfig'], capture_output=True, text=True, check=True)
             lines = result.stdout.split('\n')
@@ -305,24 +1562,98 @@ def get_system_mac_address():
     
     return None
 
+class NetworkIdentity:
+    """Cached MAC address, primary IP and interface name
+    
+    Discovery runs once at startup and then in the background, either when
+    the kernel reports an interface or address change (netlink on Linux) or
+    every `refresh_interval_s` seconds, so request handlers only ever read
+    from memory.
+    """
+    
+    # rtnetlink multicast groups: RTMGRP_LINK | RTMGRP_IPV4_IFADDR
+    NETLINK_GROUPS = 0x1 | 0x10
+    
+    def __init__(self):
+        self.mac = None
+        self.ip = None
+        self.interface = None
+        self.refresh_interval = 300
+        self.ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+    
+    def refresh(self):
+        """Rediscover the network identity and swap it in"""
+        interface = _linux_primary_interface() if platform.system() == "Linux" else None
+        mac = get_system_mac_address()
+        ip = get_primary_ip()
+        with self._lock:
+            self.mac, self.ip, self.interface = mac, ip, interface
+        self.ready.set()
+    
+    def snapshot(self):
+        """Current identity as a dict"""
+        with self._lock:
+            return {"mac_address": self.mac, "ip": self.ip, "interface": self.interface}
+    
+    def start(self, refresh_interval=None):
+        """Discover, then keep the cache fresh, in a background thread"""
+        if refresh_interval:
+            self.refresh_interval = refresh_interval
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name='network-identity', daemon=True)
+            self._thread.start()
+    
+    def _watch(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Network identity discovery error: {e}")
+            self.ready.set()
+        
+        sock = None
+        if platform.system() == "Linux" and hasattr(socket, 'AF_NETLINK'):
+            try:
+                sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+                sock.bind((0, self.NETLINK_GROUPS))
+            except OSError as e:
+                print(f"Netlink unavailable, polling network identity instead: {e}")
+                sock = None
+        
+        while True:
+            try:
+                if sock is None:
+                    time.sleep(self.refresh_interval)
+                else:
+                    sock.settimeout(self.refresh_interval)
+                    try:
+                        sock.recv(65536)
+                        # Interface changes arrive in bursts; let them settle
+                        sock.settimeout(1.0)
+                        while True:
+                            sock.recv(65536)
+                    except socket.timeout:
+                        pass
+                self.refresh()
+            except Exception as e:
+                print(f"Network identity refresh error: {e}")
+                time.sleep(self.refresh_interval)
+
+network_identity = NetworkIdentity()
+
 def generate_config_qr():
     """Generate QR code with server configuration for easy pairing"""
     try:
         # Get system MAC address
-        mac_address = get_system_mac_address()
+        identity = network_identity.snapshot()
+        mac_address = identity['mac_address']
         
         # Create configuration data for QR code
-        # If host is 0.0.0.0, try to get actual IP address for QR code
+        # If host is 0.0.0.0, use the actual IP address for the QR code
         host = config.get('host', '0.0.0.0')
         if host == '0.0.0.0':
-            try:
-                import socket
-                # Get local IP address
-                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-                    s.connect(('8.8.8.8', 80))
-                    host = s.getsockname()[0]
-            except Exception:
-                host = '0.0.0.0'  # Fallback
+            host = identity['ip'] or '0.0.0.0'
         
         qr_config = {
             "host": host,
@@ -332,6 +1663,7 @@ def generate_config_qr():
         }
         
         # Generate QR code
+        import qrcode
         qr = qrcode.QRCode(
             version=1,
             error_correction=qrcode.constants.ERROR_CORRECT_M,
@@ -361,151 +1693,3670 @@ def generate_config_qr():
 
 # API Endpoints
 
+# The health reply never changes, so it is serialized once
+HEALTH_BODY = json.dumps({"status": "ok", "platform": platform.system()})
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint (no auth required)"""
-    return jsonify({"status": "ok", "platform": platform.system()})
+    return Response(HEALTH_BODY, mimetype='application/json')
+
+@app.route('/auth/ticket', methods=['POST'])
+def issue_ticket():
+    """Trade the bearer token for a short-lived session ticket"""
+    # Tickets cannot renew themselves, so a leaked one still expires
+    if not authorize(lambda: authenticator.check_header(request.environ.get('HTTP_AUTHORIZATION'))):
+        return '', 204
+    return jsonify({"status": "ok", "ticket": authenticator.issue_ticket(),
+                    "expires_in": authenticator.ticket_ttl})
 
 @app.route('/mac', methods=['GET'])
 @require_auth
 def get_mac_address():
     """Get the system's MAC address"""
-    mac = get_system_mac_address()
-    if mac:
-        return jsonify({"status": "ok", "mac_address": mac})
+    # Discovery runs in the background right after startup
+    network_identity.ready.wait(2.0)
+    identity = network_identity.snapshot()
+    if identity['mac_address']:
+        return jsonify(dict(identity, status="ok"))
     else:
         return jsonify({"status": "error", "message": "Could not determine MAC address"}), 404
 
-@app.route('/arrow', methods=['POST'])
-@require_auth
-def arrow_key():
-    """Send arrow key press"""
-    data = request.get_json()
-    if not data or 'direction' not in data:
-        return jsonify({"error": "Missing direction"}), 400
-    
-    direction = data['direction'].lower()
-    key_map = {
-        'up': Key.up,
-        'down': Key.down,
-        'left': Key.left,
-        'right': Key.right
-    }
+class Clipboard:
+    """Minimal cross-platform text clipboard used for paste-mode typing"""
+    
+    CF_UNICODETEXT = 13
+    GMEM_MOVEABLE = 0x0002
+    # How long set() waits for the new selection to become readable
+    OWNER_TIMEOUT = 1.0
+    
+    def __init__(self):
+        self.platform = platform.system()
+    
+    def _linux_commands(self):
+        """(read, write) commands for the running display server, or None"""
+        if os.environ.get('WAYLAND_DISPLAY'):
+            return ['wl-paste', '--no-newline'], ['wl-copy']
+        for read, write in ((['xclip', '-selection', 'clipboard', '-o'], ['xclip', '-selection', 'clipboard', '-i']),
+                            (['xsel', '--clipboard', '--output'], ['xsel', '--clipboard', '--input'])):
+            if shutil.which(read[0]):
+                return read, write
+        return None
+    
+    def available(self):
+        if self.platform == "Windows":
+            return True
+        if self.platform == "Darwin":
+            return bool(shutil.which('pbcopy'))
+        commands = self._linux_commands()
+        return commands is not None and bool(shutil.which(commands[1][0]))
+    
+    def get(self):
+        """Current clipboard text, or None if it holds no text"""
+        if self.platform == "Windows":
+            return self._windows_get()
+        read = ['pbpaste'] if self.platform == "Darwin" else self._linux_commands()[0]
+        result = subprocess.run(read, capture_output=True, timeout=2)
+        if result.returncode != 0:
+            return None
+        return result.stdout.decode('utf-8', errors='replace')
+    
+    def set(self, text):
+        if self.platform == "Windows":
+            self._windows_set(text)
+            return
+        write = ['pbcopy'] if self.platform == "Darwin" else self._linux_commands()[1]
+        # xclip, xsel and wl-copy fork a child that keeps serving the
+        # selection; the parent exits once it has read the text
+        process = subprocess.Popen(write, stdin=subprocess.PIPE,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            process.communicate(text.encode('utf-8'), timeout=self.OWNER_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            raise OSError(f"{write[0]} did not take the clipboard text")
+        if self.platform != "Darwin":
+            self._wait_owned(text)
+    
+    def _wait_owned(self, text):
+        """Block until the clipboard serves `text`, so a paste cannot get the old content"""
+        deadline = time.monotonic() + self.OWNER_TIMEOUT
+        while self.get() != text:
+            if time.monotonic() > deadline:
+                raise OSError("Clipboard did not take the new text")
+            time.sleep(0.01)
+    
+    def _windows_api(self):
+        import ctypes
+        from ctypes import wintypes
+        user32 = ctypes.WinDLL('user32', use_last_error=True)
+        kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        user32.GetClipboardData.restype = wintypes.HANDLE
+        user32.SetClipboardData.argtypes = (wintypes.UINT, wintypes.HANDLE)
+        kernel32.GlobalAlloc.restype = wintypes.HGLOBAL
+        kernel32.GlobalAlloc.argtypes = (wintypes.UINT, ctypes.c_size_t)
+        kernel32.GlobalLock.restype = wintypes.LPVOID
+        kernel32.GlobalLock.argtypes = (wintypes.HGLOBAL,)
+        kernel32.GlobalUnlock.argtypes = (wintypes.HGLOBAL,)
+        return ctypes, user32, kernel32
+    
+    def _windows_get(self):
+        ctypes, user32, kernel32 = self._windows_api()
+        if not user32.OpenClipboard(None):
+            raise OSError("Could not open clipboard")
+        try:
+            handle = user32.GetClipboardData(self.CF_UNICODETEXT)
+            if not handle:
+                return None
+            pointer = kernel32.GlobalLock(handle)
+            try:
+                return ctypes.wstring_at(pointer)
+            finally:
+                kernel32.GlobalUnlock(handle)
+        finally:
+            user32.CloseClipboard()
     
-    if direction not in key_map:
-        return jsonify({"error": "Invalid direction"}), 400
+    def _windows_set(self, text):
+        ctypes, user32, kernel32 = self._windows_api()
+        data = text.encode('utf-16-le') + b'\x00\x00'
+        handle = kernel32.GlobalAlloc(self.GMEM_MOVEABLE, len(data))
+        pointer = kernel32.GlobalLock(handle)
+        ctypes.memmove(pointer, data, len(data))
+        kernel32.GlobalUnlock(handle)
+        if not user32.OpenClipboard(None):
+            raise OSError("Could not open clipboard")
+        try:
+            user32.EmptyClipboard()
+            # The clipboard owns the memory once SetClipboardData succeeds
+            user32.SetClipboardData(self.CF_UNICODETEXT, handle)
+        finally:
+            user32.CloseClipboard()
+
+class TypingJob:
+    """Progress of one /type request"""
+    __slots__ = ('job_id', 'length', 'typed', 'mode', 'status', 'command')
     
-    key = key_map[direction]
-    keyboard_controller.press(key)
-    keyboard_controller.release(key)
+    def __init__(self, job_id, length, mode):
+        self.job_id = job_id
+        self.length = length
+        self.typed = 0
+        self.mode = mode
+        self.status = 'queued'
+        self.command = None
     
-    return jsonify({"status": "ok", "action": f"arrow_{direction}"})
+    def to_dict(self):
+        status = self.status
+        if self.command is not None and self.command.status == 'dropped':
+            status = 'dropped'
+        return {"status": status, "job": self.job_id, "mode": self.mode,
+                "length": self.length, "typed": self.typed}
 
-@app.route('/key', methods=['POST'])
-@require_auth
-def key_press():
-    """Send specific key press"""
-    data = request.get_json()
-    if not data or 'key' not in data:
-        return jsonify({"error": "Missing key"}), 400
-    
-    key_name = data['key'].lower()
-    
-    if key_name == 'enter':
-        keyboard_controller.press(Key.enter)
-        keyboard_controller.release(Key.enter)
-    elif key_name == 'backspace':
-        keyboard_controller.press(Key.backspace)
-        keyboard_controller.release(Key.backspace)
-    elif key_name == 'escape':
-        keyboard_controller.press(Key.esc)
-        keyboard_controller.release(Key.esc)
-    else:
-        return jsonify({"error": "Unsupported key"}), 400
+class TextInjector:
+    """Chooses how text is injected and tracks typing progress
+    
+    Modes:
+      keys      - pynput types every character (fine for short text)
+      chunked   - keys, in chunks of `chunk_size` with progress updates
+      clipboard - put the text on the clipboard, paste it, restore the
+                  previous clipboard content
+      auto      - clipboard for text of `clipboard_threshold` characters
+                  or more (when a clipboard tool is available), else keys
+    """
+    
+    MODES = ('auto', 'keys', 'chunked', 'clipboard')
+    MAX_JOBS = 32
+    
+    def __init__(self):
+        self.mode = 'auto'
+        self.clipboard_threshold = 200
+        self.chunk_size = 64
+        self.restore_delay = 0.3
+        self.clipboard = Clipboard()
+        # Timer that puts the saved clipboard back; its args hold the saved text
+        self._restore = None
+        self._clipboard_lock = threading.Lock()
+        self._jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+    
+    def configure(self, text_config):
+        """Apply the text section of the configuration"""
+        mode = text_config.get('mode', self.mode)
+        if mode not in self.MODES:
+            print(f"Warning: unknown text mode '{mode}', using auto")
+            mode = 'auto'
+        self.mode = mode
+        self.clipboard_threshold = text_config.get('clipboard_threshold', self.clipboard_threshold)
+        self.chunk_size = max(1, text_config.get('chunk_size', self.chunk_size))
+        self.restore_delay = text_config.get('restore_delay_ms', self.restore_delay * 1000) / 1000.0
+    
+    def choose_mode(self, text, requested=None):
+        mode = requested or self.mode
+        if mode not in self.MODES:
+            raise CommandError("Invalid text mode")
+        if mode == 'auto':
+            if len(text) >= self.clipboard_threshold and self.clipboard.available():
+                return 'clipboard'
+            return 'chunked' if len(text) > self.chunk_size else 'keys'
+        return mode
+    
+    def create_job(self, text, mode):
+        job = TypingJob(secrets.token_hex(6), len(text), mode)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            while len(self._jobs) > self.MAX_JOBS:
+                self._jobs.popitem(last=False)
+        return job
     
-    return jsonify({"status": "ok", "action": f"key_{key_name}"})
+    def get_job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+    
+    def inject(self, job, text):
+        """Type `text` for `job`; runs on the injector thread"""
+        job.status = 'typing'
+        try:
+            if job.mode == 'clipboard':
+                self._paste(text)
+                job.typed = len(text)
+            elif job.mode == 'chunked':
+                for start in range(0, len(text), self.chunk_size):
+                    chunk = text[start:start + self.chunk_size]
+                    input_backend.type(chunk)
+                    job.typed += len(chunk)
+            else:
+                input_backend.type(text)
+                job.typed = len(text)
+            job.status = 'done'
+        except Exception:
+            job.status = 'failed'
+            raise
+    
+    def _paste(self, text):
+        with self._clipboard_lock:
+            restore, self._restore = self._restore, None
+            if restore is not None:
+                # Still showing an earlier paste: keep the content saved before it
+                restore.cancel()
+                previous = restore.args[0]
+            else:
+                previous = None
+                try:
+                    previous = self.clipboard.get()
+                except Exception as e:
+                    print(f"Could not save clipboard: {e}")
+            
+            self.clipboard.set(text)
+            modifier = 'cmd' if platform.system() == "Darwin" else 'ctrl'
+            input_backend.press(modifier)
+            try:
+                input_backend.tap('v')
+            finally:
+                input_backend.release(modifier)
+            
+            if previous is not None:
+                # Give the target application time to read the clipboard,
+                # without holding up the injector thread
+                self._restore = threading.Timer(self.restore_delay, self._restore_clipboard, (previous,))
+                self._restore.daemon = True
+                self._restore.start()
+    
+    def _restore_clipboard(self, previous):
+        with self._clipboard_lock:
+            if self._restore is not threading.current_thread():
+                return  # superseded by a later paste
+            self._restore = None
+            try:
+                self.clipboard.set(previous)
+            except Exception as e:
+                print(f"Could not restore clipboard: {e}")
 
-@app.route('/type', methods=['POST'])
-@require_auth
-def type_text():
-    """Type text string"""
-    data = request.get_json()
-    if not data or 'text' not in data:
-        return jsonify({"error": "Missing text"}), 400
+text_injector = TextInjector()
+
+class CommandError(Exception):
+    """Raised when a command payload is missing fields or has invalid values"""
+
+class QueueFullError(Exception):
+    """Raised when the input queue cannot take more commands
+    
+    The subclasses cover the other reasons the dispatcher refuses commands;
+    `kind` names the error counter and `status` the HTTP status.
+    """
+    kind = 'queue_full'
+    status = 429
+
+class RateLimitedError(QueueFullError):
+    """Raised when a client sends commands faster than its rate limit"""
+    kind = 'rate_limited'
+
+class LeaseHeldError(QueueFullError):
+    """Raised when another client holds exclusive control"""
+    kind = 'lease_held'
+    status = 409
+
+class PreparedCommand:
+    """A validated command waiting for the injector thread"""
+    __slots__ = ('result', 'inject', 'repeat_key', 'status', 'error', 'spec',
+                 'event_id', 'sent', 'max_age', 'deadline', 'timing', 'queue_wait', 'duration')
     
-    text = data['text']
-    keyboard_controller.type(text)
+    def __init__(self, result, inject, repeat_key=None):
+        self.result = result
+        self.inject = inject
+        # Commands with the same repeat key are interchangeable (e.g. arrow_up)
+        self.repeat_key = repeat_key
+        self.status = 'queued'
+        self.error = None
+        # The command as a replayable dict, set by prepare_command()
+        self.spec = None
+        # Optional client-supplied id, send time (ms) and freshness budget (ms)
+        self.event_id = None
+        self.sent = None
+        self.max_age = None
+        # perf_counter() time after which the command is no longer worth injecting
+        self.deadline = None
+        # Whether the client asked for queue wait and injection time (seconds) in the result
+        self.timing = False
+        self.queue_wait = None
+        self.duration = None
     
-    return jsonify({"status": "ok", "action": "type", "length": len(text)})
+    def response(self):
+        """Result payload for the client once the command has been accepted"""
+        if self.status == 'failed':
+            raise RuntimeError(f"Injection failed: {self.error}")
+        if self.status in ('dropped', 'expired'):
+            return dict(self.result, status=self.status)
+        if self.status == 'duplicate':
+            return dict(self.result, duplicate=True)
+        if self.timing and self.duration is not None:
+            return dict(self.result, queue_ms=round(self.queue_wait * 1000, 3),
+                        inject_ms=round(self.duration * 1000, 3))
+        return self.result
 
-@app.route('/volume', methods=['POST'])
-@require_auth
-def volume_control():
+def _tap(key):
+    """Press and release a single key"""
+    return lambda: input_backend.tap(key)
+
+def _chords(chords):
+    """Inject parsed chords one after another, each as a single key or an atomic chord"""
+    def inject():
+        for keys in chords:
+            if len(keys) == 1:
+                input_backend.tap(keys[0])
+            else:
+                input_backend.chord(keys)
+    return inject
+
+ARROW_KEYS = {'up': 'up', 'down': 'down', 'left': 'left', 'right': 'right'}
+
+# Named shortcuts from config.json: name -> parsed chords
+shortcuts = {}
+
+def configure_shortcuts(shortcut_config):
+    """Parse the shortcuts section once; invalid entries were rejected by validate_config()"""
+    global shortcuts
+    shortcuts = {name.lower(): keymap.parse_shortcut(chord) for name, chord in shortcut_config.items()}
+
+def _arrow_command(data):
+    """Send arrow key press"""
+    if 'direction' not in data:
+        raise CommandError("Missing direction")
+    
+    direction = str(data['direction']).lower()
+    key = ARROW_KEYS.get(direction)
+    if key is None:
+        raise CommandError("Invalid direction")
+    
+    action = f"arrow_{direction}"
+    return PreparedCommand({"status": "ok", "action": action}, _tap(key), action)
+
+def _key_command(data):
+    """Send a key, a chord such as ctrl+shift+t, or a named shortcut"""
+    if 'key' not in data:
+        raise CommandError("Missing key")
+    
+    key_name = str(data['key']).lower()
+    chords = shortcuts.get(key_name)
+    if chords is None:
+        try:
+            chords = keymap.parse_shortcut(str(data['key']))
+        except keymap.KeymapError as e:
+            raise CommandError(str(e))
+    
+    action = f"key_{key_name}"
+    return PreparedCommand({"status": "ok", "action": action}, _chords(chords), action)
+
+def _type_command(data):
+    """Type text string"""
+    if 'text' not in data:
+        raise CommandError("Missing text")
+    
+    text = str(data['text'])
+    job = text_injector.create_job(text, text_injector.choose_mode(text, data.get('mode')))
+    job.command = PreparedCommand({"status": "ok", "action": "type", "length": len(text),
+                                   "job": job.job_id, "mode": job.mode},
+                                  lambda: text_injector.inject(job, text))
+    return job.command
+
+_volume_level = _number(0, 100, integer=True)
+
+def _volume_command(data):
     """Control system volume"""
-    data = request.get_json()
-    if not data or 'action' not in data:
-        return jsonify({"error": "Missing action"}), 400
+    if 'action' not in data:
+        raise CommandError("Missing action")
     
-    action = data['action'].lower()
+    action = str(data['action']).lower()
     
     if action == 'up':
-        volume_controller.volume_up()
+        inject = volume_controller.volume_up
     elif action == 'down':
-        volume_controller.volume_down()
+        inject = volume_controller.volume_down
+    elif action == 'set':
+        if 'level' not in data:
+            raise CommandError("Missing level")
+        level = data['level']
+        if _volume_level(level):
+            raise CommandError("Invalid level")
+        inject = lambda: volume_controller.set_volume(level)
+    elif action in ('mute', 'unmute', 'toggle_mute'):
+        muted = {'mute': True, 'unmute': False, 'toggle_mute': None}[action]
+        inject = lambda: volume_controller.set_mute(muted)
     else:
-        return jsonify({"error": "Invalid volume action"}), 400
+        raise CommandError("Invalid volume action")
     
-    return jsonify({"status": "ok", "action": f"volume_{action}"})
+    action = f"volume_{action}"
+    return PreparedCommand({"status": "ok", "action": action}, inject, action)
 
-@app.errorhandler(404)
-def not_found(error):
-    """Return empty response for 404s to avoid leaking info"""
-    return '', 204
+# Commands shared by the HTTP endpoints and the persistent channels
+COMMANDS = {
+    'arrow': _arrow_command,
+    'key': _key_command,
+    'type': _type_command,
+    'volume': _volume_command,
+}
 
-@app.errorhandler(500)
-def internal_error(error):
-    """Return empty response for 500s to avoid leaking info"""
-    return '', 204
+# The fields that make up each command, as kept in the journal
+COMMAND_FIELDS = {
+    'arrow': ('direction',),
+    'key': ('key',),
+    'type': ('text', 'mode'),
+    'volume': ('action', 'level'),
+}
 
-def main():
-    """Main entry point"""
-    load_config()
+# Command journal
+
+JOURNAL_MAGIC = b'FLOWJRNL'
+JOURNAL_VERSION = 1
+JOURNAL_HEADER = struct.Struct('!8sHHIQ')  # magic, version, slot size, capacity, next sequence
+JOURNAL_HEADER_SIZE = 64
+JOURNAL_ENTRY = struct.Struct('!QdBBHII')  # sequence, unix time, source, flags, length, queue wait us, inject us
+JOURNAL_SLOT = 256
+JOURNAL_SOURCES = ('http', 'websocket', 'udp', 'repeat', 'macro')
+JOURNAL_FAILED = 0x1
+JOURNAL_TRUNCATED = 0x2
+JOURNAL_REDACTED = 0x4
+
+def _journal_entry(buffer, capacity, sequence):
+    """Decode the entry with this sequence number, or None if it has been overwritten"""
+    offset = JOURNAL_HEADER_SIZE + (sequence % capacity) * JOURNAL_SLOT
+    stored, timestamp, source, flags, length, queue_wait, inject = JOURNAL_ENTRY.unpack_from(buffer, offset)
+    if stored != sequence:
+        return None
+    payload = bytes(buffer[offset + JOURNAL_ENTRY.size:offset + JOURNAL_ENTRY.size + length])
+    return {
+        "sequence": sequence,
+        "time": timestamp,
+        "source": JOURNAL_SOURCES[source] if source < len(JOURNAL_SOURCES) else 'unknown',
+        "failed": bool(flags & JOURNAL_FAILED),
+        # Truncated commands (long text) are kept for inspection but not replayed
+        "command": None if flags & JOURNAL_TRUNCATED else json.loads(payload),
+        "redacted": bool(flags & JOURNAL_REDACTED),
+        "queue_wait_us": queue_wait,
+        "inject_us": inject,
+    }
+
+def read_journal(path):
+    """All entries still held in a journal file, oldest first"""
+    with open(path, 'rb') as f:
+        buffer = f.read()
+    magic, version, slot, capacity, next_sequence = JOURNAL_HEADER.unpack_from(buffer, 0)
+    if magic != JOURNAL_MAGIC or version != JOURNAL_VERSION or slot != JOURNAL_SLOT:
+        raise ValueError(f"{path} is not a command journal")
+    entries = []
+    for sequence in range(max(1, next_sequence - capacity), next_sequence):
+        entry = _journal_entry(buffer, capacity, sequence)
+        if entry is not None:
+            entries.append(entry)
+    return entries
+
+class CommandJournal:
+    """Append-only ring of injected commands in a memory-mapped file
     
-    print(f"Starting Android PC Controller Server")
-    print(f"Platform: {platform.system()}")
-    print(f"Host: {config.get('host', '0.0.0.0')}")
-    print(f"Port: {config.get('port', 8080)}")
-    print(f"API Token: {config.get('api_token', 'NOT SET')}")
-    print("\nEndpoints:")
-    print("  GET  /health - Health check")
-    print("  GET  /mac - Get MAC address")
-    print("  POST /arrow - Arrow key press")
-    print("  POST /key - Special key press (enter, backspace, escape)")
-    print("  POST /type - Type text")
-    print("  POST /volume - Volume control")
+    Entries have fixed-size slots and entry N lives in slot N % capacity, so
+    appending is a copy into the mapping and a segment is found from its
+    sequence numbers alone. Only the dispatch thread appends. The file is
+    preallocated and the page cache writes it back, so the injector never
+    waits on the disk. Commands too long for a slot (long text) are stored
+    truncated and are not replayed. Typed text is blanked out unless
+    `record_text` is set, since it may be a password.
+    """
     
-    # Generate and display QR code for easy pairing
-    generate_config_qr()
+    def __init__(self):
+        self.path = None
+        self.capacity = 0
+        self.record_text = False
+        self.next_sequence = 1
+        self._map = None
+        self._fd = None
     
-    print("Press Ctrl+C to stop")
+    @property
+    def enabled(self):
+        return self._map is not None
     
-    try:
-        # Use Waitress for production-ready server
-        from waitress import serve
-        serve(
-            app,
-            host=config.get('host', '0.0.0.0'),
-            port=config.get('port', 8080),
-            threads=4
-        )
-    except ImportError:
-        print("Warning: Waitress not available, falling back to Flask development server")
-        print("Install waitress for production use: pip install waitress")
-        app.run(
-            host=config.get('host', '0.0.0.0'),
-            port=config.get('port', 8080),
-            debug=False
-        )
+    def configure(self, journal_config):
+        """Apply the journal section of the configuration"""
+        if not journal_config.get('enabled', False):
+            self.close()
+            return
+        self.record_text = journal_config.get('record_text', False)
+        path = os.path.join(os.path.dirname(CONFIG_PATH), journal_config.get('path', 'journal.bin'))
+        capacity = journal_config.get('entries', 4096)
+        if self._map is not None and (path, capacity) == (self.path, self.capacity):
+            return
+        self.close()
+        try:
+            self._open(path, capacity)
+        except (OSError, ValueError) as e:
+            print(f"Command journal unavailable: {e}")
+            self.close()
+    
+    def _open(self, path, capacity):
+        size = JOURNAL_HEADER_SIZE + capacity * JOURNAL_SLOT
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._fd = fd
+        header = os.read(fd, JOURNAL_HEADER.size)
+        next_sequence = 1
+        if len(header) == JOURNAL_HEADER.size and os.fstat(fd).st_size == size:
+            magic, version, slot, stored_capacity, stored_next = JOURNAL_HEADER.unpack(header)
+            if (magic, version, slot, stored_capacity) == (JOURNAL_MAGIC, JOURNAL_VERSION, JOURNAL_SLOT, capacity):
+                next_sequence = stored_next
+        if next_sequence == 1:
+            # Write real zeros rather than a sparse file, so appends never
+            # have to wait for the filesystem to allocate blocks
+            os.ftruncate(fd, 0)
+            os.lseek(fd, 0, os.SEEK_SET)
+            zeros = bytes(min(size, 1 << 20))
+            for offset in range(0, size, len(zeros)):
+                os.write(fd, zeros[:size - offset])
+        self._map = mmap.mmap(fd, size)
+        self.path, self.capacity, self.next_sequence = path, capacity, next_sequence
+        JOURNAL_HEADER.pack_into(self._map, 0, JOURNAL_MAGIC, JOURNAL_VERSION, JOURNAL_SLOT,
+                                 capacity, next_sequence)
+    
+    def append(self, source, command, queue_wait, duration):
+        """Record one injected command; called from the dispatch thread only"""
+        mapping = self._map
+        if mapping is None or command.spec is None:
+            return
+        sequence = self.next_sequence
+        spec = command.spec
+        flags = JOURNAL_FAILED if command.status == 'failed' else 0
+        if 'text' in spec and not self.record_text:
+            spec = dict(spec, text='')
+            flags |= JOURNAL_REDACTED
+        payload = json.dumps(spec, separators=(',', ':')).encode('utf-8')
+        room = JOURNAL_SLOT - JOURNAL_ENTRY.size
+        if len(payload) > room:
+            payload = payload[:room]
+            flags |= JOURNAL_TRUNCATED
+        offset = JOURNAL_HEADER_SIZE + (sequence % self.capacity) * JOURNAL_SLOT
+        try:
+            mapping[offset + JOURNAL_ENTRY.size:offset + JOURNAL_ENTRY.size + len(payload)] = payload
+            JOURNAL_ENTRY.pack_into(mapping, offset, sequence, time.time(), source, flags, len(payload),
+                                    min(int(queue_wait * 1e6), 0xFFFFFFFF), min(int(duration * 1e6), 0xFFFFFFFF))
+            struct.pack_into('!Q', mapping, JOURNAL_HEADER.size - 8, sequence + 1)
+        except ValueError:
+            return  # closed by a config reload
+        self.next_sequence = sequence + 1
+    
+    def entries(self, first, last):
+        """Entries with first <= sequence < last that are still in the ring"""
+        mapping = self._map
+        if mapping is None:
+            return []
+        first = max(first, self.next_sequence - self.capacity, 1)
+        entries = []
+        for sequence in range(first, min(last, self.next_sequence)):
+            entry = _journal_entry(mapping, self.capacity, sequence)
+            if entry is not None:
+                entries.append(entry)
+        return entries
+    
+    def close(self):
+        mapping, fd = self._map, self._fd
+        self._map = self._fd = None
+        if mapping is not None:
+            mapping.close()
+        if fd is not None:
+            os.close(fd)
+
+journal = CommandJournal()
+
+class DispatchJob:
+    """Commands queued together; they are injected back to back"""
+    __slots__ = ('commands', 'repeat_key', 'done', 'enqueued', 'source', 'client')
+    
+    def __init__(self, commands, source=0, client=None):
+        self.commands = commands
+        self.repeat_key = commands[0].repeat_key if len(commands) == 1 else None
+        self.done = threading.Event()
+        self.enqueued = time.perf_counter()
+        self.source = source
+        self.client = client
+    
+    def finish(self, status):
+        for command in self.commands:
+            if command.status == 'queued':
+                command.status = status
+        self.done.set()
+
+class DispatchClient:
+    """One client's queue, rate limit bucket and counters"""
+    __slots__ = ('key', 'jobs', 'pending', 'ready', 'tokens', 'refilled', 'last_seen',
+                 'events', 'min_offset', 'submitted', 'injected', 'dropped', 'rejected',
+                 'rate_limited', 'duplicates', 'coalesced', 'expired',
+                 'queue_wait_total', 'queue_wait_max')
+    
+    def __init__(self, key, burst):
+        self.key = key
+        self.jobs = collections.deque()
+        self.pending = 0
+        # Whether the client is in the scheduler's round-robin
+        self.ready = False
+        self.tokens = burst
+        self.refilled = self.last_seen = time.monotonic()
+        # Recently queued event ids, and the smallest (arrival - sent_ms) seen
+        self.events = collections.OrderedDict()
+        self.min_offset = None
+        self.submitted = self.injected = self.dropped = self.rejected = self.rate_limited = 0
+        self.duplicates = self.coalesced = self.expired = 0
+        self.queue_wait_total = self.queue_wait_max = 0.0
+    
+    def stats(self):
+        return {
+            "client": self.key,
+            "queued": self.pending,
+            "submitted": self.submitted,
+            "injected": self.injected,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "rate_limited": self.rate_limited,
+            "duplicates": self.duplicates,
+            "coalesced": self.coalesced,
+            "expired": self.expired,
+            "queue_wait_ms_avg": round(self.queue_wait_total / self.injected * 1000, 3) if self.injected else 0.0,
+            "queue_wait_ms_max": round(self.queue_wait_max * 1000, 3),
+            "idle_s": round(time.monotonic() - self.last_seen, 1),
+        }
+
+class Coalescer:
+    """Filters duplicate, piled-up and stale commands before they are queued
+    
+    Phones resend commands after a timeout and keep firing repeats while
+    the network stalls. Any command may carry:
+    
+      event_id   - client-chosen id; a repeated id from the same client is
+                   acknowledged again without being injected twice
+      sent_ms    - the client's clock when the command was sent
+      max_age_ms - how long the command stays worth injecting (defaults to
+                   the configured max_age_ms; 0 means forever)
+    
+    Age is measured the way UDP freshness is: relative to the fastest
+    command seen from that client, so clock skew does not matter. Commands
+    that are too old on arrival are not queued, and the injector skips
+    queued ones whose deadline has passed. At most `max_repeat_backlog`
+    repeats of the same arrow wait per client; further ones are dropped.
+    After a hiccup the PC therefore catches up with the latest input
+    instead of replaying the backlog.
+    """
+    
+    # A sender this far behind its fastest command probably changed its clock
+    CLOCK_RESET_MS = 60000
+    
+    def __init__(self):
+        self.event_window = 256
+        self.max_repeat_backlog = 3
+        self.max_age_ms = 0
+    
+    def configure(self, coalesce_config):
+        self.event_window = coalesce_config.get('event_window', 256)
+        self.max_repeat_backlog = coalesce_config.get('max_repeat_backlog', 3)
+        self.max_age_ms = coalesce_config.get('max_age_ms', 0)
+    
+    def filter(self, dispatch_client, commands):
+        """Mark commands that should not be queued; returns the rest
+        
+        Called with the dispatcher lock held.
+        """
+        accepted = []
+        seen = dispatch_client.events
+        batch_ids = set()
+        for command in commands:
+            event_id = command.event_id
+            if event_id is not None:
+                if event_id in seen or event_id in batch_ids:
+                    command.status = 'duplicate'
+                    dispatch_client.duplicates += 1
+                    metrics.coalesced('duplicate')
+                    continue
+                batch_ids.add(event_id)
+            if not self._set_deadline(dispatch_client, command):
+                command.status = 'expired'
+                dispatch_client.expired += 1
+                metrics.coalesced('expired')
+                continue
+            accepted.append(command)
+        
+        if len(accepted) == 1 and len(commands) == 1 and self.max_repeat_backlog:
+            repeat_key = accepted[0].repeat_key
+            if repeat_key is not None:
+                backlog = sum(1 for job in dispatch_client.jobs if job.repeat_key == repeat_key)
+                if backlog >= self.max_repeat_backlog:
+                    accepted[0].status = 'dropped'
+                    dispatch_client.coalesced += 1
+                    metrics.coalesced('backlog')
+                    return []
+        return accepted
+    
+    def remember(self, dispatch_client, commands):
+        """Record the event ids of commands that were queued"""
+        seen = dispatch_client.events
+        for command in commands:
+            if command.event_id is not None:
+                seen[command.event_id] = None
+        while len(seen) > self.event_window:
+            seen.popitem(last=False)
+    
+    def _set_deadline(self, dispatch_client, command):
+        """Give the command a deadline; False if it is already too old"""
+        max_age = command.max_age if command.max_age is not None else self.max_age_ms
+        if not max_age:
+            return True
+        age = 0.0
+        if command.sent is not None:
+            offset = time.time() * 1000 - command.sent
+            if dispatch_client.min_offset is None or offset < dispatch_client.min_offset:
+                dispatch_client.min_offset = offset
+            age = offset - dispatch_client.min_offset
+            if age > self.CLOCK_RESET_MS:
+                dispatch_client.min_offset = offset
+                return False
+        if age >= max_age:
+            return False
+        command.deadline = time.perf_counter() + (max_age - age) / 1000.0
+        return True
+
+coalescer = Coalescer()
+
+class InputDispatcher:
+    """Per-client input queues drained by a single injector thread
+    
+    Every injection goes through here, so keystrokes are delivered in the
+    order they were accepted no matter which server thread accepted them,
+    and request threads never block on slow injections. Each client (see
+    request_client()) has its own queue of at most `max_size` commands and
+    an optional rate limit; the injector takes one job from each client in
+    turn, so a flood from one phone cannot starve another. A client can
+    also lease exclusive control for a while. When a client's queue is full
+    the overflow policy decides what happens to its new commands:
+    
+      drop_oldest - discard the client's oldest queued commands to make room
+      coalesce    - discard the client's queued repeats of the command, else reject
+      reject      - refuse the new command (HTTP 429)
+    """
+    
+    OVERFLOW_POLICIES = ('drop_oldest', 'coalesce', 'reject')
+    MAX_CLIENTS = 64
+    # Server-generated commands were rate limited when they were requested
+    UNLIMITED_SOURCES = (JOURNAL_SOURCES.index('repeat'), JOURNAL_SOURCES.index('macro'))
+    
+    def __init__(self, max_size=64, overflow='drop_oldest'):
+        self.max_size = max_size
+        self.overflow = overflow
+        self.rate = 0.0
+        self.burst = 0.0
+        self.max_lease = 60.0
+        self._clients = collections.OrderedDict()
+        self._ready = collections.deque()
+        self._pending = 0
+        self._lease_client = None
+        self._lease_expires = 0.0
+        self._cond = threading.Condition()
+        self._thread = None
+    
+    def configure(self, max_size=None, overflow=None, rate=None, burst=None, max_lease_ms=None):
+        """Apply queue settings from the configuration"""
+        if overflow is not None:
+            if overflow not in self.OVERFLOW_POLICIES:
+                print(f"Warning: unknown overflow policy '{overflow}', using drop_oldest")
+                overflow = 'drop_oldest'
+            self.overflow = overflow
+        if max_size is not None:
+            self.max_size = max(1, int(max_size))
+        if rate is not None:
+            self.rate = max(0.0, float(rate))
+        if burst is not None:
+            self.burst = max(1.0, float(burst))
+        elif self.rate and not self.burst:
+            # Below one token a client could never send anything
+            self.burst = max(1.0, self.rate)
+        if max_lease_ms is not None:
+            self.max_lease = max_lease_ms / 1000.0
+    
+    @property
+    def depth(self):
+        """Number of commands waiting to be injected"""
+        return self._pending
+    
+    def submit(self, commands, wait=False, timeout=None, source='http', client=None):
+        """Queue commands as one job on the client's queue (keyed by `client`, else `source`)
+        
+        Returns the job, after injection if wait=True; raises QueueFullError or a subclass if refused.
+        """
+        source_index = JOURNAL_SOURCES.index(source)
+        client_key = client or source
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='input-dispatch', daemon=True)
+                self._thread.start()
+            dispatch_client = self._client(client_key)
+            now = dispatch_client.last_seen = time.monotonic()
+            if self._lease_client not in (None, client_key) and now < self._lease_expires:
+                dispatch_client.rejected += len(commands)
+                raise LeaseHeldError("Another client has exclusive control")
+            queued = coalescer.filter(dispatch_client, commands)
+            if not queued:
+                job = DispatchJob(commands, source_index, dispatch_client)
+                job.done.set()
+                return job
+            commands = queued
+            if self.rate and source_index not in self.UNLIMITED_SOURCES:
+                dispatch_client.tokens = min(self.burst, dispatch_client.tokens
+                                             + (now - dispatch_client.refilled) * self.rate)
+                dispatch_client.refilled = now
+                if dispatch_client.tokens < len(commands):
+                    dispatch_client.rate_limited += len(commands)
+                    raise RateLimitedError("Rate limit exceeded")
+                dispatch_client.tokens -= len(commands)
+            job = DispatchJob(commands, source_index, dispatch_client)
+            try:
+                self._make_room(dispatch_client, len(commands), job.repeat_key)
+            except QueueFullError:
+                dispatch_client.rejected += len(commands)
+                raise
+            dispatch_client.jobs.append(job)
+            coalescer.remember(dispatch_client, commands)
+            dispatch_client.pending += len(commands)
+            dispatch_client.submitted += len(commands)
+            self._pending += len(commands)
+            if not dispatch_client.ready:
+                dispatch_client.ready = True
+                self._ready.append(dispatch_client)
+            self._cond.notify()
+        if wait:
+            job.done.wait(timeout)
+        return job
+    
+    def _client(self, key):
+        dispatch_client = self._clients.get(key)
+        if dispatch_client is None:
+            dispatch_client = self._clients[key] = DispatchClient(key, self.burst)
+            if len(self._clients) > self.MAX_CLIENTS:
+                # Forget the longest-idle client that has nothing queued
+                for idle in self._clients.values():
+                    if not idle.ready and idle is not dispatch_client:
+                        del self._clients[idle.key]
+                        break
+        else:
+            self._clients.move_to_end(key)
+        return dispatch_client
+    
+    def _make_room(self, dispatch_client, size, repeat_key):
+        if dispatch_client.pending + size <= self.max_size:
+            return
+        
+        jobs = dispatch_client.jobs
+        if self.overflow == 'drop_oldest':
+            while jobs and dispatch_client.pending + size > self.max_size:
+                self._discard(dispatch_client, jobs.popleft())
+        elif self.overflow == 'coalesce' and repeat_key is not None:
+            kept = collections.deque()
+            for job in jobs:
+                if job.repeat_key == repeat_key:
+                    self._discard(dispatch_client, job)
+                else:
+                    kept.append(job)
+            dispatch_client.jobs = kept
+        
+        if dispatch_client.pending + size > self.max_size:
+            raise QueueFullError("Input queue full")
+    
+    def _discard(self, dispatch_client, job):
+        dispatch_client.pending -= len(job.commands)
+        dispatch_client.dropped += len(job.commands)
+        self._pending -= len(job.commands)
+        job.finish('dropped')
+    
+    def acquire_lease(self, client, ttl):
+        """Give a client exclusive control for ttl seconds (capped at max_lease)
+        
+        Renews the client's own lease. Returns (granted, seconds left).
+        """
+        now = time.monotonic()
+        with self._cond:
+            if self._lease_client not in (None, client) and now < self._lease_expires:
+                return False, self._lease_expires - now
+            ttl = min(max(0.0, ttl), self.max_lease)
+            self._lease_client, self._lease_expires = client, now + ttl
+            return True, ttl
+    
+    def release_lease(self, client):
+        with self._cond:
+            if self._lease_client != client:
+                return False
+            self._lease_client = None
+            return True
+    
+    def lease(self):
+        """(client, seconds left) of the current lease, or (None, 0)"""
+        with self._cond:
+            remaining = self._lease_expires - time.monotonic()
+            if self._lease_client is None or remaining <= 0:
+                return None, 0.0
+            return self._lease_client, remaining
+    
+    def client_stats(self):
+        with self._cond:
+            return [dispatch_client.stats() for dispatch_client in self._clients.values()]
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._ready:
+                    self._cond.wait()
+                # Round-robin: one job per client per turn
+                dispatch_client = self._ready.popleft()
+                if not dispatch_client.jobs:
+                    dispatch_client.ready = False
+                    continue
+                job = dispatch_client.jobs.popleft()
+                dispatch_client.pending -= len(job.commands)
+                self._pending -= len(job.commands)
+                if dispatch_client.jobs:
+                    self._ready.append(dispatch_client)
+                else:
+                    dispatch_client.ready = False
+            
+            start = time.perf_counter()
+            queue_wait = start - job.enqueued
+            metrics.observe('queue_wait', queue_wait)
+            dispatch_client.queue_wait_max = max(dispatch_client.queue_wait_max, queue_wait)
+            for command in job.commands:
+                if command.deadline is not None and start > command.deadline:
+                    command.status = 'expired'
+                    dispatch_client.expired += 1
+                    metrics.coalesced('expired')
+                    continue
+                dispatch_client.injected += 1
+                dispatch_client.queue_wait_total += queue_wait
+                try:
+                    command.inject()
+                    command.status = 'done'
+                except Exception as e:
+                    command.status = 'failed'
+                    command.error = e
+                    metrics.error('injection_failed')
+                    print(f"Input injection error: {e}")
+                end = time.perf_counter()
+                command.queue_wait = queue_wait
+                command.duration = end - start
+                metrics.observe('injection', end - start)
+                journal.append(job.source, command, queue_wait, end - start)
+                start = end
+            job.finish('done')
+
+dispatcher = InputDispatcher()
+
+def _wait_requested(data):
+    """Whether the client wants the response only after injection
+    
+    Asking for timing implies waiting, since the times are only known then.
+    """
+    if isinstance(data, dict) and data.get('timing'):
+        return True
+    wait = data.get('wait') if isinstance(data, dict) else None
+    if wait is None:
+        wait = config.get('dispatch', {}).get('wait', False)
+    return bool(wait)
+
+MAX_EVENT_ID_LENGTH = 64
+
+def _optional_number(data, field):
+    value = data.get(field)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise CommandError(f"Invalid {field}")
+    return value
+
+def prepare_command(name, data):
+    """Validate a command, returning it ready for injection"""
+    handler = COMMANDS.get(name)
+    if handler is None:
+        raise CommandError("Unknown command")
+    if not isinstance(data, dict):
+        raise CommandError("Invalid command payload")
+    command = handler(data)
+    command.spec = {field: data[field] for field in COMMAND_FIELDS[name] if field in data}
+    command.spec['cmd'] = name
+    
+    event_id = data.get('event_id')
+    if event_id is not None:
+        if isinstance(event_id, bool) or not isinstance(event_id, (str, int)):
+            raise CommandError("Invalid event_id")
+        event_id = str(event_id)
+        if len(event_id) > MAX_EVENT_ID_LENGTH:
+            raise CommandError("Invalid event_id")
+        command.event_id = event_id
+    command.sent = _optional_number(data, 'sent_ms')
+    command.max_age = _optional_number(data, 'max_age_ms')
+    command.timing = bool(data.get('timing'))
+    return command
+
+def run_command(name, data, source='http', client=None):
+    """Validate and queue a single command, returning its result payload"""
+    command = prepare_command(name, data)
+    dispatcher.submit([command], wait=_wait_requested(data), source=source, client=client)
+    return command.response()
+
+def run_batch(commands, wait=False, source='http', client=None):
+    """Queue commands strictly in order, returning one result per command
+    
+    All valid commands are queued as a single job, so commands accepted on
+    other threads cannot interleave with the batch.
+    """
+    results = []
+    prepared = []
+    for data in commands:
+        try:
+            name = data.get('cmd') if isinstance(data, dict) else None
+            command = prepare_command(name, data)
+            prepared.append(command)
+            results.append(command)
+        except CommandError as e:
+            metrics.error('bad_request')
+            results.append({"error": str(e)})
+    
+    if prepared:
+        wait = wait or any(command.timing for command in prepared)
+        dispatcher.submit(prepared, wait=wait, source=source, client=client)
+    
+    for i, entry in enumerate(results):
+        if isinstance(entry, PreparedCommand):
+            try:
+                results[i] = entry.response()
+            except RuntimeError:
+                results[i] = {"error": "Injection failed"}
+    return results
+
+class RepeatSession:
+    """A held arrow key that the server repeats until stopped"""
+    __slots__ = ('session_id', 'direction', 'interval', 'next_time', 'last_heartbeat', 'count', 'client')
+    
+    def __init__(self, session_id, direction, interval, next_time, now, client=None):
+        self.session_id = session_id
+        self.direction = direction
+        self.client = client
+        self.interval = interval
+        self.next_time = next_time
+        self.last_heartbeat = now
+        self.count = 0
+
+class RepeatManager:
+    """Server-side key auto-repeat for held gestures
+    
+    Each session repeats its key at `interval_ms`, shrinking the interval by
+    the `acceleration` factor after every repeat down to `min_interval_ms`.
+    A session ends on an explicit stop, or when no heartbeat has arrived for
+    `heartbeat_timeout_ms`, so a lost client cannot leave a key repeating.
+    """
+    
+    def __init__(self):
+        self.delay = 0.2
+        self.interval = 0.2
+        self.min_interval = 0.05
+        self.acceleration = 0.9
+        self.heartbeat_timeout = 1.5
+        self.max_sessions = 8
+        self._sessions = {}
+        self._cond = threading.Condition()
+        self._thread = None
+    
+    def configure(self, repeat_config):
+        """Apply the repeat section of the configuration"""
+        self.delay = repeat_config.get('delay_ms', self.delay * 1000) / 1000.0
+        self.interval = repeat_config.get('interval_ms', self.interval * 1000) / 1000.0
+        self.min_interval = repeat_config.get('min_interval_ms', self.min_interval * 1000) / 1000.0
+        self.acceleration = min(1.0, max(0.1, repeat_config.get('acceleration', self.acceleration)))
+        self.heartbeat_timeout = repeat_config.get('heartbeat_timeout_ms', self.heartbeat_timeout * 1000) / 1000.0
+        self.max_sessions = max(1, repeat_config.get('max_sessions', self.max_sessions))
+    
+    def start(self, direction, client=None):
+        """Start repeating an arrow key, returning the new session id"""
+        now = time.monotonic()
+        session = RepeatSession(secrets.token_hex(8), direction, self.interval, now + self.delay, now, client)
+        with self._cond:
+            if len(self._sessions) >= self.max_sessions:
+                # Evict the session that has gone longest without a heartbeat
+                oldest = min(self._sessions.values(), key=lambda s: s.last_heartbeat)
+                del self._sessions[oldest.session_id]
+            self._sessions[session.session_id] = session
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='key-repeat', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return session.session_id
+    
+    def stop(self, session_id, client=None):
+        """Stop a session; returns False if it was unknown, over or not the caller's"""
+        with self._cond:
+            session = self._sessions.get(session_id)
+            if session is None or session.client != client:
+                return False
+            del self._sessions[session_id]
+            return True
+    
+    def heartbeat(self, session_id, client=None):
+        """Keep a session alive; returns False if it was unknown, expired or not the caller's"""
+        with self._cond:
+            session = self._sessions.get(session_id)
+            if session is None or session.client != client:
+                return False
+            session.last_heartbeat = time.monotonic()
+            return True
+    
+    def _run(self):
+        while True:
+            due = []
+            with self._cond:
+                while not self._sessions:
+                    self._cond.wait()
+                now = time.monotonic()
+                for session in list(self._sessions.values()):
+                    if now - session.last_heartbeat > self.heartbeat_timeout:
+                        del self._sessions[session.session_id]
+                    elif session.next_time <= now:
+                        due.append((session.direction, session.client))
+                        session.count += 1
+                        session.interval = max(self.min_interval, session.interval * self.acceleration)
+                        session.next_time = max(session.next_time + session.interval, now)
+                if self._sessions and not due:
+                    next_time = min(s.next_time for s in self._sessions.values())
+                    next_expiry = min(s.last_heartbeat for s in self._sessions.values()) + self.heartbeat_timeout
+                    self._cond.wait(max(0.0, min(next_time, next_expiry) - now))
+            
+            for direction, client in due:
+                try:
+                    dispatcher.submit([prepare_command('arrow', {'direction': direction})],
+                                      source='repeat', client=client)
+                except QueueFullError:
+                    pass
+
+repeat_manager = RepeatManager()
+
+def start_hold(data, source='http', client=None):
+    """Inject an arrow press and keep repeating it server-side"""
+    result = run_command('arrow', data, source, client)
+    if result.get('status') != 'ok':
+        return result
+    return dict(result, session=repeat_manager.start(str(data['direction']).lower(), client))
+
+def request_client():
+    """Dispatch client key for the current HTTP request
+    
+    Clients can name themselves with X-Client-Id; otherwise each session
+    ticket, or failing that each address, counts as one client.
+    """
+    environ = request.environ
+    client_id = environ.get('HTTP_X_CLIENT_ID')
+    if client_id:
+        return 'id:' + client_id[:64]
+    ticket = environ.get('HTTP_X_TICKET')
+    if ticket:
+        # Never expose the ticket itself in the client stats
+        return 'ticket:' + hashlib.sha256(ticket.encode('latin-1')).hexdigest()[:12]
+    return 'http:' + environ.get('REMOTE_ADDR', '')
+
+class MacroManager:
+    """Journal segments recorded on request and replayed through the dispatcher
+    
+    A macro is just a range of journal sequence numbers, so recording costs
+    nothing beyond the journal itself. Playback keeps the original gaps
+    between commands, multiplied by `scale` (0 replays back to back).
+    Commands that were themselves replayed, or whose text was redacted, are
+    skipped.
+    """
+    
+    MAX_MACROS = 64
+    MAX_SCALE = 100.0
+    
+    def __init__(self):
+        self.recordings = {}
+        self.macros = collections.OrderedDict()
+        self.playbacks = {}
+        self._lock = threading.Lock()
+    
+    def record(self):
+        """Start recording; returns (macro id, first sequence)"""
+        macro_id = secrets.token_hex(4)
+        with self._lock:
+            self.recordings[macro_id] = journal.next_sequence
+        return macro_id, journal.next_sequence
+    
+    def stop(self, macro_id):
+        """Finish a recording; returns (first, last) or None if unknown"""
+        with self._lock:
+            first = self.recordings.pop(macro_id, None)
+            if first is None:
+                return None
+            self.macros[macro_id] = (first, journal.next_sequence)
+            while len(self.macros) > self.MAX_MACROS:
+                self.macros.popitem(last=False)
+            return self.macros[macro_id]
+    
+    def segment(self, macro_id):
+        with self._lock:
+            return self.macros.get(macro_id)
+    
+    def play(self, first, last, scale=1.0, client=None):
+        """Replay a journal segment in the background; returns (playback id, commands, seconds)"""
+        if not (math.isfinite(scale) and 0 <= scale <= self.MAX_SCALE):
+            raise ValueError(f"scale must be between 0 and {self.MAX_SCALE:g}")
+        entries = [e for e in journal.entries(first, last)
+                   if e['command'] is not None and not e['redacted'] and e['source'] != 'macro']
+        duration = (entries[-1]['time'] - entries[0]['time']) * scale if entries else 0.0
+        playback_id = secrets.token_hex(4)
+        cancel = threading.Event()
+        with self._lock:
+            self.playbacks[playback_id] = cancel
+        threading.Thread(target=self._play, args=(playback_id, entries, scale, cancel, client),
+                         name='macro-playback', daemon=True).start()
+        return playback_id, len(entries), duration
+    
+    def cancel(self, playback_id):
+        with self._lock:
+            cancel = self.playbacks.get(playback_id)
+        if cancel is None:
+            return False
+        cancel.set()
+        return True
+    
+    def _play(self, playback_id, entries, scale, cancel, client):
+        try:
+            started = time.monotonic()
+            for entry in entries:
+                delay = started + (entry['time'] - entries[0]['time']) * scale - time.monotonic()
+                if cancel.wait(delay) if delay > 0 else cancel.is_set():
+                    break
+                command = entry['command']
+                try:
+                    dispatcher.submit([prepare_command(command['cmd'], command)], source='macro', client=client)
+                except (CommandError, QueueFullError) as e:
+                    print(f"Macro playback skipped a command: {e}")
+        finally:
+            with self._lock:
+                self.playbacks.pop(playback_id, None)
+
+macro_manager = MacroManager()
+
+POINTER_BUTTONS = ('left', 'right', 'middle')
+POINTER_BUTTON_ACTIONS = ('click', 'down', 'up', 'double')
+# Entries (samples, button events and scroll steps) accepted per request
+MAX_POINTER_EVENTS = 256
+
+def _pointer_entries(data, field, parse):
+    entries = data.get(field) or []
+    if not isinstance(entries, list):
+        raise CommandError(f"Invalid {field}")
+    parsed = []
+    for entry in entries:
+        if not isinstance(entry, (list, tuple)) or len(entry) != 3:
+            raise CommandError(f"Invalid {field}")
+        parsed.append(parse(entry))
+    return parsed
+
+def _pointer_motion(entry):
+    if any(isinstance(v, bool) or not isinstance(v, (int, float)) for v in entry):
+        raise CommandError("Invalid pointer sample")
+    return float(entry[0]), float(entry[1]), float(entry[2])
+
+def _pointer_button(entry):
+    time_ms, button, action = entry
+    if (isinstance(time_ms, bool) or not isinstance(time_ms, (int, float))
+            or button not in POINTER_BUTTONS or action not in POINTER_BUTTON_ACTIONS):
+        raise CommandError("Invalid pointer button")
+    return float(time_ms), button, action
+
+def parse_pointer(data):
+    """Validate a pointer payload, returning (samples, buttons, scroll) lists"""
+    if not isinstance(data, dict):
+        raise CommandError("Invalid pointer payload")
+    samples = _pointer_entries(data, 'samples', _pointer_motion)
+    buttons = _pointer_entries(data, 'buttons', _pointer_button)
+    scroll = _pointer_entries(data, 'scroll', _pointer_motion)
+    if len(samples) + len(buttons) + len(scroll) > MAX_POINTER_EVENTS:
+        raise CommandError("Too many pointer events")
+    return samples, buttons, scroll
+
+class PointerStream:
+    """One client's timestamped pointer input, waiting to be played out"""
+    __slots__ = ('client', 'min_offset', 'last_time', 'last_play', 'segments', 'events',
+                 'remainder_x', 'remainder_y', 'held', 'last_seen')
+    
+    def __init__(self, client):
+        self.client = client
+        # Smallest (arrival - client time) seen: the client's fastest path to us
+        self.min_offset = None
+        self.last_time = None
+        self.last_play = None
+        # [start, end, dx, dy, fraction already emitted], in playout order
+        self.segments = collections.deque()
+        # (playout time, kind, args) for buttons and scrolling
+        self.events = collections.deque()
+        self.remainder_x = self.remainder_y = 0.0
+        self.held = set()
+        self.last_seen = time.monotonic()
+
+class PointerStreamer:
+    """Relative pointer motion from streamed, timestamped delta batches
+    
+    Phones send batches of (time, dx, dy) samples plus button and scroll
+    events. Every sample is scheduled at its client time shifted by the
+    sender's fastest observed delay plus `jitter_ms`, so a burst that was
+    held up on Wi-Fi still plays out with its original spacing. The output
+    thread wakes at `rate_hz` while motion is pending and moves the pointer
+    by the part of each sample that falls into the elapsed interval, which
+    spreads coarse input over display frames. Sample deltas are scaled by
+    `sensitivity` and by an acceleration curve on their speed:
+    
+      gain = min(max_gain, 1 + acceleration * speed in counts per ms)
+    
+    Buttons left down are released after HOLD_TIMEOUT without input, so a
+    lost client cannot leave a drag in progress.
+    """
+    
+    MAX_STREAMS = 16
+    MAX_PENDING = 512
+    HOLD_TIMEOUT = 3.0
+    # A sample this far behind its playout time means the client clock jumped
+    CLOCK_RESET_MS = 1000.0
+    # Longer gaps between samples start a new stroke instead of being interpolated
+    MAX_SEGMENT_MS = 100.0
+    
+    def __init__(self):
+        self.rate_hz = 120
+        self.jitter_ms = 30.0
+        self.sensitivity = 1.0
+        self.acceleration = 0.0
+        self.max_gain = 4.0
+        self._streams = collections.OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+        # When the output thread next wakes up (perf_counter), None while idle
+        self._wake_at = None
+    
+    def configure(self, pointer_config):
+        """Apply the pointer section of the configuration"""
+        self.rate_hz = pointer_config.get('rate_hz', 120)
+        self.jitter_ms = pointer_config.get('jitter_ms', 30)
+        self.sensitivity = pointer_config.get('sensitivity', 1.0)
+        self.acceleration = pointer_config.get('acceleration', 0.0)
+        self.max_gain = pointer_config.get('max_gain', 4.0)
+    
+    def submit(self, client, samples=(), buttons=(), scroll=()):
+        """Schedule parsed pointer input from one client; returns the number of entries
+        
+        Raises LeaseHeldError while another client holds the input lease.
+        """
+        holder, _ = dispatcher.lease()
+        if holder not in (None, client):
+            raise LeaseHeldError("Another client has exclusive control")
+        now = time.perf_counter() * 1000.0
+        with self._cond:
+            stream = self._stream(client)
+            stream.last_seen = time.monotonic()
+            times = [entry[0] for entries in (samples, buttons, scroll) for entry in entries]
+            if not times:
+                return 0
+            # The newest entry came the fastest way, so it sets the clock offset
+            self._sync_clock(stream, max(times), now)
+            first = float('inf')
+            for time_ms, dx, dy in sorted(samples):
+                self._add_sample(stream, self._playout(stream, time_ms), time_ms, dx, dy)
+                first = min(first, stream.segments[-1][0])
+            for time_ms, button, action in buttons:
+                play = self._playout(stream, time_ms)
+                stream.events.append((play, 'button', (button, action)))
+                first = min(first, play)
+            for time_ms, dx, dy in scroll:
+                play = self._playout(stream, time_ms)
+                stream.events.append((play, 'scroll', (int(dx), int(dy))))
+                first = min(first, play)
+            if buttons or scroll:
+                stream.events = collections.deque(sorted(stream.events, key=lambda event: event[0]))
+            while len(stream.segments) > self.MAX_PENDING:
+                # Too far behind: jump over the oldest motion instead of replaying it
+                stream.segments.popleft()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='pointer', daemon=True)
+                self._thread.start()
+            # While the thread is ticking it picks new input up on its own
+            if self._wake_at is None or first / 1000.0 < self._wake_at:
+                self._cond.notify()
+        return len(samples) + len(buttons) + len(scroll)
+    
+    def release(self, client):
+        """Drop a client's pending input and release its buttons"""
+        with self._cond:
+            stream = self._streams.pop(client, None)
+        if stream is not None:
+            self._release_buttons(stream)
+    
+    def _stream(self, client):
+        stream = self._streams.get(client)
+        if stream is None:
+            stream = self._streams[client] = PointerStream(client)
+            if len(self._streams) > self.MAX_STREAMS:
+                for idle in self._streams.values():
+                    if not (idle.segments or idle.events or idle.held):
+                        del self._streams[idle.client]
+                        break
+        else:
+            self._streams.move_to_end(client)
+        return stream
+    
+    def _sync_clock(self, stream, time_ms, now):
+        offset = now - time_ms
+        if (stream.min_offset is None or offset < stream.min_offset
+                or offset - stream.min_offset > self.CLOCK_RESET_MS):
+            stream.min_offset = offset
+    
+    def _playout(self, stream, time_ms):
+        """Server time (perf_counter ms) at which a client timestamp plays out"""
+        return time_ms + stream.min_offset + self.jitter_ms
+    
+    def _add_sample(self, stream, play, time_ms, dx, dy):
+        if stream.last_time is not None and time_ms > stream.last_time:
+            elapsed = time_ms - stream.last_time
+        else:
+            elapsed = 1000.0 / self.rate_hz
+        if self.acceleration:
+            speed = math.hypot(dx, dy) / elapsed
+            gain = self.sensitivity * min(self.max_gain, 1.0 + self.acceleration * speed)
+        else:
+            gain = self.sensitivity
+        start = stream.last_play
+        if start is None or play - start > self.MAX_SEGMENT_MS or start > play:
+            start = play - min(elapsed, 1000.0 / self.rate_hz)
+        stream.segments.append([start, play, dx * gain, dy * gain, 0.0])
+        stream.last_time = max(time_ms, stream.last_time or time_ms)
+        stream.last_play = max(play, start)
+    
+    def _motion(self, stream, until):
+        """Integer motion due by `until`; sub-count remainders carry over"""
+        dx = dy = 0.0
+        segments = stream.segments
+        while segments and segments[0][0] < until:
+            start, end, seg_dx, seg_dy, done = segments[0]
+            fraction = 1.0 if end <= until else (until - start) / (end - start)
+            dx += seg_dx * (fraction - done)
+            dy += seg_dy * (fraction - done)
+            if fraction < 1.0:
+                segments[0][4] = fraction
+                break
+            segments.popleft()
+        x = stream.remainder_x + dx
+        y = stream.remainder_y + dy
+        # Segment fractions can add up to 0.999...; do not lose that count
+        move_x, move_y = int(round(x, 9)), int(round(y, 9))
+        stream.remainder_x, stream.remainder_y = x - move_x, y - move_y
+        return move_x, move_y
+    
+    def _collect(self, now):
+        """Actions due by `now`, in order; called with the lock held"""
+        actions = []
+        total_x = total_y = 0
+        idle_before = time.monotonic() - self.HOLD_TIMEOUT
+        for stream in list(self._streams.values()):
+            while stream.events and stream.events[0][0] <= now:
+                play, kind, args = stream.events.popleft()
+                move_x, move_y = self._motion(stream, play)
+                if move_x or move_y:
+                    actions.append(('move', (move_x, move_y)))
+                actions.append((kind, args))
+                if kind == 'button':
+                    button, action = args
+                    if action == 'down':
+                        stream.held.add(button)
+                    elif action == 'up':
+                        stream.held.discard(button)
+            move_x, move_y = self._motion(stream, now)
+            total_x += move_x
+            total_y += move_y
+            if stream.held and not stream.segments and stream.last_seen < idle_before:
+                actions.extend(('button', (button, 'up')) for button in stream.held)
+                stream.held.clear()
+        if total_x or total_y:
+            actions.append(('move', (total_x, total_y)))
+        return actions
+    
+    def _release_buttons(self, stream):
+        for button in list(stream.held):
+            try:
+                input_backend.button(button, False)
+            except Exception as e:
+                print(f"Pointer injection error: {e}")
+        stream.held.clear()
+    
+    def _inject(self, kind, args):
+        if kind == 'move':
+            input_backend.move(*args)
+        elif kind == 'scroll':
+            input_backend.scroll(*args)
+        else:
+            button, action = args
+            if action in ('click', 'double', 'down'):
+                input_backend.button(button, True)
+            if action in ('click', 'double', 'up'):
+                input_backend.button(button, False)
+            if action == 'double':
+                input_backend.button(button, True)
+                input_backend.button(button, False)
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    pending = [s for s in self._streams.values() if s.segments or s.events]
+                    if pending:
+                        break
+                    held = [s for s in self._streams.values() if s.held]
+                    self._wake_at = None
+                    if not held:
+                        self._cond.wait()
+                        continue
+                    # Only held buttons left: wake up when they time out
+                    timeout = min(s.last_seen for s in held) + self.HOLD_TIMEOUT - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                tick = time.perf_counter()
+                actions = self._collect(tick * 1000.0)
+                # Next frame, or later if nothing is due before then
+                upcoming = ([s.segments[0][0] for s in self._streams.values() if s.segments]
+                            + [s.events[0][0] for s in self._streams.values() if s.events])
+                self._wake_at = tick + 1.0 / self.rate_hz
+                if upcoming:
+                    self._wake_at = max(self._wake_at, min(upcoming) / 1000.0)
+            
+            start = time.perf_counter()
+            for kind, args in actions:
+                try:
+                    self._inject(kind, args)
+                except Exception as e:
+                    metrics.error('injection_failed')
+                    print(f"Pointer injection error: {e}")
+            if actions:
+                metrics.observe('injection', time.perf_counter() - start)
+            with self._cond:
+                delay = self._wake_at - time.perf_counter()
+                if delay > 0:
+                    self._cond.wait(delay)
+
+pointer_streamer = PointerStreamer()
+
+def binary_request():
+    """Whether the request body uses the compact binary encoding (see codec.py)"""
+    return request.mimetype == codec.CONTENT_TYPE
+
+def binary_response(results, status=200):
+    return Response(codec.encode_results(results), status=status, mimetype=codec.CONTENT_TYPE)
+
+def _reply(binary, result, status=200):
+    if binary:
+        return binary_response([result], status)
+    return jsonify(result), status
+
+def routed(f):
+    """Decorator letting a hub forward the endpoint's commands to other servers"""
+    def decorated_function(*args, **kwargs):
+        if not hub.enabled:
+            return f(*args, **kwargs)
+        return hub.route_request(f, args, kwargs)
+    decorated_function.__name__ = f.__name__
+    return decorated_function
+
+def command_response(name):
+    """Run the request's command for an HTTP endpoint and build the response
+    
+    The response is JSON, or a binary result frame for binary requests.
+    """
+    binary = binary_request()
+    try:
+        start = time.perf_counter()
+        if binary:
+            data = codec.decode(request.get_data(cache=False), limit=1)[0]
+            if data['cmd'] != name:
+                raise CommandError("Command does not match endpoint")
+        else:
+            # Keep the endpoint-specific "Missing ..." messages for empty bodies
+            data = request.get_json() or {}
+        command = prepare_command(name, data)
+        metrics.observe('parse', time.perf_counter() - start)
+        dispatcher.submit([command], wait=_wait_requested(data), client=request_client())
+        result = command.response()
+        if command.timing:
+            # Everything the server spent on the request, auth and parsing included
+            result = dict(result, server_ms=round((time.perf_counter() - request.environ['flow.start']) * 1000, 3))
+        return _reply(binary, result)
+    except (CommandError, codec.CodecError) as e:
+        metrics.error('bad_request')
+        return _reply(binary, {"error": str(e)}, 400)
+    except QueueFullError as e:
+        metrics.error(e.kind)
+        return _reply(binary, {"error": str(e)}, e.status)
+
+@app.route('/arrow', methods=['POST'])
+@require_auth
+@routed
+def arrow_key():
+    """Send arrow key press, optionally starting a server-side repeat"""
+    data = None if binary_request() else request.get_json()
+    if isinstance(data, dict) and data.get('hold'):
+        try:
+            return jsonify(start_hold(data, client=request_client()))
+        except CommandError as e:
+            metrics.error('bad_request')
+            return jsonify({"error": str(e)}), 400
+        except QueueFullError as e:
+            metrics.error(e.kind)
+            return jsonify({"error": str(e)}), e.status
+    return command_response('arrow')
+
+@app.route('/repeat/stop', methods=['POST'])
+@require_auth
+@routed
+def repeat_stop():
+    """Stop a held-key repeat session"""
+    data = request.get_json()
+    if not isinstance(data, dict) or 'session' not in data:
+        return jsonify({"error": "Missing session"}), 400
+    if not repeat_manager.stop(str(data['session']), request_client()):
+        return jsonify({"error": "Unknown session"}), 404
+    return jsonify({"status": "ok", "action": "repeat_stop"})
+
+@app.route('/repeat/heartbeat', methods=['POST'])
+@require_auth
+@routed
+def repeat_heartbeat():
+    """Keep a held-key repeat session alive"""
+    data = request.get_json()
+    if not isinstance(data, dict) or 'session' not in data:
+        return jsonify({"error": "Missing session"}), 400
+    if not repeat_manager.heartbeat(str(data['session']), request_client()):
+        return jsonify({"error": "Unknown session"}), 404
+    return jsonify({"status": "ok", "action": "repeat_heartbeat"})
+
+@app.route('/key', methods=['POST'])
+@require_auth
+@routed
+def key_press():
+    """Send specific key press"""
+    return command_response('key')
+
+@app.route('/shortcuts', methods=['GET'])
+@require_auth
+def shortcut_list():
+    """Named shortcuts from the configuration, for building client buttons"""
+    return jsonify({"status": "ok",
+                    "shortcuts": {name: keymap.format_shortcut(chords) for name, chords in shortcuts.items()}})
+
+@app.route('/type', methods=['POST'])
+@require_auth
+@routed
+def type_text():
+    """Type text string"""
+    return command_response('type')
+
+@app.route('/type/<job_id>', methods=['GET'])
+@require_auth
+def type_status(job_id):
+    """Progress of a /type request"""
+    job = text_injector.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/volume', methods=['POST'])
+@require_auth
+@routed
+def volume_control():
+    """Control system volume"""
+    return command_response('volume')
+
+def volume_state(level, muted, version):
+    """Volume state payload shared by the readback endpoints"""
+    return {"status": "ok", "level": level, "muted": muted, "version": version}
+
+class VolumeWatchers:
+    """Caps the volume long-polls and event streams that hold an HTTP worker
+    
+    Each one keeps a request thread for its whole duration, so only a
+    quarter of the pool may be used this way. Event streams on the asyncio
+    core run on its stream pool and are not counted. Clients that want
+    unlimited updates can subscribe over the WebSocket channel instead.
+    """
+    
+    def __init__(self):
+        self.active = 0
+        self._lock = threading.Lock()
+    
+    def limit(self):
+        return max(1, config.get('server', {}).get('threads', 4) // 4)
+    
+    def acquire(self):
+        with self._lock:
+            if self.active >= self.limit():
+                return False
+            self.active += 1
+            return True
+    
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+volume_watchers = VolumeWatchers()
+
+def _too_many_watchers():
+    return jsonify({"error": "Too many volume watchers; use the WebSocket volume_subscribe command"}), 503
+
+@app.route('/volume', methods=['GET'])
+@require_auth
+def volume_get():
+    """Current volume; with ?since=<version> waits for the next change (long-poll)"""
+    since = request.args.get('since')
+    if since is None:
+        level, muted, version = volume_controller.get_volume()
+    else:
+        try:
+            since = int(since)
+        except ValueError:
+            return jsonify({"error": "Invalid since"}), 400
+        timeout = min(60.0, request.args.get('timeout', 25.0, type=float))
+        if not volume_watchers.acquire():
+            return _too_many_watchers()
+        try:
+            level, muted, version = volume_controller.wait_for_change(since, timeout)
+        finally:
+            volume_watchers.release()
+    if level is None:
+        return jsonify({"error": "Volume readback not available"}), 501
+    return jsonify(volume_state(level, muted, version))
+
+@app.route('/volume/events', methods=['GET'])
+@require_auth
+def volume_events():
+    """Server-sent events stream of volume changes"""
+    held = config.get('server', {}).get('core', 'waitress') != 'asyncio'
+    if held and not volume_watchers.acquire():
+        return _too_many_watchers()
+    updates = queue.Queue()
+    
+    def on_change(level, muted, version):
+        updates.put(volume_state(level, muted, version))
+    
+    def stream():
+        volume_controller.add_listener(on_change)
+        try:
+            level, muted, version = volume_controller.get_volume()
+            yield f"data: {json.dumps(volume_state(level, muted, version))}\n\n"
+            while True:
+                try:
+                    state = updates.get(timeout=15)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(state)}\n\n"
+        finally:
+            volume_controller.remove_listener(on_change)
+    
+    response = Response(stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    if held:
+        response.call_on_close(volume_watchers.release)
+    return response
+
+@app.route('/batch', methods=['POST'])
+@require_auth
+@routed
+def batch_commands():
+    """Run an ordered list of mixed commands in one request"""
+    if binary_request():
+        return binary_batch()
+    data = request.get_json()
+    if not isinstance(data, dict) or not isinstance(data.get('commands'), list):
+        return jsonify({"error": "Missing commands"}), 400
+    
+    commands = data['commands']
+    if len(commands) > MAX_BATCH_COMMANDS:
+        return jsonify({"error": "Too many commands"}), 400
+    
+    try:
+        results = run_batch(commands, wait=_wait_requested(data), client=request_client())
+    except QueueFullError as e:
+        metrics.error(e.kind)
+        return jsonify({"error": str(e)}), e.status
+    return jsonify({"status": "ok", "count": len(results), "results": results})
+
+def binary_batch():
+    """/batch for a binary body: one result frame per command frame"""
+    try:
+        commands = codec.decode(request.get_data(cache=False), limit=MAX_BATCH_COMMANDS)
+    except codec.CodecError as e:
+        metrics.error('bad_request')
+        return binary_response([{"error": str(e)}], 400)
+    wait = any(data.get('wait') for data in commands) or _wait_requested({})
+    try:
+        results = run_batch(commands, wait=wait, client=request_client())
+    except QueueFullError as e:
+        metrics.error(e.kind)
+        return binary_response([{"error": str(e)}], e.status)
+    return binary_response(results)
+
+@app.route('/pointer', methods=['POST'])
+@require_auth
+@routed
+def pointer_motion():
+    """Stream timestamped pointer samples, button and scroll events"""
+    binary = binary_request()
+    try:
+        if binary:
+            frames = codec.decode(request.get_data(cache=False), limit=MAX_BATCH_COMMANDS)
+            if any(frame['cmd'] != 'pointer' for frame in frames):
+                raise CommandError("Command does not match endpoint")
+        else:
+            frames = [request.get_json()]
+        client = request_client()
+        accepted = sum(pointer_streamer.submit(client, *parse_pointer(frame)) for frame in frames)
+    except (CommandError, codec.CodecError) as e:
+        metrics.error('bad_request')
+        return _reply(binary, {"error": str(e)}, 400)
+    except QueueFullError as e:
+        metrics.error(e.kind)
+        return _reply(binary, {"error": str(e)}, e.status)
+    return _reply(binary, {"status": "ok", "action": "pointer", "accepted": accepted})
+
+class LinkEstimate:
+    """Rolling round-trip, clock offset and jitter estimate for one client"""
+    __slots__ = ('samples', 'rtt', 'jitter', 'offset', 'count', 'last_seen', 'fragment')
+    
+    def __init__(self):
+        # (rtt, offset) of the most recent probes
+        self.samples = collections.deque(maxlen=LatencyTracker.WINDOW)
+        self.rtt = None
+        self.jitter = 0.0
+        self.offset = None
+        self.count = 0
+        self.last_seen = 0.0
+        # The estimate as JSON members, ready to splice into a probe response
+        self.fragment = ''
+    
+    def add(self, rtt, offset):
+        if self.rtt is None:
+            self.rtt = rtt
+        else:
+            # RFC 6298 smoothing for the RTT, RFC 3550 gain for the jitter
+            self.jitter += (abs(rtt - self.rtt) - self.jitter) / 16.0
+            self.rtt += (rtt - self.rtt) / 8.0
+        self.samples.append((rtt, offset))
+        # Queueing delay skews the offset, so trust the quickest recent exchange
+        self.offset = min(self.samples)[1]
+        self.count += 1
+        self.fragment = (f',"rtt_ms":{self.rtt:.3f},"offset_ms":{self.offset:.3f},'
+                         f'"jitter_ms":{self.jitter:.3f}')
+    
+    def stats(self):
+        return {"rtt_ms": round(self.rtt, 3), "offset_ms": round(self.offset, 3),
+                "jitter_ms": round(self.jitter, 3), "samples": self.count}
+
+class LatencyTracker:
+    """Per-client link estimates from /probe round trips
+    
+    A probe reply carries the server's receive and send times (t1, t2, wall
+    clock ms). The client echoes them in its next probe together with its
+    own send and receive times for that exchange (t0, t3), which gives one
+    NTP-style sample:
+    
+      rtt    = (t3 - t0) - (t2 - t1)
+      offset = ((t1 - t0) + (t2 - t3)) / 2    (server clock minus client clock)
+    
+    Estimates are keyed like the dispatch queues (see request_client()).
+    """
+    
+    WINDOW = 8
+    MAX_CLIENTS = 64
+    # Samples beyond this are from a stalled client, not the link
+    MAX_RTT_MS = 60000.0
+    
+    def __init__(self):
+        self._clients = collections.OrderedDict()
+        self._lock = threading.Lock()
+    
+    def record(self, client, t0, t1, t2, t3):
+        """Add one exchange; returns the client's estimate, or None if the sample is unusable"""
+        rtt = (t3 - t0) - (t2 - t1)
+        if not 0.0 <= rtt <= self.MAX_RTT_MS or t2 < t1:
+            return None
+        offset = ((t1 - t0) + (t2 - t3)) / 2.0
+        with self._lock:
+            estimate = self._clients.get(client)
+            if estimate is None:
+                estimate = self._clients[client] = LinkEstimate()
+                if len(self._clients) > self.MAX_CLIENTS:
+                    self._clients.popitem(last=False)
+            else:
+                self._clients.move_to_end(client)
+            estimate.add(rtt, offset)
+            estimate.last_seen = time.monotonic()
+            return estimate
+    
+    def get(self, client):
+        return self._clients.get(client)
+    
+    def stats(self):
+        with self._lock:
+            return {client: estimate.stats() for client, estimate in self._clients.items()}
+
+latency_tracker = LatencyTracker()
+
+PROBE_FIELDS = ('t0', 't1', 't2', 't3')
+
+def probe_response(client, fields, received, received_wall, extra=''):
+    """Body of a probe reply as a JSON string
+    
+    `fields` holds the previous exchange's t0..t3, if the client sent them;
+    `received` is the perf_counter() time the request arrived and
+    `received_wall` the matching time.time(). `extra` is appended as
+    further JSON members.
+    """
+    estimate = None
+    try:
+        times = [float(fields[field]) for field in PROBE_FIELDS]
+    except (KeyError, TypeError, ValueError):
+        estimate = latency_tracker.get(client)
+    else:
+        estimate = latency_tracker.record(client, *times) or latency_tracker.get(client)
+    # Formatted by hand rather than through json so the send stamp is taken last
+    sent = time.perf_counter()
+    return (f'{{"status":"ok","t1":{received_wall * 1000:.3f},'
+            f'"t2":{(received_wall + sent - received) * 1000:.3f},'
+            f'"recv_mono_ms":{received * 1000:.3f},"send_mono_ms":{sent * 1000:.3f}'
+            f'{estimate.fragment if estimate else ""}{extra}}}')
+
+@app.route('/probe', methods=['GET'])
+@require_auth
+def probe():
+    """Latency probe: server receive/send timestamps plus this client's link estimate"""
+    environ = request.environ
+    received = environ['flow.start']
+    received_wall = time.time() - (time.perf_counter() - received)
+    body = probe_response(request_client(), request.args, received, received_wall)
+    return Response(body, mimetype='application/json', headers={'Cache-Control': 'no-store'})
+
+# Hub mode: one server routing commands to others
+
+# Paths of the commands a hub can route, by WebSocket command name
+HUB_PATHS = {
+    'arrow': '/arrow', 'key': '/key', 'volume': '/volume', 'type': '/type', 'batch': '/batch',
+    'pointer': '/pointer', 'repeat_stop': '/repeat/stop', 'repeat_heartbeat': '/repeat/heartbeat',
+}
+# Target ids with a meaning of their own
+HUB_RESERVED = ('local', 'all')
+
+def _hub_error(status, message):
+    return status, 'application/json', json.dumps({"error": message}).encode('utf-8')
+
+def _hub_result(status, content_type, data):
+    """One target's reply as a result dict"""
+    if content_type and content_type.startswith('application/json') and data:
+        try:
+            result = json.loads(data)
+        except ValueError:
+            result = None
+        if isinstance(result, dict):
+            return result
+    return {"error": f"Target answered HTTP {status}"}
+
+class Downstream:
+    """Another server behind the hub, reached over a pool of keep-alive connections"""
+    
+    # After a failure, requests fail fast for this long unless a health check succeeds
+    RETRY_DELAY = 1.0
+    
+    def __init__(self, target_id, url, token, connections=2, timeout=2.0):
+        self.target_id = target_id
+        self.url = url
+        self.token = token
+        parts = urlsplit(url)
+        self._connection_class = (http.client.HTTPSConnection if parts.scheme == 'https'
+                                  else http.client.HTTPConnection)
+        self._host = parts.hostname
+        self._port = parts.port
+        self._auth = f'Bearer {token}'
+        self.connections = connections
+        self.timeout = timeout
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+        self.healthy = None
+        self.retry_at = 0.0
+        self.forwarded = 0
+        self.failed = 0
+        self.latency = None
+        self.last_error = None
+    
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connection_class(self._host, self._port, timeout=self.timeout)
+    
+    def _release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.connections:
+                self._idle.append(connection)
+                return
+        connection.close()
+    
+    def request(self, method, path, body=None, headers=None):
+        """Send one request, returning (status, content type, body)
+        
+        A pooled connection the other side has closed in the meantime
+        fails on first use; the request is then retried once on a fresh
+        connection.
+        """
+        headers = dict(headers or {}, Authorization=self._auth)
+        for attempt in range(2):
+            connection = self._acquire()
+            reused = connection.sock is not None
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(connection)
+            return response.status, response.getheader('Content-Type'), data
+    
+    def call(self, method, path, body, headers):
+        """Forward a command; failures come back as error replies, never as exceptions"""
+        if not self.healthy and time.monotonic() < self.retry_at:
+            self.failed += 1
+            return _hub_error(503, "Target unavailable")
+        start = time.perf_counter()
+        try:
+            status, content_type, data = self.request(method, path, body, headers)
+        except (OSError, http.client.HTTPException) as e:
+            self.failed += 1
+            self.mark_down(e)
+            return _hub_error(502, "Target unreachable")
+        if status == 204 and not data:
+            # The target drops requests it cannot authenticate
+            self.failed += 1
+            self.last_error = "Token rejected"
+            return _hub_error(502, "Target rejected the hub's token")
+        seconds = time.perf_counter() - start
+        self.latency = seconds if self.latency is None else self.latency + (seconds - self.latency) / 8.0
+        self.forwarded += 1
+        self.mark_up()
+        return status, content_type, data
+    
+    def check(self, links):
+        """Health check through /probe, feeding the hub's link estimates"""
+        try:
+            t0 = time.time() * 1000
+            status, _, data = self.request('GET', '/probe')
+            t3 = time.time() * 1000
+            if status != 200:
+                raise ValueError("Token rejected" if status == 204 else f"HTTP {status}")
+            fields = json.loads(data)
+            links.record(self.target_id, t0, float(fields['t1']), float(fields['t2']), t3)
+        except (OSError, http.client.HTTPException, ValueError, KeyError, TypeError) as e:
+            self.mark_down(e)
+            return
+        self.mark_up()
+    
+    def mark_up(self):
+        if self.healthy is False:
+            print(f"Hub target {self.target_id} is back")
+        self.healthy = True
+    
+    def mark_down(self, error):
+        if self.healthy is not False:
+            print(f"Hub target {self.target_id} is down: {error}")
+        self.healthy = False
+        self.last_error = str(error) or type(error).__name__
+        self.retry_at = time.monotonic() + self.RETRY_DELAY
+    
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, collections.deque()
+        for connection in idle:
+            connection.close()
+    
+    def stats(self):
+        return {"url": self.url, "healthy": self.healthy, "forwarded": self.forwarded,
+                "failed": self.failed, "idle_connections": len(self._idle),
+                "latency_ms": round(self.latency * 1000, 3) if self.latency is not None else None,
+                "last_error": self.last_error}
+
+class Hub:
+    """Routes commands to other server instances by target id
+    
+    A command names its targets with an X-Target header, a ?target= query
+    or a "target" field: one id from the `targets` section, several
+    separated by commas, 'local' for this server or 'all' for every target
+    (and this server too unless `local` is off). Commands without one use
+    `default_target`, else run here. Each target keeps a small pool of
+    keep-alive connections that a health check through /probe uses too,
+    so forwarding rarely pays for a connect. Commands for several targets
+    are forwarded in parallel and answered together once all have replied.
+    """
+    
+    MAX_WORKERS = 16
+    
+    def __init__(self):
+        self.enabled = False
+        self.include_local = True
+        self.default_target = None
+        self.health_interval = 5.0
+        self.targets = {}
+        self.links = LatencyTracker()
+        self._executor = None
+        self._thread = None
+    
+    def configure(self, hub_config):
+        self.enabled = hub_config.get('enabled', False)
+        self.include_local = hub_config.get('local', True)
+        self.default_target = hub_config.get('default_target')
+        self.health_interval = float(hub_config.get('health_interval_s', 5.0))
+        connections = hub_config.get('connections', 2)
+        timeout = hub_config.get('timeout_ms', 2000) / 1000.0
+        
+        targets = {}
+        for target_id, entry in hub_config.get('targets', {}).items():
+            url, token = entry['url'], entry.get('token', config.get('api_token'))
+            downstream = self.targets.get(target_id)
+            if downstream is None or (downstream.url, downstream.token) != (url, token):
+                downstream = Downstream(target_id, url, token)
+            downstream.connections, downstream.timeout = connections, timeout
+            targets[target_id] = downstream
+        previous, self.targets = self.targets, targets
+        for target_id, downstream in previous.items():
+            if targets.get(target_id) is not downstream:
+                downstream.close()
+        
+        if self.enabled and targets and self._thread is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(self.MAX_WORKERS, thread_name_prefix='hub')
+            self._thread = threading.Thread(target=self._watch, name='hub-health', daemon=True)
+            self._thread.start()
+    
+    def resolve(self, spec):
+        """Target ids named by a target spec, in order and without repeats"""
+        if not isinstance(spec, str):
+            raise CommandError("Invalid target")
+        resolved = []
+        for name in spec.split(','):
+            name = name.strip()
+            if name == 'all':
+                names = list(self.targets) + (['local'] if self.include_local else [])
+            elif name == 'local' or name in self.targets:
+                names = [name]
+            else:
+                raise CommandError(f"Unknown target: {name}")
+            resolved += [n for n in names if n not in resolved]
+        if not resolved:
+            raise CommandError("Invalid target")
+        return resolved
+    
+    def dispatch(self, target_ids, method, path, body, content_type, client, local=None):
+        """Run a command on every target, returning {target: (status, content type, body)}
+        
+        Remote targets are called in parallel; `local` runs this server's
+        share on the calling thread meanwhile.
+        """
+        if client.startswith('id:'):
+            client = client[3:]
+        headers = {'Content-Type': content_type or 'application/json', 'X-Client-Id': client}
+        targets = self.targets
+        remote = [target_id for target_id in target_ids if target_id != 'local']
+        if len(remote) == 1 and local is None:
+            return {remote[0]: targets[remote[0]].call(method, path, body, headers)}
+        futures = {target_id: self._executor.submit(targets[target_id].call, method, path, body, headers)
+                   for target_id in remote}
+        results = {}
+        if local is not None:
+            results['local'] = local()
+        for target_id, future in futures.items():
+            results[target_id] = future.result()
+        return {target_id: results[target_id] for target_id in target_ids}
+    
+    def route_request(self, view, args, kwargs):
+        """Serve a routable HTTP endpoint, forwarding it if it names targets"""
+        binary = binary_request()
+        data = None if binary else request.get_json(silent=True)
+        spec = request.environ.get('HTTP_X_TARGET') or request.args.get('target')
+        if spec is None and isinstance(data, dict):
+            spec = data.get('target')
+        if spec is None:
+            spec = self.default_target
+        if spec is None or spec == 'local':
+            return view(*args, **kwargs)
+        try:
+            target_ids = self.resolve(spec)
+            if binary and len(target_ids) > 1:
+                raise CommandError("Binary commands go to a single target")
+        except CommandError as e:
+            metrics.error('bad_request')
+            return _reply(binary, {"error": str(e)}, 400)
+        if target_ids == ['local']:
+            return view(*args, **kwargs)
+        
+        if isinstance(data, dict) and 'target' in data:
+            body = json.dumps({k: v for k, v in data.items() if k != 'target'}).encode('utf-8')
+        else:
+            body = request.get_data()
+        local = None
+        if 'local' in target_ids:
+            def local():
+                response = app.make_response(view(*args, **kwargs))
+                return response.status_code, response.content_type, response.get_data()
+        results = self.dispatch(target_ids, request.method, request.path, body,
+                                request.content_type, request_client(), local)
+        if len(target_ids) == 1:
+            status, content_type, data = results[target_ids[0]]
+            return Response(data, status=status, content_type=content_type)
+        merged = {target_id: _hub_result(*result) for target_id, result in results.items()}
+        ok = any('error' not in result for result in merged.values())
+        return jsonify({"status": "ok" if ok else "error", "targets": merged}), 200 if ok else 502
+    
+    def route_message(self, cmd, data, client, run_local):
+        """Result of a WebSocket command that names targets; run_local(cmd, data) runs it here"""
+        path = HUB_PATHS.get(cmd)
+        if path is None:
+            raise CommandError("Command cannot be routed")
+        target_ids = self.resolve(data['target'])
+        fields = {k: v for k, v in data.items() if k not in ('target', 'id')}
+        local = None
+        if 'local' in target_ids:
+            def local():
+                return 200, 'application/json', json.dumps(run_local(cmd, fields)).encode('utf-8')
+        results = self.dispatch(target_ids, 'POST', path, json.dumps(fields).encode('utf-8'),
+                                'application/json', client, local)
+        if len(target_ids) == 1:
+            return _hub_result(*results[target_ids[0]])
+        merged = {target_id: _hub_result(*result) for target_id, result in results.items()}
+        ok = any('error' not in result for result in merged.values())
+        return {"status": "ok" if ok else "error", "targets": merged}
+    
+    def stats(self):
+        links = self.links.stats()
+        return {target_id: dict(downstream.stats(), link=links.get(target_id))
+                for target_id, downstream in self.targets.items()}
+    
+    def _watch(self):
+        while True:
+            if self.enabled:
+                links = self.links
+                checks = [self._executor.submit(downstream.check, links) for downstream in self.targets.values()]
+                concurrent.futures.wait(checks)
+            time.sleep(self.health_interval)
+
+hub = Hub()
+
+@app.route('/targets', methods=['GET'])
+@require_auth
+def target_list():
+    """Hub mode: downstream servers with their health and link estimates"""
+    return jsonify({"status": "ok", "enabled": hub.enabled, "local": hub.include_local,
+                    "targets": hub.stats()})
+
+def lease_response(client, data):
+    """Acquire or renew exclusive control for a client"""
+    try:
+        ttl = float(data.get('ttl_ms', 5000)) / 1000.0
+    except (TypeError, ValueError):
+        raise CommandError("Invalid ttl_ms")
+    if not (math.isfinite(ttl) and ttl > 0):
+        raise CommandError("Invalid ttl_ms")
+    granted, remaining = dispatcher.acquire_lease(client, ttl)
+    if not granted:
+        raise LeaseHeldError("Another client has exclusive control")
+    return {"status": "ok", "action": "lease", "client": client, "expires_in_ms": round(remaining * 1000)}
+
+@app.route('/lease', methods=['POST'])
+@require_auth
+def lease_acquire():
+    """Take (or renew) exclusive control of the input for ttl_ms"""
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(lease_response(request_client(), data if isinstance(data, dict) else {}))
+    except CommandError as e:
+        metrics.error('bad_request')
+        return jsonify({"error": str(e)}), 400
+    except LeaseHeldError as e:
+        metrics.error(e.kind)
+        _, remaining = dispatcher.lease()
+        return jsonify({"error": str(e), "expires_in_ms": round(remaining * 1000)}), e.status
+
+@app.route('/lease/release', methods=['POST'])
+@require_auth
+def lease_release():
+    """Give up exclusive control"""
+    if not dispatcher.release_lease(request_client()):
+        return jsonify({"error": "No lease held"}), 404
+    return jsonify({"status": "ok", "action": "lease_release"})
+
+@app.route('/clients', methods=['GET'])
+@require_auth
+def client_stats():
+    """Per-client queue, rate limit and latency statistics"""
+    client, remaining = dispatcher.lease()
+    return jsonify({"status": "ok", "clients": dispatcher.client_stats(), "links": latency_tracker.stats(),
+                    "lease": {"client": client, "expires_in_ms": round(remaining * 1000)} if client else None})
+
+@app.route('/macro/record', methods=['POST'])
+@require_auth
+def macro_record():
+    """Start recording injected commands into a macro"""
+    if not journal.enabled:
+        return jsonify({"error": "Command journal is disabled"}), 400
+    macro_id, first = macro_manager.record()
+    return jsonify({"status": "ok", "macro": macro_id, "from": first})
+
+@app.route('/macro/stop', methods=['POST'])
+@require_auth
+def macro_stop():
+    """Finish recording a macro, or cancel a playback"""
+    data = request.get_json()
+    if isinstance(data, dict) and 'playback' in data:
+        if not macro_manager.cancel(str(data['playback'])):
+            return jsonify({"error": "Unknown playback"}), 404
+        return jsonify({"status": "ok", "playback": str(data['playback'])})
+    if not isinstance(data, dict) or 'macro' not in data:
+        return jsonify({"error": "Missing macro"}), 400
+    segment = macro_manager.stop(str(data['macro']))
+    if segment is None:
+        return jsonify({"error": "Unknown macro"}), 404
+    first, last = segment
+    return jsonify({"status": "ok", "macro": str(data['macro']), "from": first, "to": last,
+                    "commands": last - first})
+
+@app.route('/macro/play', methods=['POST'])
+@require_auth
+def macro_play():
+    """Replay a recorded macro or a journal range ("from"/"to")"""
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({"error": "Missing macro"}), 400
+    if not journal.enabled:
+        return jsonify({"error": "Command journal is disabled"}), 400
+    try:
+        scale = float(data.get('scale', 1.0))
+        if 'macro' in data:
+            segment = macro_manager.segment(str(data['macro']))
+            if segment is None:
+                return jsonify({"error": "Unknown macro"}), 404
+            first, last = segment
+        elif 'from' in data:
+            first = int(data['from'])
+            last = int(data['to']) if 'to' in data else journal.next_sequence
+        else:
+            return jsonify({"error": "Missing macro"}), 400
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid macro range or scale"}), 400
+    
+    try:
+        playback_id, count, duration = macro_manager.play(first, last, scale, request_client())
+    except ValueError as e:
+        return jsonify({"error": f"Invalid macro scale: {e}"}), 400
+    return jsonify({"status": "ok", "playback": playback_id, "commands": count,
+                    "duration_ms": round(duration * 1000)})
+
+@app.route('/metrics', methods=['GET'])
+@require_auth
+def metrics_endpoint():
+    """Prometheus metrics"""
+    if not metrics.enabled:
+        return '', 204
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.before_request
+def start_request_timer():
+    request.environ['flow.start'] = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    start = request.environ.get('flow.start')
+    if start is not None:
+        metrics.observe_request(request.endpoint, time.perf_counter() - start)
+    if 'first_request' not in metrics.startup:
+        seconds = metrics.mark_startup('first_request')
+        print(f"First request served {seconds * 1000:.0f} ms after start")
+    return response
+
+@app.errorhandler(404)
+def not_found(error):
+    """Return empty response for 404s to avoid leaking info"""
+    metrics.error('not_found')
+    return '', 204
+
+@app.errorhandler(500)
+def internal_error(error):
+    """Return empty response for 500s to avoid leaking info"""
+    metrics.error('internal_error')
+    return '', 204
+
+metrics.register_endpoints([e for e in app.view_functions if e != 'static'] + ['websocket', 'udp'])
+
+# Persistent WebSocket command channel
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WS_OP_CONTINUATION = 0x0
+WS_OP_TEXT = 0x1
+WS_OP_BINARY = 0x2
+WS_OP_CLOSE = 0x8
+WS_OP_PING = 0x9
+WS_OP_PONG = 0xA
+WS_MAX_MESSAGE = 64 * 1024
+
+def _ws_unmask(payload, mask):
+    """Apply a WebSocket masking key to a frame payload"""
+    if not payload:
+        return payload
+    length = len(payload)
+    key = (mask * (length // 4 + 1))[:length]
+    value = int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')
+    return value.to_bytes(length, 'big')
+
+class WebSocketHandler(socketserver.StreamRequestHandler):
+    """One authenticated WebSocket connection carrying command messages
+    
+    Messages are JSON text frames such as {"cmd": "arrow", "direction": "up"}.
+    Adding an "id" field asks for an acknowledgement carrying the same id and
+    the command result, otherwise commands are fire-and-forget. Binary
+    frames carry the compact encoding from codec.py instead.
+    """
+    
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.send_lock = threading.Lock()
+        self.repeat_sessions = set()
+        self.volume_listener = None
+        self.client = 'ws:%s:%s' % self.client_address[:2]
+    
+    def handle(self):
+        if not self._handshake():
+            return
+        try:
+            while True:
+                message = self._recv_message()
+                if message is None:
+                    break
+                self._handle_message(message)
+        except (ConnectionError, OSError, ValueError):
+            pass
+        finally:
+            # A dropped channel must not leave keys repeating
+            for session_id in self.repeat_sessions:
+                repeat_manager.stop(session_id, self.client)
+            pointer_streamer.release(self.client)
+            if self.volume_listener:
+                volume_controller.remove_listener(self.volume_listener)
+    
+    def _handshake(self):
+        """Complete the HTTP upgrade, authenticating the client once"""
+        request_line = self.rfile.readline(8192).decode('latin-1')
+        parts = request_line.split()
+        if len(parts) < 2 or parts[0] != 'GET':
+            return False
+        
+        headers = {}
+        while True:
+            line = self.rfile.readline(8192).decode('latin-1')
+            if line in ('\r\n', '\n', ''):
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        
+        # Browsers cannot set headers on WebSockets, so allow ?token= as well
+        query = parse_qs(urlsplit(parts[1]).query)
+        token = None
+        auth_header = headers.get('authorization', '')
+        if auth_header.startswith('Bearer '):
+            token = auth_header[7:]
+        else:
+            token = query.get('token', [None])[0]
+        client_id = headers.get('x-client-id') or query.get('client', [None])[0]
+        if client_id:
+            self.client = 'id:' + client_id[:64]
+        
+        ws_key = headers.get('sec-websocket-key')
+        address = self.client_address[0]
+        if not authenticator.allow(address):
+            metrics.error('auth_limited')
+            return False
+        if not authenticator.check_token(token):
+            authenticator.failed(address)
+            metrics.error('auth_failed')
+            return False
+        if (not ws_key
+                or 'websocket' not in headers.get('upgrade', '').lower()):
+            # Drop the connection silently, same as unauthenticated HTTP requests
+            return False
+        
+        accept = base64.b64encode(
+            hashlib.sha1((ws_key + WS_GUID).encode('ascii')).digest()
+        ).decode('ascii')
+        self.wfile.write((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode('ascii'))
+        return True
+    
+    def _read_exact(self, size):
+        data = self.rfile.read(size)
+        if len(data) < size:
+            raise ConnectionError("WebSocket closed mid-frame")
+        return data
+    
+    def _recv_frame(self):
+        first, second = self._read_exact(2)
+        fin = bool(first & 0x80)
+        opcode = first & 0x0F
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', self._read_exact(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self._read_exact(8))[0]
+        if length > WS_MAX_MESSAGE:
+            raise ValueError("WebSocket frame too large")
+        mask = self._read_exact(4) if second & 0x80 else None
+        payload = self._read_exact(length)
+        if mask:
+            payload = _ws_unmask(payload, mask)
+        return fin, opcode, payload
+    
+    def _recv_message(self):
+        """Return the next (opcode, payload) data message, or None on close"""
+        fragments = []
+        message_opcode = None
+        while True:
+            fin, opcode, payload = self._recv_frame()
+            if opcode == WS_OP_CLOSE:
+                self._send_frame(WS_OP_CLOSE, payload[:2])
+                return None
+            if opcode == WS_OP_PING:
+                self._send_frame(WS_OP_PONG, payload)
+                continue
+            if opcode == WS_OP_PONG:
+                continue
+            if opcode != WS_OP_CONTINUATION:
+                message_opcode = opcode
+                fragments = []
+            fragments.append(payload)
+            if sum(len(f) for f in fragments) > WS_MAX_MESSAGE:
+                raise ValueError("WebSocket message too large")
+            if fin:
+                return message_opcode, b''.join(fragments)
+    
+    def _send_frame(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, length)
+        elif length < 0x10000:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+        with self.send_lock:
+            self.wfile.write(header + payload)
+    
+    def send_json(self, payload):
+        self._send_frame(WS_OP_TEXT, json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+    
+    def _handle_binary(self, payload):
+        """Binary messages are codec frames; any FLAG_ACK frame asks for the results"""
+        try:
+            commands = codec.decode(payload, limit=MAX_BATCH_COMMANDS)
+        except codec.CodecError:
+            metrics.error('bad_request')
+            return
+        results = [None] * len(commands)
+        queued = [i for i, data in enumerate(commands) if data['cmd'] != 'pointer']
+        try:
+            for i, data in enumerate(commands):
+                if data['cmd'] == 'pointer':
+                    accepted = pointer_streamer.submit(self.client, *parse_pointer(data))
+                    results[i] = {"status": "ok", "action": "pointer", "accepted": accepted}
+            if len(queued) == 1:
+                data = commands[queued[0]]
+                results[queued[0]] = run_command(data['cmd'], data, 'websocket', self.client)
+            elif queued:
+                wait = any(commands[i].get('wait') for i in queued) or _wait_requested({})
+                batch = run_batch([commands[i] for i in queued], wait=wait,
+                                  source='websocket', client=self.client)
+                for i, result in zip(queued, batch):
+                    results[i] = result
+        except CommandError as e:
+            metrics.error('bad_request')
+            results = [result or {"error": str(e)} for result in results]
+        except QueueFullError as e:
+            metrics.error(e.kind)
+            results = [result or {"error": str(e)} for result in results]
+        except RuntimeError:
+            results = [result or {"error": "Injection failed"} for result in results]
+        if any(data.get('ack') for data in commands):
+            self._send_frame(WS_OP_BINARY, codec.encode_results(results))
+    
+    def _push_volume(self, level, muted, version):
+        try:
+            self.send_json(dict(volume_state(level, muted, version), event='volume'))
+        except OSError:
+            pass
+    
+    def _run_command(self, cmd, data):
+        """Result of one JSON command run on this server"""
+        if cmd == 'batch' and isinstance(data.get('commands'), list):
+            results = run_batch(data['commands'][:MAX_BATCH_COMMANDS], wait=_wait_requested(data),
+                                source='websocket', client=self.client)
+            return {"status": "ok", "count": len(results), "results": results}
+        elif cmd == 'arrow' and data.get('hold'):
+            result = start_hold(data, 'websocket', self.client)
+            if 'session' in result:
+                self.repeat_sessions.add(result['session'])
+            return result
+        elif cmd in ('repeat_stop', 'repeat_heartbeat'):
+            session_id = str(data.get('session'))
+            if cmd == 'repeat_stop':
+                self.repeat_sessions.discard(session_id)
+                found = repeat_manager.stop(session_id, self.client)
+            else:
+                found = repeat_manager.heartbeat(session_id, self.client)
+            return {"status": "ok", "action": cmd} if found else {"error": "Unknown session"}
+        elif cmd == 'volume_get':
+            return volume_state(*volume_controller.get_volume())
+        elif cmd == 'volume_subscribe':
+            if self.volume_listener is None:
+                self.volume_listener = self._push_volume
+                volume_controller.add_listener(self.volume_listener)
+            return volume_state(*volume_controller.get_volume())
+        elif cmd == 'pointer':
+            accepted = pointer_streamer.submit(self.client, *parse_pointer(data))
+            return {"status": "ok", "action": "pointer", "accepted": accepted}
+        elif cmd == 'lease':
+            return lease_response(self.client, data)
+        elif cmd == 'lease_release':
+            dispatcher.release_lease(self.client)
+            return {"status": "ok", "action": "lease_release"}
+        return run_command(cmd, data, 'websocket', self.client)
+    
+    def _handle_message(self, message):
+        start = time.perf_counter()
+        opcode, payload = message
+        if opcode == WS_OP_BINARY:
+            self._handle_binary(payload)
+            metrics.observe_request('websocket', time.perf_counter() - start)
+            return
+        if opcode != WS_OP_TEXT:
+            return
+        try:
+            data = json.loads(payload.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            return
+        if not isinstance(data, dict):
+            return
+        
+        message_id = data.get('id')
+        cmd = data.get('cmd')
+        if cmd == 'probe':
+            # Always answered, and without building a result dict
+            received_wall = time.time() - (time.perf_counter() - start)
+            extra = f',"id":{json.dumps(message_id)}' if message_id is not None else ''
+            self._send_frame(WS_OP_TEXT, probe_response(self.client, data, start, received_wall,
+                                                        extra).encode('utf-8'))
+            metrics.observe_request('websocket', time.perf_counter() - start)
+            return
+        try:
+            if hub.enabled and data.get('target') is not None:
+                result = hub.route_message(cmd, data, self.client, self._run_command)
+            else:
+                result = self._run_command(cmd, data)
+        except CommandError as e:
+            metrics.error('bad_request')
+            result = {"error": str(e)}
+        except QueueFullError as e:
+            metrics.error(e.kind)
+            result = {"error": str(e)}
+        except Exception as e:
+            metrics.error('internal_error')
+            print(f"WebSocket command error: {e}")
+            result = {"error": "Command failed"}
+        
+        if message_id is not None:
+            result = dict(result, id=message_id)
+            self.send_json(result)
+        metrics.observe_request('websocket', time.perf_counter() - start)
+
+class WebSocketServer(socketserver.ThreadingTCPServer):
+    """Threaded listener for persistent WebSocket command channels"""
+    daemon_threads = True
+    allow_reuse_address = True
+    # The default backlog of 5 makes simultaneous connects wait on SYN retries
+    request_queue_size = 64
+    
+    def close(self):
+        """Stop listening; open channels keep running"""
+        self.shutdown()
+        self.server_close()
+
+def websocket_address():
+    """(host, port) of the WebSocket listener, or None when disabled"""
+    ws_config = config.get('websocket', {})
+    if not ws_config.get('enabled', True):
+        return None
+    return config.get('host', '0.0.0.0'), ws_config.get('port', config.get('port', 8080) + 1)
+
+def start_websocket_server():
+    """Start the WebSocket listener in a background thread, if enabled"""
+    address = websocket_address()
+    if address is None:
+        return None
+    
+    host, port = address
+    try:
+        server = WebSocketServer((host, port), WebSocketHandler)
+    except OSError as e:
+        print(f"Could not start WebSocket channel on port {port}: {e}")
+        return None
+    
+    thread = threading.Thread(target=server.serve_forever, name='websocket', daemon=True)
+    thread.start()
+    return server
+
+# UDP datagram channel for fire-and-forget gestures
+
+UDP_VERSION = 1
+UDP_HEADER = struct.Struct('!BBIQQ')  # version, opcode, sender id, sequence, timestamp ms
+UDP_MAC_SIZE = 16
+# Same numbering and payloads as the binary codec, except that key names
+# are not length-prefixed; text is too large for one datagram
+UDP_OPCODES = {opcode: name for opcode, name in codec.OPCODES.items() if name != 'type'}
+UDP_DIRECTIONS = codec.DIRECTIONS
+UDP_VOLUME_ACTIONS = codec.VOLUME_ACTIONS[:5]
+
+class UdpSender:
+    """Replay window and clock offset for one datagram sender"""
+    __slots__ = ('highest', 'window', 'min_offset')
+    
+    def __init__(self):
+        self.highest = -1
+        self.window = 0
+        self.min_offset = None
+
+class UdpCommandServer:
+    """Authenticated datagram listener for arrow, key, volume and pointer commands
+    
+    Datagram layout (network byte order):
+    
+      version u8 | opcode u8 | sender id u32 | sequence u64 | timestamp ms u64
+      | payload | HMAC-SHA256(api_token, everything before it)[:16]
+    
+    Payloads: arrow and volume carry one index byte (see UDP_DIRECTIONS and
+    UDP_VOLUME_ACTIONS), key carries the UTF-8 key name and pointer carries
+    samples, buttons and scroll steps as laid out in codec.py. Each sender keeps a
+    sliding window of sequence numbers, so duplicates and packets that fall
+    behind the window are discarded. Packets delayed by more than
+    `max_age_ms` beyond the fastest one seen from their sender are stale
+    and dropped too; measuring relative to that sender keeps the check
+    independent of clock skew between phone and PC.
+    """
+    
+    MAX_SENDERS = 64
+    
+    def __init__(self, host, port, window=64, max_age_ms=1000):
+        self.configure(window, max_age_ms)
+        self.senders = collections.OrderedDict()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.server_address = self.sock.getsockname()
+        self.closed = False
+    
+    def configure(self, window, max_age_ms):
+        self.window_size = min(64, max(1, window))
+        self.max_age = max_age_ms
+    
+    def close(self):
+        self.closed = True
+        try:
+            # Wakes up the blocked recvfrom()
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+    
+    def serve_forever(self):
+        while not self.closed:
+            try:
+                packet, _ = self.sock.recvfrom(2048)
+            except OSError:
+                break
+            if self.closed:
+                break
+            start = time.perf_counter()
+            try:
+                self.handle_packet(packet)
+            except Exception as e:
+                print(f"UDP command error: {e}")
+            metrics.observe_request('udp', time.perf_counter() - start)
+    
+    def _verify(self, packet):
+        """Return the signed body of a packet, or None if the MAC is wrong"""
+        if len(packet) < UDP_HEADER.size + UDP_MAC_SIZE:
+            return None
+        body, mac = packet[:-UDP_MAC_SIZE], packet[-UDP_MAC_SIZE:]
+        key = authenticator.token
+        if not key:
+            return None
+        expected = hmac.new(key, body, hashlib.sha256).digest()[:UDP_MAC_SIZE]
+        return body if hmac.compare_digest(mac, expected) else None
+    
+    def _accept_sequence(self, sender, sequence):
+        """Sliding-window replay check; records the sequence if accepted"""
+        if sequence > sender.highest:
+            shift = sequence - sender.highest
+            if shift >= self.window_size:
+                # Nothing in the old window survives; don't build a huge shift
+                sender.window = 1
+            else:
+                sender.window = ((sender.window << shift) | 1) & ((1 << self.window_size) - 1)
+            sender.highest = sequence
+            return True
+        offset = sender.highest - sequence
+        if offset >= self.window_size or sender.window & (1 << offset):
+            return False
+        sender.window |= 1 << offset
+        return True
+    
+    def _is_fresh(self, sender, timestamp_ms):
+        if not self.max_age:
+            return True
+        offset = time.time() * 1000 - timestamp_ms
+        if sender.min_offset is None or offset < sender.min_offset:
+            sender.min_offset = offset
+        return offset - sender.min_offset <= self.max_age
+    
+    def _sender(self, sender_id):
+        sender = self.senders.get(sender_id)
+        if sender is None:
+            sender = self.senders[sender_id] = UdpSender()
+            if len(self.senders) > self.MAX_SENDERS:
+                self.senders.popitem(last=False)
+        else:
+            self.senders.move_to_end(sender_id)
+        return sender
+    
+    def handle_packet(self, packet):
+        body = self._verify(packet)
+        if body is None:
+            metrics.error('auth_failed')
+            return
+        version, opcode, sender_id, sequence, timestamp_ms = UDP_HEADER.unpack_from(body)
+        if version != UDP_VERSION or opcode not in UDP_OPCODES:
+            metrics.error('bad_request')
+            return
+        
+        sender = self._sender(sender_id)
+        if not self._is_fresh(sender, timestamp_ms):
+            metrics.error('udp_stale')
+            return
+        if not self._accept_sequence(sender, sequence):
+            metrics.error('udp_replayed')
+            return
+        
+        payload = body[UDP_HEADER.size:]
+        name = UDP_OPCODES[opcode]
+        if name == 'pointer':
+            try:
+                fields, _ = codec.decode_pointer(payload)
+                pointer_streamer.submit(f'udp:{sender_id}', *parse_pointer(fields))
+            except (IndexError, struct.error, CommandError):
+                metrics.error('bad_request')
+            except QueueFullError as e:
+                metrics.error(e.kind)
+            return
+        try:
+            if name == 'arrow':
+                data = {'direction': UDP_DIRECTIONS[payload[0]]}
+            elif name == 'volume':
+                data = {'action': UDP_VOLUME_ACTIONS[payload[0]]}
+            else:
+                data = {'key': payload.decode('utf-8')}
+        except (IndexError, UnicodeDecodeError):
+            metrics.error('bad_request')
+            return
+        
+        # Queued datagrams age against the same budget as arriving ones
+        data['sent_ms'] = timestamp_ms
+        data['max_age_ms'] = self.max_age
+        try:
+            dispatcher.submit([prepare_command(name, data)], source='udp', client=f'udp:{sender_id}')
+        except CommandError:
+            metrics.error('bad_request')
+        except QueueFullError as e:
+            metrics.error(e.kind)
+
+def udp_address():
+    """(host, port) of the UDP listener, or None when disabled"""
+    udp_config = config.get('udp', {})
+    if not udp_config.get('enabled', False):
+        return None
+    return config.get('host', '0.0.0.0'), udp_config.get('port', config.get('port', 8080) + 2)
+
+def start_udp_server():
+    """Start the UDP command listener in a background thread, if enabled"""
+    address = udp_address()
+    if address is None:
+        return None
+    
+    udp_config = config.get('udp', {})
+    host, port = address
+    try:
+        server = UdpCommandServer(host, port, udp_config.get('window', 64),
+                                  udp_config.get('max_age_ms', 1000))
+    except OSError as e:
+        print(f"Could not start UDP channel on port {port}: {e}")
+        return None
+    
+    thread = threading.Thread(target=server.serve_forever, name='udp', daemon=True)
+    thread.start()
+    return server
+
+# Readiness announcements
+
+# Opcode of announcement datagrams; kept clear of the command opcodes
+ANNOUNCE_OPCODE = 0x80
+
+def _sleepless_clock():
+    """A clock that keeps running while the machine is suspended"""
+    if hasattr(time, 'CLOCK_BOOTTIME'):
+        return time.clock_gettime(time.CLOCK_BOOTTIME)
+    return time.time()
+
+class ReadinessAnnouncer:
+    """Signed datagrams telling clients where the server can be reached
+    
+    An announcement goes out as soon as the listeners are bound, again when
+    the machine resumes from suspend, and whenever the primary IP or a
+    listener port changes, so a phone can reconnect at once instead of
+    waiting for its next poll. It uses the UDP channel's framing:
+    
+      version u8 | ANNOUNCE_OPCODE u8 | boot id u32 | sequence u64 | timestamp ms u64
+      | JSON payload | HMAC-SHA256(api_token, everything before it)[:16]
+    
+    The boot id is random per server start, so a client can tell a restart
+    from a resume. The payload holds the event ('ready', 'resumed',
+    'address' or 'moved'), the IP and the listener ports. Broadcast
+    datagrams are easily lost on Wi-Fi, so each announcement is sent
+    `repeat` times with the same sequence number.
+    
+    Suspend is noticed by a watcher thread that wakes every
+    `check_interval_s`: a gap between the monotonic clock (which stops
+    while suspended) and a clock that does not, or a sleep that overran by
+    far, means the machine was asleep. The input and audio backends are
+    then reopened before the announcement, so the first gesture after wake
+    does not pay for it.
+    """
+    
+    # Unexplained time beyond this means the machine was suspended
+    RESUME_GAP_S = 5.0
+    # Delays between the copies of one announcement
+    REPEAT_DELAYS = (0.0, 0.5, 1.5, 3.0)
+    
+    def __init__(self):
+        self.enabled = False
+        self.address = '255.255.255.255'
+        self.port = None
+        self.repeat = 3
+        self.check_interval = 2.0
+        self.boot_id = secrets.randbits(32)
+        self.sequence = 0
+        self.ip = None
+        self._lock = threading.Lock()
+        self._thread = None
+    
+    def configure(self, announce_config):
+        self.enabled = announce_config.get('enabled', False)
+        self.address = announce_config.get('address', '255.255.255.255')
+        self.port = announce_config.get('port', config.get('port', 8080) + 3)
+        self.repeat = max(1, min(len(self.REPEAT_DELAYS), int(announce_config.get('repeat', 3))))
+        self.check_interval = float(announce_config.get('check_interval_s', 2.0))
+    
+    def start(self):
+        """Announce readiness, then watch for resume and address changes"""
+        self.announce('ready')
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name='announce', daemon=True)
+            self._thread.start()
+    
+    def _current_ip(self):
+        host = config.get('host', '0.0.0.0')
+        if host not in ('0.0.0.0', ''):
+            return host
+        return network_identity.ip or get_primary_ip()
+    
+    def _payload(self, event, ip):
+        http, websocket, udp = listeners.http, listeners.websocket, listeners.udp
+        payload = {"event": event, "ip": ip,
+                   "port": int(http.port) if http else config.get('port', 8080),
+                   "ws_port": websocket.server_address[1] if websocket else None,
+                   "udp_port": udp.server_address[1] if udp else None,
+                   "mac": network_identity.mac, "platform": platform.system()}
+        return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    
+    def packet(self, event, ip):
+        """One signed announcement, or None without an API token"""
+        key = authenticator.token
+        if not key:
+            return None
+        with self._lock:
+            self.sequence += 1
+            sequence = self.sequence
+        body = (UDP_HEADER.pack(UDP_VERSION, ANNOUNCE_OPCODE, self.boot_id, sequence, int(time.time() * 1000))
+                + self._payload(event, ip))
+        return body + hmac.new(key, body, hashlib.sha256).digest()[:UDP_MAC_SIZE]
+    
+    def announce(self, event):
+        """Send an announcement in the background; returns immediately"""
+        if not self.enabled or self.port is None:
+            return
+        ip = self._current_ip()
+        self.ip = ip
+        packet = self.packet(event, ip)
+        if packet is not None:
+            threading.Thread(target=self._send, args=(packet,), name='announce-send', daemon=True).start()
+    
+    def _send(self, packet):
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                if ipaddress.ip_address(self.address).is_multicast:
+                    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+                else:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                previous = 0.0
+                for delay in self.REPEAT_DELAYS[:self.repeat]:
+                    time.sleep(delay - previous)
+                    previous = delay
+                    sock.sendto(packet, (self.address, self.port))
+        except (OSError, ValueError) as e:
+            print(f"Could not send readiness announcement: {e}")
+    
+    def _watch(self):
+        while True:
+            mono, sleepless = time.monotonic(), _sleepless_clock()
+            time.sleep(self.check_interval)
+            elapsed = time.monotonic() - mono
+            # Linux and macOS stop the monotonic clock while suspended, Windows does not
+            unexplained = max(_sleepless_clock() - sleepless - elapsed, elapsed - self.check_interval)
+            try:
+                if unexplained > self.RESUME_GAP_S:
+                    print(f"Resumed after about {unexplained:.0f} s, reopening backends")
+                    self.resume()
+                elif self.enabled and self._current_ip() not in (None, self.ip):
+                    self.announce('address')
+            except Exception as e:
+                print(f"Readiness watcher error: {e}")
+    
+    def resume(self):
+        """Reopen the input and audio backends, then tell clients we are back"""
+        try:
+            set_input_backend(config.get('input_backend', 'pynput'))
+        except Exception as e:
+            print(f"Input backend not ready: {e}")
+        volume_controller.reopen()
+        # DHCP may have handed out a new address while we slept
+        network_identity.refresh()
+        self.announce('resumed')
+
+announcer = ReadinessAnnouncer()
+
+# Asyncio serving core
+
+HTTP_REASONS = {
+    200: 'OK', 204: 'No Content', 400: 'Bad Request', 404: 'Not Found',
+    413: 'Payload Too Large', 415: 'Unsupported Media Type', 417: 'Expectation Failed',
+    429: 'Too Many Requests',
+    500: 'Internal Server Error', 501: 'Not Implemented',
+}
+MAX_REQUEST_HEAD = 64 * 1024
+MAX_REQUEST_BODY = 1024 * 1024
+
+class AsyncioServer:
+    """HTTP/1.1 server on asyncio that runs the Flask app on an executor
+    
+    Connections, keep-alive and request parsing live on the event loop, so
+    idle or slow clients cost no threads. Only the short app calls use the
+    `workers` pool; injection and audio already run on their own threads.
+    Streaming responses (server-sent events) are pumped from a separate pool
+    so they never hold up ordinary requests.
+    """
+    
+    def __init__(self, app, host, port, workers=4, max_streams=16):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='asyncio-app')
+        self.stream_executor = concurrent.futures.ThreadPoolExecutor(max_streams, thread_name_prefix='asyncio-stream')
+        self.loop = None
+        self.server = None
+    
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                 limit=MAX_REQUEST_HEAD)
+        self.port = self.server.sockets[0].getsockname()[1]
+    
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+    
+    def set_workers(self, workers):
+        """Resize the app pool; requests already running finish on the old one"""
+        previous = self.executor
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='asyncio-app')
+        previous.shutdown(wait=False)
+    
+    def close(self):
+        """Stop listening; safe to call from any thread"""
+        if self.loop is not None and self.server is not None:
+            self.loop.call_soon_threadsafe(self.server.close)
+        self.executor.shutdown(wait=False)
+        self.stream_executor.shutdown(wait=False)
+    
+    async def _handle_connection(self, reader, writer):
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        peer = writer.get_extra_info('peername') or ('', 0)
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                keep_alive = await self._handle_request(head, reader, writer, peer)
+                if not keep_alive:
+                    break
+        except (ConnectionError, OSError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+    
+    async def _handle_request(self, head, reader, writer, peer):
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, protocol = lines[0].split(' ', 2)
+        except ValueError:
+            return False
+        
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+        
+        expect = headers.get('expect', '').lower()
+        if expect and expect != '100-continue':
+            await self._write_simple(writer, 417)
+            return False
+        encoding = headers.pop('transfer-encoding', '').lower()
+        if encoding and encoding != 'chunked':
+            await self._write_simple(writer, 501)
+            return False
+        try:
+            length = int(headers.get('content-length', 0) or 0) if not encoding else 0
+        except ValueError:
+            await self._write_simple(writer, 400)
+            return False
+        if length > MAX_REQUEST_BODY:
+            await self._write_simple(writer, 413)
+            return False
+        if expect and protocol == 'HTTP/1.1':
+            # The client holds the body back until it is told to go ahead
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            await writer.drain()
+        if encoding:
+            try:
+                body = await self._read_chunked(reader)
+            except (ValueError, asyncio.LimitOverrunError):
+                await self._write_simple(writer, 400)
+                return False
+            if body is None:
+                await self._write_simple(writer, 413)
+                return False
+            headers['content-length'] = str(len(body))
+        else:
+            body = await reader.readexactly(length) if length else b''
+        
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection != 'close' if protocol == 'HTTP/1.1' else connection == 'keep-alive'
+        environ = self._environ(method, target, protocol, headers, body, peer)
+        
+        status, response_headers, payload = await self.loop.run_in_executor(
+            self.executor, self._call_app, environ)
+        if isinstance(payload, bytes):
+            await self._write_response(writer, protocol, status, response_headers, payload, keep_alive)
+            return keep_alive
+        return await self._stream_response(writer, protocol, status, response_headers, payload, keep_alive)
+    
+    async def _read_chunked(self, reader):
+        """Read a chunked request body; None if it exceeds MAX_REQUEST_BODY
+        
+        Raises ValueError for a malformed chunk size line.
+        """
+        chunks = []
+        size = 0
+        while True:
+            line = await reader.readuntil(b'\r\n')
+            length = int(line.split(b';', 1)[0].strip(), 16)
+            if length == 0:
+                break
+            size += length
+            if size > MAX_REQUEST_BODY:
+                return None
+            chunks.append(await reader.readexactly(length))
+            if await reader.readexactly(2) != b'\r\n':
+                raise ValueError("Malformed chunk")
+        # Skip any trailer fields up to the blank line
+        while await reader.readuntil(b'\r\n') != b'\r\n':
+            pass
+        return b''.join(chunks)
+    
+    def _environ(self, method, target, protocol, headers, body, peer):
+        path, _, query = target.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote_to_bytes(path).decode('latin-1'),
+            'QUERY_STRING': query,
+            'SERVER_NAME': self.host,
+            'SERVER_PORT': str(self.port),
+            'SERVER_PROTOCOL': protocol,
+            'REMOTE_ADDR': peer[0],
+            'REMOTE_PORT': str(peer[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in headers.items():
+            if name == 'content-type':
+                environ['CONTENT_TYPE'] = value
+            elif name == 'content-length':
+                environ['CONTENT_LENGTH'] = value
+            else:
+                environ['HTTP_' + name.upper().replace('-', '_')] = value
+        return environ
+    
+    def _call_app(self, environ):
+        """Run the WSGI app; buffer the body unless it is a stream"""
+        started = []
+        
+        def start_response(status, response_headers, exc_info=None):
+            started[:] = [status, response_headers]
+        
+        result = self.app(environ, start_response)
+        status, response_headers = started
+        if any(name.lower() == 'content-length' for name, _ in response_headers):
+            try:
+                return status, response_headers, b''.join(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+        return status, response_headers, iter(result)
+    
+    @staticmethod
+    def _head(protocol, status, response_headers, keep_alive, extra=()):
+        lines = [f'{protocol} {status}']
+        lines.extend(f'{name}: {value}' for name, value in response_headers)
+        lines.extend(extra)
+        lines.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+    
+    async def _write_response(self, writer, protocol, status, response_headers, body, keep_alive):
+        writer.write(self._head(protocol, status, response_headers, keep_alive) + body)
+        await writer.drain()
+    
+    async def _write_simple(self, writer, code):
+        writer.write(f'HTTP/1.1 {code} {HTTP_REASONS.get(code, "")}\r\n'
+                     'Content-Length: 0\r\nConnection: close\r\n\r\n'.encode('latin-1'))
+        await writer.drain()
+    
+    async def _stream_response(self, writer, protocol, status, response_headers, iterator, keep_alive):
+        chunked = protocol == 'HTTP/1.1'
+        extra = ('Transfer-Encoding: chunked',) if chunked else ()
+        keep_alive = keep_alive and chunked
+        writer.write(self._head(protocol, status, response_headers, keep_alive, extra))
+        try:
+            while True:
+                chunk = await self.loop.run_in_executor(self.stream_executor, next, iterator, None)
+                if chunk is None:
+                    break
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                if not chunk:
+                    continue
+                writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk) if chunked else chunk)
+                await writer.drain()
+            if chunked:
+                writer.write(b'0\r\n\r\n')
+                await writer.drain()
+            return keep_alive
+        finally:
+            if hasattr(iterator, 'close'):
+                try:
+                    await self.loop.run_in_executor(self.stream_executor, iterator.close)
+                except RuntimeError:
+                    pass  # executor already shut down by close()
+
+class HttpListener:
+    """The Flask app served on a background thread by Waitress or the asyncio core
+    
+    Each listener owns its socket map or event loop, so it can be closed
+    or resized without touching the WebSocket and UDP channels. Waitress is
+    only driven through its public API, so a different thread count means
+    a new listener (see Listeners); the asyncio core resizes in place.
+    """
+    
+    # How long close() waits for the serving thread to finish
+    CLOSE_TIMEOUT = 5.0
+    
+    def __init__(self, core, host, port, threads):
+        self.core = core
+        self.threads = threads
+        if core == 'asyncio':
+            self.server = AsyncioServer(app, host, port, threads)
+            started, self.error = threading.Event(), None
+            self.thread = threading.Thread(target=self._serve_asyncio, args=(started,),
+                                           name='http', daemon=True)
+            self.thread.start()
+            started.wait()
+            if self.error is not None:
+                raise self.error
+            self.port = self.server.port
+        else:
+            from waitress import create_server
+            # Our own socket map, so close() can also drop open connections.
+            # poll() skips descriptors closed from another thread, where
+            # select() would fail with EBADF
+            self.channels = {}
+            self.server = create_server(app, map=self.channels, host=host, port=port, threads=threads,
+                                        asyncore_use_poll=True)
+            self.port = self.server.effective_port
+            self.thread = threading.Thread(target=self.server.run, name='http', daemon=True)
+            self.thread.start()
+    
+    def _serve_asyncio(self, started):
+        async def run():
+            try:
+                await self.server.start()
+            except OSError as e:
+                self.error = e
+                return
+            finally:
+                started.set()
+            try:
+                await self.server.server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+        asyncio.run(run())
+    
+    def set_threads(self, threads):
+        """Resize the asyncio app pool; Waitress listeners are replaced instead"""
+        if threads != self.threads and self.core == 'asyncio':
+            self.threads = threads
+            self.server.set_workers(threads)
+    
+    def close(self):
+        self.server.close()
+        if self.core != 'asyncio':
+            # run() returns once no keep-alive connections are left
+            for channel in list(self.channels.values()):
+                channel.close()
+        self.thread.join(self.CLOSE_TIMEOUT)
+
+def start_http_server():
+    """Start the HTTP listener described by the config; raises OSError if it cannot bind"""
+    server_config = config.get('server', {})
+    return HttpListener(server_config.get('core', 'waitress'), config.get('host', '0.0.0.0'),
+                        config.get('port', 8080), server_config.get('threads', 4))
+
+class Listeners:
+    """The HTTP, WebSocket and UDP listeners, each rebound on its own when its address changes"""
+    
+    def __init__(self):
+        self.serve_http = True
+        self.started = False
+        self.servers = {}
+        self.addresses = {}
+    
+    @property
+    def http(self):
+        return self.servers.get('http')
+    
+    @property
+    def websocket(self):
+        return self.servers.get('websocket')
+    
+    @property
+    def udp(self):
+        return self.servers.get('udp')
+    
+    def update(self):
+        """Start, move or stop listeners to match the config"""
+        try:
+            moved = self._update()
+        finally:
+            started, self.started = self.started, True
+        if started and moved:
+            announcer.announce('moved')
+    
+    def _update(self):
+        moved = self._swap('websocket', websocket_address(), start_websocket_server)
+        moved = self._swap('udp', udp_address(), start_udp_server) or moved
+        if self.serve_http:
+            server_config = config.get('server', {})
+            core = server_config.get('core', 'waitress')
+            # A new Waitress thread count needs a new server
+            threads = server_config.get('threads', 4) if core == 'waitress' else None
+            address = (core, threads, config.get('host', '0.0.0.0'), config.get('port', 8080))
+            previous = self.addresses.get('http')
+            if self._swap('http', address, start_http_server):
+                # Phones only need to hear about it if the listener moved
+                moved = moved or previous is None or previous[2:] != address[2:]
+            elif self.http:
+                self.http.set_threads(server_config.get('threads', 4))
+        if self.udp:
+            udp_config = config.get('udp', {})
+            self.udp.configure(udp_config.get('window', 64), udp_config.get('max_age_ms', 1000))
+        return moved
+    
+    def _swap(self, name, address, start):
+        """Replace one listener if its address changed; True if it did"""
+        previous = self.addresses.get(name)
+        if address == previous:
+            return False
+        old = self.servers.pop(name, None)
+        if old is not None and address is not None and address[-1] == previous[-1]:
+            # Same port: the old socket has to go first
+            old.close()
+            old = None
+        try:
+            new = start() if address is not None else None
+        except Exception:
+            if old is not None:
+                # Still serving its previous address
+                self.servers[name] = old
+            else:
+                self.addresses.pop(name, None)
+            raise
+        if old is not None:
+            old.close()
+        if new is not None:
+            self.servers[name] = new
+            self.addresses[name] = address
+        else:
+            self.addresses.pop(name, None)
+        if self.started:
+            if new is not None:
+                print(f"{name} listener on {address[-2]}:{address[-1]}")
+            elif address is None:
+                print(f"{name} listener stopped")
+        return True
+    
+    def close(self):
+        for server in self.servers.values():
+            server.close()
+        self.servers.clear()
+        self.addresses.clear()
+
+listeners = Listeners()
+
+def configure_runtime(previous=None):
+    """Push the current config snapshot into the running subsystems"""
+    previous = previous or {}
+    authenticator.configure(config.get('api_token'), config.get('auth', {}))
+    metrics.enabled = config.get('metrics', {}).get('enabled', True)
+    if not previous or previous.get('input_backend') != config.get('input_backend'):
+        # At startup pynput is opened by finish_startup() instead
+        set_input_backend(config.get('input_backend', 'pynput'), lazy=not previous)
+    volume_controller.set_backend(config.get('audio_backend', 'auto'))
+    dispatch_config = config.get('dispatch', {})
+    dispatcher.configure(dispatch_config.get('queue_size'), dispatch_config.get('overflow'),
+                         dispatch_config.get('client_rate'), dispatch_config.get('client_burst'),
+                         dispatch_config.get('max_lease_ms'))
+    coalescer.configure(config.get('coalesce', {}))
+    configure_shortcuts(config.get('shortcuts', {}))
+    pointer_streamer.configure(config.get('pointer', {}))
+    repeat_manager.configure(config.get('repeat', {}))
+    text_injector.configure(config.get('text', {}))
+    journal.configure(config.get('journal', {}))
+    announcer.configure(config.get('announce', {}))
+    hub.configure(config.get('hub', {}))
+    refresh_interval = config.get('network', {}).get('refresh_interval_s')
+    if refresh_interval:
+        network_identity.refresh_interval = refresh_interval
+
+def finish_startup():
+    """Startup work that does not have to hold up the listeners"""
+    if input_backend.name == 'pynput':
+        try:
+            input_backend.open()
+        except Exception as e:
+            print(f"Input backend not ready: {e}")
+    volume_controller.warm_up()
+    
+    # Discover the network identity once; it is refreshed in the background
+    network_identity.start(config.get('network', {}).get('refresh_interval_s'))
+    network_identity.ready.wait()
+    
+    # Generate and display QR code for easy pairing
+    generate_config_qr()
+    
+    # Edits to config.json are applied without a restart
+    config_watcher.start()
+    
+    seconds = metrics.mark_startup('ready')
+    print(f"Startup finished {seconds * 1000:.0f} ms after start")
+
+def main():
+    """Main entry point"""
+    global CONFIG_PATH
+    metrics.mark_startup('import')
+    parser = argparse.ArgumentParser(description="Android PC Controller Server")
+    parser.add_argument('--config', help="config file to use instead of config.json next to server.py")
+    args = parser.parse_args()
+    if args.config:
+        # Lets several instances (e.g. a hub and its targets) run from one directory
+        CONFIG_PATH = config_watcher.path = os.path.abspath(args.config)
+    load_config()
+    configure_runtime()
+    
+    print(f"Starting Android PC Controller Server")
+    print(f"Platform: {platform.system()}")
+    print(f"Input backend: {input_backend.name}")
+    print(f"Host: {config.get('host', '0.0.0.0')}")
+    print(f"Port: {config.get('port', 8080)}")
+    print(f"API Token: {config.get('api_token', 'NOT SET')}")
+    print("\nEndpoints:")
+    print("  GET  /health - Health check")
+    print("  GET  /probe - Latency probe with server timestamps")
+    print("  POST /auth/ticket - Short-lived session ticket (send as X-Ticket)")
+    print("  GET  /mac - Get MAC address")
+    print("  POST /arrow - Arrow key press (\"hold\": true starts a repeat session)")
+    print("  POST /repeat/stop, /repeat/heartbeat - Control a repeat session")
+    print("  POST /key - Key, chord (ctrl+shift+t) or named shortcut")
+    print("  GET  /shortcuts - Named shortcuts from config.json")
+    print("  POST /type - Type text")
+    print("  GET  /type/<job> - Typing progress")
+    print("  POST /volume - Volume control (up, down, set, mute, unmute, toggle_mute)")
+    print("  GET  /volume - Current volume (?since=<version> to long-poll)")
+    print("  GET  /volume/events - Volume change stream (server-sent events)")
+    print("  POST /batch - Ordered list of commands")
+    print("  POST /pointer - Stream pointer motion, clicks and scrolling")
+    print("  POST /lease, /lease/release - Exclusive control for one client")
+    print("  GET  /clients - Per-client queue and latency statistics")
+    print("  POST /macro/record, /macro/stop, /macro/play - Record and replay commands")
+    print("  GET  /metrics - Prometheus metrics")
+    print("  GET  /targets - Downstream servers (hub mode)")
+    
+    try:
+        listeners.update()
+    except ImportError:
+        print("Warning: Waitress not available, falling back to Flask development server")
+        print("Install waitress for production use: pip install waitress")
+        listeners.serve_http = False
+        listeners.update()
+    except OSError as e:
+        # Without the HTTP listener there is nothing for the phone to talk to
+        print(f"Could not start HTTP server on port {config.get('port', 8080)}: {e}")
+        listeners.close()
+        sys.exit(1)
+    
+    if listeners.websocket:
+        print(f"  WS   ws://<host>:{listeners.websocket.server_address[1]}/ - Persistent command channel")
+    if listeners.udp:
+        print(f"  UDP  <host>:{listeners.udp.server_address[1]} - Signed gesture datagrams")
+    if hub.enabled:
+        print(f"Hub mode: routing to {', '.join(hub.targets) or 'no targets'}")
+    
+    listening = metrics.mark_startup('listening')
+    print(f"Listening {listening * 1000:.0f} ms after start "
+          f"(imports took {metrics.startup['import'] * 1000:.0f} ms)")
+    
+    # Tell waiting phones right away rather than at their next poll
+    announcer.start()
+    if announcer.enabled:
+        print(f"Announcing readiness to {announcer.address}:{announcer.port}")
+    
+    # Everything else can happen while gestures are already being served
+    threading.Thread(target=finish_startup, name='startup', daemon=True).start()
+    
+    print("Press Ctrl+C to stop")
+    
+    try:
+        if not listeners.serve_http:
+            app.run(
+                host=config.get('host', '0.0.0.0'),
+                port=config.get('port', 8080),
+                debug=False
+            )
+            return
+        if listeners.http:
+            server_config = config.get('server', {})
+            print(f"Serving with {server_config.get('core', 'waitress')} "
+                  f"({server_config.get('threads', 4)} threads)")
+        while True:
+            time.sleep(3600)
     except KeyboardInterrupt:
         print("\nServer stopped")
 
@@ -0,0 +1,115 @@
+"""Unit tests for request parsing in the asyncio server core"""
+
+import asyncio
+import socket
+import threading
+
+import pytest
+
+import server
+
+def echo_app(environ, start_response):
+    body = environ['wsgi.input'].read()
+    reply = b'%s %s %s' % (environ['REQUEST_METHOD'].encode(), environ.get('CONTENT_LENGTH', '').encode(), body)
+    start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', str(len(reply)))])
+    return [reply]
+
+@pytest.fixture
+def core():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    core = server.AsyncioServer(echo_app, '127.0.0.1', 0, workers=2)
+    asyncio.run_coroutine_threadsafe(core.start(), loop).result(5)
+    yield core
+    core.close()
+    
+    async def cancel_connections():
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    asyncio.run_coroutine_threadsafe(cancel_connections(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    loop.close()
+
+@pytest.fixture
+def conn(core):
+    sock = socket.create_connection(('127.0.0.1', core.port), timeout=5)
+    yield sock
+    sock.close()
+
+def read_response(sock):
+    """(status code, headers, body) of one response with a Content-Length"""
+    data = b''
+    while b'\r\n\r\n' not in data:
+        chunk = sock.recv(4096)
+        assert chunk, "connection closed"
+        data += chunk
+    head, _, body = data.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    headers = dict(line.lower().split(': ', 1) for line in lines[1:])
+    length = int(headers.get('content-length', 0))
+    while len(body) < length:
+        body += sock.recv(4096)
+    return int(lines[0].split()[1]), headers, body
+
+def test_content_length_and_keep_alive(conn):
+    conn.sendall(b'POST /a HTTP/1.1\r\nHost: x\r\nContent-Length: 5\r\n\r\nhello')
+    assert read_response(conn)[::2] == (200, b'POST 5 hello')
+    conn.sendall(b'GET /b HTTP/1.1\r\nHost: x\r\n\r\n')
+    status, headers, body = read_response(conn)
+    assert status == 200 and headers['connection'] == 'keep-alive'
+
+def test_chunked_body(conn):
+    conn.sendall(b'POST / HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n'
+                 b'5;name=value\r\nhello\r\n'
+                 b'6\r\n world\r\n'
+                 b'0\r\nX-Trailer: yes\r\n\r\n')
+    assert read_response(conn)[::2] == (200, b'POST 11 hello world')
+    # The connection is still in sync for the next request
+    conn.sendall(b'POST / HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n0\r\n\r\n')
+    assert read_response(conn)[::2] == (200, b'POST 0 ')
+
+def test_expect_continue(conn):
+    conn.sendall(b'POST / HTTP/1.1\r\nHost: x\r\nContent-Length: 4\r\nExpect: 100-continue\r\n\r\n')
+    assert conn.recv(4096) == b'HTTP/1.1 100 Continue\r\n\r\n'
+    conn.sendall(b'body')
+    assert read_response(conn)[::2] == (200, b'POST 4 body')
+
+def test_expect_continue_with_chunked_body(conn):
+    conn.sendall(b'POST / HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\nExpect: 100-continue\r\n\r\n')
+    assert conn.recv(4096) == b'HTTP/1.1 100 Continue\r\n\r\n'
+    conn.sendall(b'3\r\nabc\r\n0\r\n\r\n')
+    assert read_response(conn)[::2] == (200, b'POST 3 abc')
+
+def test_too_large_body_is_refused_before_continue(monkeypatch, conn):
+    monkeypatch.setattr(server, 'MAX_REQUEST_BODY', 8)
+    conn.sendall(b'POST / HTTP/1.1\r\nHost: x\r\nContent-Length: 9\r\nExpect: 100-continue\r\n\r\n')
+    assert read_response(conn)[0] == 413
+
+def test_too_large_chunked_body(monkeypatch, conn):
+    monkeypatch.setattr(server, 'MAX_REQUEST_BODY', 8)
+    conn.sendall(b'POST / HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n'
+                 b'5\r\nhello\r\n5\r\nworld\r\n0\r\n\r\n')
+    assert read_response(conn)[0] == 413
+
+@pytest.mark.parametrize('head, status', [
+    (b'Expect: something-else\r\n', 417),
+    (b'Transfer-Encoding: gzip\r\n', 501),
+    (b'Content-Length: many\r\n', 400),
+])
+def test_refused_requests(conn, head, status):
+    conn.sendall(b'POST / HTTP/1.1\r\nHost: x\r\n' + head + b'\r\n')
+    code, headers, _ = read_response(conn)
+    assert code == status and headers['connection'] == 'close'
+    assert conn.recv(4096) == b''
+
+def test_malformed_chunk(conn):
+    conn.sendall(b'POST / HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\nhello\r\n0\r\n\r\n')
+    assert read_response(conn)[0] == 400
+
+def test_chunk_longer_than_its_size(conn):
+    conn.sendall(b'POST / HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n2\r\nhello\r\n0\r\n\r\n')
+    assert read_response(conn)[0] == 400
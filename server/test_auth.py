@@ -0,0 +1,70 @@
+"""Unit tests for token, ticket and failed-attempt checks"""
+
+import pytest
+
+import server
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(server.time, 'monotonic', clock)
+    return clock
+
+@pytest.fixture
+def auth():
+    authenticator = server.Authenticator()
+    authenticator.configure('secret', {"ticket_ttl_s": 10, "failure_burst": 3, "failure_rate": 0.5})
+    return authenticator
+
+def test_token_checks(auth):
+    assert auth.check_header('Bearer secret')
+    assert not auth.check_header('Bearer secreT')
+    assert not auth.check_header('secret')
+    assert not auth.check_header(None)
+    assert auth.check_token('secret')
+    assert not auth.check_token('')
+
+def test_no_token_configured():
+    auth = server.Authenticator()
+    auth.configure(None, {})
+    assert not auth.check_header('Bearer ')
+    assert not auth.check_token('anything')
+
+def test_ticket_expires(auth, clock):
+    ticket = auth.issue_ticket()
+    assert auth.check_ticket(ticket)
+    assert not auth.check_ticket('forged')
+    clock.now += 11
+    assert not auth.check_ticket(ticket)
+
+def test_token_change_drops_tickets(auth):
+    ticket = auth.issue_ticket()
+    auth.configure('rotated', {})
+    assert not auth.check_ticket(ticket)
+
+def test_failure_bucket(auth, clock):
+    assert auth.allow('10.0.0.2')
+    for _ in range(3):
+        auth.failed('10.0.0.2')
+    assert not auth.allow('10.0.0.2')
+    # Other addresses have their own bucket
+    assert auth.allow('10.0.0.3')
+    # One attempt comes back every 2 seconds at 0.5/s
+    clock.now += 1.9
+    assert not auth.allow('10.0.0.2')
+    clock.now += 0.2
+    assert auth.allow('10.0.0.2')
+
+def test_failure_bucket_caps_at_burst(auth, clock):
+    auth.failed('10.0.0.2')
+    clock.now += 3600
+    for _ in range(3):
+        auth.failed('10.0.0.2')
+    assert not auth.allow('10.0.0.2')
@@ -0,0 +1,100 @@
+"""Unit tests for duplicate, backlog and freshness filtering"""
+
+import time
+
+import pytest
+
+import server
+
+@pytest.fixture
+def coalescer():
+    coalescer = server.Coalescer()
+    coalescer.configure({'event_window': 4, 'max_repeat_backlog': 2})
+    return coalescer
+
+@pytest.fixture
+def client():
+    return server.DispatchClient('a', 0)
+
+def command(repeat_key='up', event_id=None, sent=None, max_age=None):
+    command = server.PreparedCommand({'action': 'arrow_up'}, lambda: None, repeat_key)
+    command.event_id, command.sent, command.max_age = event_id, sent, max_age
+    return command
+
+def queue(coalescer, client, commands):
+    """Queue what the coalescer lets through, as the dispatcher does"""
+    accepted = coalescer.filter(client, commands)
+    if accepted:
+        client.jobs.append(server.DispatchJob(accepted))
+        coalescer.remember(client, accepted)
+    return accepted
+
+def test_duplicate_event_ids(coalescer, client):
+    first = command(event_id='e1')
+    assert queue(coalescer, client, [first]) == [first]
+    retry = command(event_id='e1')
+    assert queue(coalescer, client, [retry]) == []
+    assert retry.status == 'duplicate'
+    assert retry.response()['duplicate'] is True
+    # Within one batch as well
+    batch = [command(None, 'e2'), command(None, 'e2'), command(None)]
+    assert queue(coalescer, client, batch) == [batch[0], batch[2]]
+    assert client.duplicates == 2
+
+def test_event_window(coalescer, client):
+    for i in range(5):
+        queue(coalescer, client, [command(None, f'e{i}')])
+    # e0 has fallen out of the 4-id window
+    assert list(client.events) == ['e1', 'e2', 'e3', 'e4']
+    assert queue(coalescer, client, [command(None, 'e0')])
+
+def test_repeat_backlog(coalescer, client):
+    assert queue(coalescer, client, [command()])
+    assert queue(coalescer, client, [command()])
+    third = command()
+    assert queue(coalescer, client, [third]) == []
+    assert third.status == 'dropped' and client.coalesced == 1
+    # Other keys and batches are not capped
+    assert queue(coalescer, client, [command('down')])
+    assert queue(coalescer, client, [command(), command()])
+
+def test_backlog_cap_can_be_disabled(coalescer, client):
+    coalescer.max_repeat_backlog = 0
+    for _ in range(5):
+        assert queue(coalescer, client, [command()])
+
+def test_stale_command_is_expired(coalescer, client):
+    now = time.time() * 1000
+    # The fastest command sets the client's clock offset
+    fresh = command(sent=now, max_age=100)
+    assert queue(coalescer, client, [fresh])
+    assert fresh.deadline is not None
+    stale = command(sent=now - 500, max_age=100)
+    assert queue(coalescer, client, [stale]) == []
+    assert stale.status == 'expired' and client.expired == 1
+
+def test_clock_skew_does_not_matter(coalescer, client):
+    skewed = time.time() * 1000 - 3600 * 1000
+    assert queue(coalescer, client, [command(sent=skewed, max_age=100)])
+    assert queue(coalescer, client, [command('down', sent=skewed + 10, max_age=100)])
+
+def test_default_max_age(coalescer, client):
+    coalescer.max_age_ms = 50
+    plain = command()
+    assert queue(coalescer, client, [plain])
+    assert plain.deadline is not None
+    forever = command('down', max_age=0)
+    assert queue(coalescer, client, [forever])
+    assert forever.deadline is None
+
+def test_injector_skips_expired_commands(monkeypatch):
+    monkeypatch.setattr(server, 'coalescer', server.Coalescer())
+    dispatcher = server.InputDispatcher()
+    injected = []
+    late = server.PreparedCommand({'action': 'late'}, lambda: injected.append('late'))
+    late.max_age = 1
+    # Wait out the budget while the injector is busy with the first command
+    busy = server.PreparedCommand({'action': 'busy'}, lambda: time.sleep(0.02))
+    job = dispatcher.submit([busy, late], wait=True, timeout=5)
+    assert job.done.is_set()
+    assert late.status == 'expired' and injected == []
@@ -0,0 +1,62 @@
+"""Unit tests for the binary command codec"""
+
+import pytest
+
+import codec
+
+SAMPLES = [
+    {"cmd": "arrow", "direction": "left"},
+    {"cmd": "key", "key": "enter"},
+    {"cmd": "key", "key": "ctrl+shift+t", "wait": True},
+    {"cmd": "volume", "action": "toggle_mute"},
+    {"cmd": "volume", "action": "set", "level": 40},
+    {"cmd": "type", "text": "héllo ✓"},
+    {"cmd": "type", "text": "pasted", "mode": "clipboard"},
+    {"cmd": "pointer", "samples": [[1000, 4, -3], [1008, -12, 7]],
+     "buttons": [[1010, "left", "click"]], "scroll": [[1012, 0, -1]]},
+    {"cmd": "key", "key": "enter", "event_id": 7, "sent_ms": 1700000000000,
+     "max_age_ms": 250, "wait": True, "ack": True},
+]
+
+@pytest.mark.parametrize("command", SAMPLES)
+def test_round_trip(command):
+    assert codec.decode(codec.encode_command(command)) == [command]
+
+def test_batch_round_trip():
+    assert codec.decode(codec.encode(SAMPLES)) == SAMPLES
+
+@pytest.mark.parametrize("command", SAMPLES)
+def test_truncated_frame(command):
+    frame = codec.encode_command(command)
+    for length in range(len(frame)):
+        with pytest.raises(codec.CodecError):
+            codec.decode(frame[:length])
+
+def test_unknown_opcode():
+    with pytest.raises(codec.CodecError, match="Unknown opcode"):
+        codec.decode(bytes((99, 0, 0)))
+
+def test_unknown_command():
+    with pytest.raises(codec.CodecError):
+        codec.encode_command({"cmd": "reboot"})
+
+def test_invalid_field():
+    with pytest.raises(codec.CodecError):
+        codec.encode_command({"cmd": "arrow", "direction": "sideways"})
+
+def test_frame_limit():
+    message = codec.encode(SAMPLES[:3])
+    assert len(codec.decode(message, limit=3)) == 3
+    with pytest.raises(codec.CodecError, match="Too many"):
+        codec.decode(message, limit=2)
+
+def test_results_round_trip():
+    results = [{"status": "ok"}, {"status": "dropped"}, {"status": "ok", "job": "abc123"},
+               {"status": "ok", "duplicate": True}, {"error": "Unsupported key: nope"}]
+    assert codec.decode_results(codec.encode_results(results)) == [
+        ('ok', ''), ('dropped', ''), ('ok', 'abc123'), ('duplicate', ''), ('error', 'Unsupported key: nope')]
+
+def test_truncated_results():
+    data = codec.encode_result({"error": "Queue full"})
+    with pytest.raises(codec.CodecError):
+        codec.decode_results(data[:-1])
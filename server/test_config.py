@@ -0,0 +1,57 @@
+"""Unit tests for config.json validation"""
+
+import json
+import types
+
+import server
+
+def test_shipped_config_is_valid():
+    with open(server.CONFIG_PATH) as f:
+        assert server.validate_config(json.load(f)) == []
+
+def test_api_token_required():
+    assert server.validate_config({}) == ["api_token must be set"]
+
+def test_types_and_ranges():
+    errors = server.validate_config({
+        "api_token": "t",
+        "port": 70000,
+        "input_backend": "xdotool",
+        "server": {"threads": 2.5},
+        "udp": {"enabled": "yes"},
+        "repeat": {"acceleration": 2},
+    })
+    assert errors == [
+        "port must be between 1 and 65535",
+        "input_backend must be one of pynput, uinput, recording",
+        "server.threads must be an integer",
+        "udp.enabled must be a bool",
+        "repeat.acceleration must be between 0.1 and 1.0",
+    ]
+
+def test_booleans_are_not_numbers():
+    assert server.validate_config({"api_token": "t", "port": True}) == ["port must be an integer"]
+
+def test_unknown_keys_only_warn(capsys):
+    assert server.validate_config({"api_token": "t", "colour": "blue", "udp": {"mtu": 1}}) == []
+    output = capsys.readouterr().out
+    assert "'colour'" in output and "'udp.mtu'" in output
+
+def test_section_must_be_object():
+    assert server.validate_config({"api_token": "t", "udp": 5}) == ["udp must be an object"]
+
+def test_shortcuts():
+    assert server.validate_config({"api_token": "t", "shortcuts": {"copy": "ctrl+c"}}) == []
+    errors = server.validate_config({"api_token": "t", "shortcuts": {"copy": "ctrl+nope"}})
+    assert len(errors) == 1 and errors[0].startswith("shortcuts entry 'copy' is invalid")
+
+def test_hub_targets():
+    ok = {"den": {"url": "http://10.0.0.5:8080", "token": "x"}}
+    assert server.validate_config({"api_token": "t", "hub": {"targets": ok}}) == []
+    for targets in ({"den": {"url": "ftp://10.0.0.5"}}, {"a,b": {"url": "http://h"}}, {"den": {}}):
+        assert len(server.validate_config({"api_token": "t", "hub": {"targets": targets}})) == 1
+
+def test_freeze_config():
+    frozen = server.freeze_config({"a": {"b": [1, 2]}})
+    assert isinstance(frozen, types.MappingProxyType)
+    assert frozen["a"]["b"] == (1, 2)
@@ -0,0 +1,115 @@
+"""Unit tests for the per-client input dispatcher"""
+
+import threading
+import time
+
+import pytest
+
+import server
+
+@pytest.fixture
+def dispatcher(monkeypatch):
+    coalescer = server.Coalescer()
+    coalescer.max_repeat_backlog = 0
+    monkeypatch.setattr(server, 'coalescer', coalescer)
+    dispatcher = server.InputDispatcher(max_size=2)
+    monkeypatch.setattr(server, 'dispatcher', dispatcher)
+    dispatcher.log = []
+    return dispatcher
+
+def command(dispatcher, name, repeat_key=None):
+    return server.PreparedCommand({'action': name}, lambda: dispatcher.log.append(name), repeat_key)
+
+@pytest.fixture
+def blocked(dispatcher):
+    """Hold the injector inside a job until the test releases it"""
+    started, gate = threading.Event(), threading.Event()
+    def inject():
+        started.set()
+        gate.wait(5)
+    dispatcher.submit([server.PreparedCommand({'action': 'block'}, inject)], client='blocker')
+    assert started.wait(5)
+    yield gate
+    gate.set()
+
+def drain(dispatcher, gate, *clients):
+    gate.set()
+    deadline = time.monotonic() + 5
+    while dispatcher.depth:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    # The last job may still be injecting
+    dispatcher.submit([command(dispatcher, 'end')], wait=True, timeout=5, client='end')
+    return dispatcher.log[:-1]
+
+def test_clients_take_turns(dispatcher, blocked):
+    dispatcher.configure(max_size=8)
+    for name in ('a1', 'a2', 'a3'):
+        dispatcher.submit([command(dispatcher, name)], client='a')
+    for name in ('b1', 'b2'):
+        dispatcher.submit([command(dispatcher, name)], client='b')
+    assert drain(dispatcher, blocked) == ['a1', 'b1', 'a2', 'b2', 'a3']
+
+def test_drop_oldest(dispatcher, blocked):
+    jobs = [dispatcher.submit([command(dispatcher, name)], client='a') for name in ('a1', 'a2', 'a3')]
+    assert jobs[0].commands[0].status == 'dropped'
+    assert drain(dispatcher, blocked) == ['a2', 'a3']
+    stats = {s['client']: s for s in dispatcher.client_stats()}
+    assert stats['a']['dropped'] == 1
+
+def test_reject(dispatcher, blocked):
+    dispatcher.configure(overflow='reject')
+    dispatcher.submit([command(dispatcher, 'a1')], client='a')
+    dispatcher.submit([command(dispatcher, 'a2')], client='a')
+    with pytest.raises(server.QueueFullError):
+        dispatcher.submit([command(dispatcher, 'a3')], client='a')
+    # Other clients keep their own room
+    dispatcher.submit([command(dispatcher, 'b1')], client='b')
+    assert drain(dispatcher, blocked) == ['a1', 'b1', 'a2']
+
+def test_coalesce(dispatcher, blocked):
+    dispatcher.configure(overflow='coalesce')
+    dispatcher.submit([command(dispatcher, 'up1', 'up')], client='a')
+    dispatcher.submit([command(dispatcher, 'enter', 'enter')], client='a')
+    dispatcher.submit([command(dispatcher, 'up2', 'up')], client='a')
+    with pytest.raises(server.QueueFullError):
+        dispatcher.submit([command(dispatcher, 'down', 'down')], client='a')
+    assert drain(dispatcher, blocked) == ['enter', 'up2']
+
+def test_rate_limit(dispatcher):
+    dispatcher.configure(max_size=8, rate=2)
+    assert dispatcher.burst == 2
+    dispatcher.submit([command(dispatcher, 'a1'), command(dispatcher, 'a2')], client='a')
+    with pytest.raises(server.RateLimitedError):
+        dispatcher.submit([command(dispatcher, 'a3')], client='a')
+    # Server-generated repeats were limited when they were requested
+    dispatcher.submit([command(dispatcher, 'r1')], source='repeat', client='a')
+
+def test_slow_rate_still_allows_one_command(dispatcher):
+    dispatcher.configure(rate=0.5)
+    assert dispatcher.burst == 1
+    dispatcher.submit([command(dispatcher, 'a1')], client='a')
+
+def test_lease(dispatcher):
+    dispatcher.configure(max_size=8, max_lease_ms=500)
+    assert dispatcher.acquire_lease('a', 10) == (True, 0.5)
+    with pytest.raises(server.LeaseHeldError):
+        dispatcher.submit([command(dispatcher, 'b1')], client='b')
+    dispatcher.submit([command(dispatcher, 'a1')], client='a')
+    granted, remaining = dispatcher.acquire_lease('b', 1)
+    assert not granted and 0 < remaining <= 0.5
+    assert not dispatcher.release_lease('b')
+    assert dispatcher.release_lease('a')
+    dispatcher.submit([command(dispatcher, 'b1')], client='b')
+
+def test_lease_expires(dispatcher):
+    dispatcher.acquire_lease('a', 0.01)
+    time.sleep(0.02)
+    assert dispatcher.lease() == (None, 0.0)
+    dispatcher.submit([command(dispatcher, 'b1')], client='b')
+
+@pytest.mark.parametrize('ttl_ms', [0, -1, 'nan', 'inf', 'soon'])
+def test_lease_ttl_must_be_finite_and_positive(dispatcher, ttl_ms):
+    with pytest.raises(server.CommandError):
+        server.lease_response('a', {'ttl_ms': ttl_ms})
+    assert dispatcher.lease() == (None, 0.0)
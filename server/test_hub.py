@@ -0,0 +1,159 @@
+"""Unit tests for hub routing to downstream servers"""
+
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+import server
+
+TOKEN = 'hub-token'
+
+class FakeTarget(http.server.ThreadingHTTPServer):
+    """A downstream server that records what the hub forwards"""
+    daemon_threads = True
+    
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeHandler)
+        self.received = []
+        self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+        threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True).start()
+
+class FakeHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    
+    def do_GET(self):
+        # Health checks
+        now = time.time() * 1000
+        self.reply({"t1": now, "t2": now})
+    
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.received.append((self.path, dict(self.headers), json.loads(body)))
+        self.reply({"status": "ok", "from": self.server.url})
+    
+    def reply(self, result):
+        reply = json.dumps(result).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+    
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def targets():
+    targets = {'den': FakeTarget(), 'office': FakeTarget()}
+    yield targets
+    for target in targets.values():
+        target.shutdown()
+        target.server_close()
+
+@pytest.fixture
+def hub(monkeypatch, targets):
+    hub = server.Hub()
+    hub.configure({'enabled': True, 'health_interval_s': 3600,
+                   'targets': {name: {'url': target.url, 'token': 'down-' + name}
+                               for name, target in targets.items()}})
+    monkeypatch.setattr(server, 'hub', hub)
+    # Let the first health check finish so it cannot race the test
+    deadline = time.monotonic() + 5
+    while not all(downstream.healthy for downstream in hub.targets.values()):
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+    yield hub
+    for downstream in hub.targets.values():
+        downstream.close()
+
+@pytest.fixture
+def local(monkeypatch):
+    server.authenticator.configure(TOKEN, {})
+    submitted = []
+    monkeypatch.setattr(server.dispatcher, 'submit',
+                        lambda commands, **kwargs: submitted.extend(c.result for c in commands))
+    return submitted
+
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+def post(client, path, data, **headers):
+    headers = dict(headers, Authorization=f'Bearer {TOKEN}')
+    return client.post(path, json=data, headers={k.replace('_', '-'): v for k, v in headers.items()})
+
+def test_resolve(hub):
+    assert hub.resolve('den') == ['den']
+    assert hub.resolve('office, den,office') == ['office', 'den']
+    assert hub.resolve('all') == ['den', 'office', 'local']
+    assert hub.resolve('local,all') == ['local', 'den', 'office']
+    hub.include_local = False
+    assert hub.resolve('all') == ['den', 'office']
+    for spec in ('attic', '', ' , ', None, 3):
+        with pytest.raises(server.CommandError):
+            hub.resolve(spec)
+
+def test_single_target(hub, targets, local, client):
+    response = post(client, '/arrow', {'direction': 'up', 'target': 'den'}, X_Client_Id='phone')
+    assert response.status_code == 200
+    assert response.get_json() == {'status': 'ok', 'from': targets['den'].url}
+    path, headers, body = targets['den'].received[0]
+    assert path == '/arrow' and body == {'direction': 'up'}
+    assert headers['Authorization'] == 'Bearer down-den'
+    assert headers['X-Client-Id'] == 'phone'
+    assert local == [] and targets['office'].received == []
+
+def test_header_and_query_targets(hub, targets, local, client):
+    post(client, '/key', {'key': 'enter'}, X_Target='office')
+    post(client, '/key?target=den', {'key': 'esc'})
+    assert targets['office'].received[0][2] == {'key': 'enter'}
+    assert targets['den'].received[0][2] == {'key': 'esc'}
+
+def test_local_and_default_target(hub, targets, local, client):
+    post(client, '/arrow', {'direction': 'up'})
+    post(client, '/arrow', {'direction': 'down', 'target': 'local'})
+    hub.default_target = 'den'
+    post(client, '/arrow', {'direction': 'left'})
+    assert [r['action'] for r in local] == ['arrow_up', 'arrow_down']
+    assert targets['den'].received[0][2] == {'direction': 'left'}
+
+def test_all_targets(hub, targets, local, client):
+    response = post(client, '/arrow', {'direction': 'up', 'target': 'all'})
+    assert response.status_code == 200
+    reply = response.get_json()
+    assert reply['status'] == 'ok'
+    assert set(reply['targets']) == {'den', 'office', 'local'}
+    assert reply['targets']['office']['from'] == targets['office'].url
+    assert reply['targets']['local']['action'] == 'arrow_up'
+    assert [r['action'] for r in local] == ['arrow_up']
+
+def test_unknown_target(hub, local, client):
+    response = post(client, '/arrow', {'direction': 'up', 'target': 'attic'})
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Unknown target: attic'}
+
+def test_unreachable_target(hub, targets, local, client):
+    targets['den'].shutdown()
+    targets['den'].server_close()
+    hub.targets['den'].close()
+    response = post(client, '/arrow', {'direction': 'up', 'target': 'den'})
+    assert response.status_code == 502
+    assert hub.targets['den'].healthy is False
+    # Fails fast until the retry delay is over
+    response = post(client, '/arrow', {'direction': 'up', 'target': 'den,office'})
+    assert response.status_code == 200
+    reply = response.get_json()['targets']
+    assert reply['den'] == {'error': 'Target unavailable'}
+    assert reply['office']['status'] == 'ok'
+
+def test_websocket_message(hub, targets, local):
+    reply = hub.route_message('volume', {'action': 'up', 'target': 'office', 'id': 7}, 'id:phone',
+                              lambda cmd, data: {})
+    assert reply['from'] == targets['office'].url
+    assert targets['office'].received[0][:1] == ('/volume',)
+    assert targets['office'].received[0][2] == {'action': 'up'}
+    with pytest.raises(server.CommandError):
+        hub.route_message('volume_get', {'target': 'office'}, 'id:phone', None)
@@ -0,0 +1,106 @@
+"""Unit tests for the command journal and macro playback"""
+
+import time
+
+import pytest
+
+import server
+
+HTTP, MACRO = server.JOURNAL_SOURCES.index('http'), server.JOURNAL_SOURCES.index('macro')
+
+@pytest.fixture
+def journal(monkeypatch, tmp_path):
+    journal = server.CommandJournal()
+    journal.configure({'enabled': True, 'path': str(tmp_path / 'journal.bin'), 'entries': 4})
+    assert journal.enabled
+    monkeypatch.setattr(server, 'journal', journal)
+    yield journal
+    journal.close()
+
+def append(journal, name, data, source=HTTP):
+    journal.append(source, server.prepare_command(name, data), 0.001, 0.002)
+
+def arrows(entries):
+    return [e['command']['direction'] for e in entries]
+
+def test_ring_wraps(journal):
+    for direction in ('up', 'down', 'left', 'right', 'up', 'down'):
+        append(journal, 'arrow', {'direction': direction})
+    assert journal.next_sequence == 7
+    entries = journal.entries(1, 100)
+    assert [e['sequence'] for e in entries] == [3, 4, 5, 6]
+    assert arrows(entries) == ['left', 'right', 'up', 'down']
+    assert entries[0]['queue_wait_us'] == 1000 and entries[0]['inject_us'] == 2000
+    assert arrows(journal.entries(4, 6)) == ['right', 'up']
+    assert server.read_journal(journal.path) == entries
+
+def test_reopen_keeps_entries(journal):
+    append(journal, 'arrow', {'direction': 'up'})
+    path = journal.path
+    journal.close()
+    journal.configure({'enabled': True, 'path': path, 'entries': 4})
+    assert journal.next_sequence == 2
+    assert arrows(journal.entries(1, 2)) == ['up']
+    # A different capacity starts a fresh ring
+    journal.close()
+    journal.configure({'enabled': True, 'path': path, 'entries': 8})
+    assert journal.entries(1, 100) == []
+
+def test_text_is_redacted_and_long_commands_truncated(journal):
+    append(journal, 'type', {'text': 'secret'})
+    journal.record_text = True
+    append(journal, 'type', {'text': 'x' * 1000})
+    redacted, truncated = journal.entries(1, 3)
+    assert redacted['redacted'] and redacted['command']['text'] == ''
+    assert truncated['command'] is None
+
+@pytest.fixture
+def submitted(monkeypatch):
+    submitted = []
+    monkeypatch.setattr(server.dispatcher, 'submit',
+                        lambda commands, **kwargs: submitted.extend(
+                            (c.spec, kwargs['source'], kwargs['client']) for c in commands))
+    return submitted
+
+def wait_for_playback(macros, playback_id):
+    deadline = time.monotonic() + 5
+    while playback_id in macros.playbacks:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+def test_macro_replay(journal, submitted):
+    macros = server.MacroManager()
+    append(journal, 'arrow', {'direction': 'left'})
+    macro_id, first = macros.record()
+    assert first == 2
+    append(journal, 'arrow', {'direction': 'up'})
+    append(journal, 'type', {'text': 'secret'})
+    append(journal, 'arrow', {'direction': 'down'}, source=MACRO)
+    append(journal, 'key', {'key': 'enter'})
+    assert macros.stop(macro_id) == (2, 6)
+    assert macros.stop(macro_id) is None
+    
+    playback_id, count, duration = macros.play(*macros.segment(macro_id), scale=0, client='id:phone')
+    wait_for_playback(macros, playback_id)
+    # Redacted text and earlier replays are skipped
+    assert count == 2 and duration == 0
+    assert submitted == [({'direction': 'up', 'cmd': 'arrow'}, 'macro', 'id:phone'),
+                         ({'key': 'enter', 'cmd': 'key'}, 'macro', 'id:phone')]
+
+def test_macro_cancel(journal, submitted):
+    macros = server.MacroManager()
+    macro_id, _ = macros.record()
+    append(journal, 'arrow', {'direction': 'up'})
+    time.sleep(0.05)
+    append(journal, 'arrow', {'direction': 'down'})
+    playback_id, count, duration = macros.play(*macros.stop(macro_id), scale=100)
+    assert count == 2 and duration > 1
+    assert macros.cancel(playback_id)
+    wait_for_playback(macros, playback_id)
+    assert len(submitted) <= 1
+    assert not macros.cancel(playback_id)
+
+@pytest.mark.parametrize('scale', [-1, float('nan'), float('inf'), 101])
+def test_macro_scale_is_checked(journal, scale):
+    with pytest.raises(ValueError):
+        server.MacroManager().play(1, 2, scale=scale)
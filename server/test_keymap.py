@@ -0,0 +1,30 @@
+"""Unit tests for key name resolution and shortcut parsing"""
+
+import pytest
+
+import keymap
+
+def test_single_keys():
+    assert keymap.parse_shortcut('enter') == (('enter',),)
+    assert keymap.parse_shortcut('Escape') == (('esc',),)
+    assert keymap.parse_shortcut('a') == (('a',),)
+    assert keymap.parse_shortcut('+') == (('+',),)
+
+def test_chord():
+    assert keymap.parse_shortcut('ctrl+shift+t') == (('ctrl', 'shift', 't'),)
+    # Shift is explicit in a chord, so the letter is lowercased
+    assert keymap.parse_shortcut('ctrl+T') == (('ctrl', 't'),)
+    assert keymap.parse_shortcut('win+pgup') == (('cmd', 'page_up'),)
+
+def test_sequence():
+    assert keymap.parse_shortcut('ctrl+k ctrl+c') == (('ctrl', 'k'), ('ctrl', 'c'))
+
+@pytest.mark.parametrize("text", ['', '   ', 'ctrl+', '+ctrl', 'ctrl++', 'ctrl+nope',
+                                  'ctrl+ctrl', 'a+b+c+d+e+f+g+h+i', ' '.join(['a'] * 9)])
+def test_invalid(text):
+    with pytest.raises(keymap.KeymapError):
+        keymap.parse_shortcut(text)
+
+def test_format_round_trip():
+    for text in ('ctrl+shift+t', 'alt+tab', 'ctrl+k ctrl+c', 'f5'):
+        assert keymap.format_shortcut(keymap.parse_shortcut(text)) == text
@@ -0,0 +1,85 @@
+"""Unit tests for pointer stream interpolation"""
+
+import time
+
+import pytest
+
+import server
+
+@pytest.fixture
+def streamer():
+    streamer = server.PointerStreamer()
+    streamer.configure({'rate_hz': 100, 'jitter_ms': 0})
+    return streamer
+
+@pytest.fixture
+def stream(streamer):
+    stream = streamer._stream('phone')
+    stream.min_offset = 0.0
+    return stream
+
+def add(streamer, stream, samples):
+    for time_ms, dx, dy in samples:
+        streamer._add_sample(stream, streamer._playout(stream, time_ms), time_ms, dx, dy)
+
+def test_motion_is_spread_over_frames(streamer, stream):
+    add(streamer, stream, [(0, 10, 0), (10, 10, -20), (20, 10, 0)])
+    # The first sample covers one frame before it is due
+    assert streamer._motion(stream, -5) == (5, 0)
+    assert streamer._motion(stream, 5) == (10, -10)
+    assert streamer._motion(stream, 20) == (15, -10)
+    assert not stream.segments
+
+def test_remainders_carry_over(streamer, stream):
+    add(streamer, stream, [(0, 1, 3)])
+    moves = [streamer._motion(stream, t) for t in (-7.5, -5, -2.5, 0)]
+    assert moves == [(0, 0), (0, 1), (0, 1), (1, 1)]
+
+def test_gap_starts_a_new_stroke(streamer, stream):
+    add(streamer, stream, [(0, 10, 0), (500, 10, 0)])
+    assert stream.segments[1][:2] == [490, 500]
+    assert streamer._motion(stream, 250) == (10, 0)
+    assert streamer._motion(stream, 495) == (5, 0)
+
+def test_acceleration(streamer, stream):
+    streamer.configure({'rate_hz': 100, 'jitter_ms': 0, 'acceleration': 1.0, 'max_gain': 2.0})
+    # 1 count per ms is capped at 2x, 0.1 count per ms gets 1.1x
+    add(streamer, stream, [(0, 10, 0), (10, 1, 0)])
+    assert [segment[2] for segment in stream.segments] == [20, pytest.approx(1.1)]
+
+def test_buttons_play_out_between_motion(streamer, stream):
+    add(streamer, stream, [(10, 10, 0), (20, 10, 0)])
+    stream.events.append((10, 'button', ('left', 'down')))
+    assert streamer._collect(20) == [('move', (10, 0)), ('button', ('left', 'down')), ('move', (10, 0))]
+    assert stream.held == {'left'}
+
+def test_held_buttons_time_out(streamer, stream):
+    stream.held.add('left')
+    assert streamer._collect(0) == []
+    stream.last_seen -= streamer.HOLD_TIMEOUT + 1
+    assert streamer._collect(0) == [('button', ('left', 'up'))]
+    assert not stream.held
+
+def test_stream_is_injected(monkeypatch, streamer):
+    backend = server.RecordingInputBackend()
+    monkeypatch.setattr(server, 'input_backend', backend)
+    # The batch arrives at once; the jitter budget lets it play out with its spacing
+    streamer.configure({'rate_hz': 100, 'jitter_ms': 60})
+    now = time.time() * 1000
+    samples = [(now + i * 5, 3, -1) for i in range(10)]
+    assert streamer.submit('phone', samples, [(now + 45, 'left', 'click')]) == 11
+    deadline = time.monotonic() + 5
+    while ('button', 'left', False) not in backend.events:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+    moves = [event[1:] for event in backend.events if event[0] == 'move']
+    assert len(moves) > 1
+    assert (sum(x for x, _ in moves), sum(y for _, y in moves)) == (30, -10)
+
+def test_lease_holder_only(monkeypatch, streamer):
+    dispatcher = server.InputDispatcher()
+    monkeypatch.setattr(server, 'dispatcher', dispatcher)
+    dispatcher.acquire_lease('tablet', 1)
+    with pytest.raises(server.LeaseHeldError):
+        streamer.submit('phone', [(0, 1, 1)])
+    assert streamer.submit('tablet', [(0, 1, 1)]) == 1
@@ -0,0 +1,54 @@
+"""Unit tests for server-side key repeat sessions"""
+
+import time
+
+import pytest
+
+import server
+
+@pytest.fixture
+def repeats(monkeypatch):
+    submitted = []
+    monkeypatch.setattr(server.dispatcher, 'submit',
+                        lambda commands, **kwargs: submitted.extend(
+                            (c.result['action'], kwargs.get('client')) for c in commands))
+    manager = server.RepeatManager()
+    manager.configure({'delay_ms': 10, 'interval_ms': 10, 'min_interval_ms': 10,
+                       'heartbeat_timeout_ms': 100})
+    manager.submitted = submitted
+    return manager
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+def test_session_repeats_until_stopped(repeats):
+    session = repeats.start('up', 'id:phone')
+    wait_for(lambda: len(repeats.submitted) >= 3)
+    assert set(repeats.submitted) == {('arrow_up', 'id:phone')}
+    assert repeats.stop(session, 'id:phone')
+    assert not repeats.stop(session, 'id:phone')
+    count = len(repeats.submitted)
+    time.sleep(0.05)
+    assert len(repeats.submitted) <= count + 1
+
+def test_session_times_out_without_heartbeat(repeats):
+    session = repeats.start('down', 'id:phone')
+    wait_for(lambda: session not in repeats._sessions)
+    assert not repeats.heartbeat(session, 'id:phone')
+
+def test_heartbeat_keeps_session_alive(repeats):
+    session = repeats.start('left', 'id:phone')
+    for _ in range(6):
+        time.sleep(0.04)
+        assert repeats.heartbeat(session, 'id:phone')
+    assert repeats.stop(session, 'id:phone')
+
+def test_other_client_cannot_touch_session(repeats):
+    session = repeats.start('right', 'id:phone')
+    assert not repeats.heartbeat(session, 'id:tablet')
+    assert not repeats.stop(session, 'id:tablet')
+    assert not repeats.stop(session)
+    assert repeats.stop(session, 'id:phone')
@@ -0,0 +1,67 @@
+"""Unit tests for the signed UDP command channel"""
+
+import hashlib
+import hmac
+import time
+
+import pytest
+
+import server
+
+TOKEN = 'udp-token'
+
+@pytest.fixture
+def udp(monkeypatch):
+    server.authenticator.configure(TOKEN, {})
+    submitted = []
+    monkeypatch.setattr(server.dispatcher, 'submit',
+                        lambda commands, **kwargs: submitted.extend(c.result for c in commands))
+    listener = server.UdpCommandServer('127.0.0.1', 0, window=8, max_age_ms=1000)
+    listener.submitted = submitted
+    yield listener
+    listener.close()
+
+def packet(sequence, payload=b'\x00', opcode=1, sender=7, timestamp_ms=None, key=TOKEN):
+    if timestamp_ms is None:
+        timestamp_ms = int(time.time() * 1000)
+    body = server.UDP_HEADER.pack(server.UDP_VERSION, opcode, sender, sequence, timestamp_ms) + payload
+    return body + hmac.new(key.encode(), body, hashlib.sha256).digest()[:server.UDP_MAC_SIZE]
+
+def test_signed_packet_is_injected(udp):
+    udp.handle_packet(packet(1))
+    udp.handle_packet(packet(2, b'\x03'))
+    udp.handle_packet(packet(3, b'enter', opcode=2))
+    assert [r['action'] for r in udp.submitted] == ['arrow_up', 'arrow_right', 'key_enter']
+
+def test_bad_mac_is_dropped(udp):
+    udp.handle_packet(packet(1, key='wrong'))
+    tampered = bytearray(packet(2))
+    tampered[server.UDP_HEADER.size] = 1
+    udp.handle_packet(bytes(tampered))
+    udp.handle_packet(b'short')
+    assert udp.submitted == []
+
+def test_replay_window(udp):
+    for sequence in (5, 5, 3, 4, 3, 6):
+        udp.handle_packet(packet(sequence))
+    assert len(udp.submitted) == 4
+    # Sequence 5 - 8 = -3 has fallen behind the 8-packet window
+    udp.handle_packet(packet(20))
+    udp.handle_packet(packet(12))
+    assert len(udp.submitted) == 5
+
+def test_large_sequence_jump(udp):
+    sender = server.UdpSender()
+    assert udp._accept_sequence(sender, 1)
+    assert udp._accept_sequence(sender, 1 << 62)
+    assert sender.window == 1
+    assert not udp._accept_sequence(sender, 1 << 62)
+    assert udp._accept_sequence(sender, (1 << 62) - 1)
+
+def test_freshness_is_relative_to_fastest_packet(udp):
+    # The phone's clock is an hour behind; only relative delay counts
+    skewed = int(time.time() * 1000) - 3600 * 1000
+    udp.handle_packet(packet(1, timestamp_ms=skewed))
+    udp.handle_packet(packet(2, timestamp_ms=skewed - 5000))
+    udp.handle_packet(packet(3, timestamp_ms=skewed + 10))
+    assert len(udp.submitted) == 2
@@ -0,0 +1,45 @@
+"""Unit tests for the events the uinput backend writes (no device needed)"""
+
+import struct
+
+import pytest
+
+import server
+
+SHIFT, CTRL, A, ONE = 42, 29, 30, 2
+
+@pytest.fixture
+def uinput():
+    backend = server.UinputInputBackend()
+    backend.written = []
+    backend._write = backend.written.append
+    return backend
+
+def keys(backend):
+    """(code, value) of every key event written so far"""
+    data = b''.join(backend.written)
+    size = struct.calcsize(backend.EVENT_FORMAT)
+    events = [struct.unpack_from(backend.EVENT_FORMAT, data, i) for i in range(0, len(data), size)]
+    return [(code, value) for _, _, kind, code, value in events if kind == server.EV_KEY]
+
+def test_plain_key(uinput):
+    uinput.tap('a')
+    assert keys(uinput) == [(A, 1), (A, 0)]
+
+@pytest.mark.parametrize("key, code", [('A', A), ('!', ONE)])
+def test_shifted_character(uinput, key, code):
+    uinput.tap(key)
+    assert keys(uinput) == [(SHIFT, 1), (code, 1), (code, 0), (SHIFT, 0)]
+
+def test_chord_with_shifted_character(uinput):
+    uinput.chord(['ctrl', '!'])
+    assert keys(uinput) == [(CTRL, 1), (SHIFT, 1), (ONE, 1), (ONE, 0), (SHIFT, 0), (CTRL, 0)]
+
+def test_explicit_shift_is_not_doubled(uinput):
+    uinput.chord(['shift', '!'])
+    assert keys(uinput) == [(SHIFT, 1), (ONE, 1), (ONE, 0), (SHIFT, 0)]
+
+def test_unknown_key(uinput):
+    with pytest.raises(ValueError):
+        uinput.tap('é')
+    assert uinput.written == []
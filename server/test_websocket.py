@@ -0,0 +1,137 @@
+"""Unit tests for WebSocket framing"""
+
+import json
+import os
+import socket
+import struct
+import threading
+
+import pytest
+
+import server
+
+TOKEN = 'ws-token'
+
+def unmask_slowly(payload, mask):
+    return bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+@pytest.mark.parametrize('size', [0, 1, 3, 4, 5, 125, 1000])
+def test_unmask(size):
+    payload, mask = os.urandom(size), os.urandom(4)
+    assert server._ws_unmask(payload, mask) == unmask_slowly(payload, mask)
+    assert server._ws_unmask(server._ws_unmask(payload, mask), mask) == payload
+
+@pytest.fixture
+def ws_server(monkeypatch):
+    server.authenticator.configure(TOKEN, {})
+    submitted = []
+    monkeypatch.setattr(server.dispatcher, 'submit',
+                        lambda commands, **kwargs: submitted.extend(c.result for c in commands))
+    listener = server.WebSocketServer(('127.0.0.1', 0), server.WebSocketHandler)
+    threading.Thread(target=listener.serve_forever, args=(0.05,), daemon=True).start()
+    listener.submitted = submitted
+    yield listener
+    listener.close()
+
+def connect(ws_server, token=TOKEN, key='dGhlIHNhbXBsZSBub25jZQ=='):
+    sock = socket.create_connection(ws_server.server_address, timeout=5)
+    sock.sendall((f'GET /?token={token} HTTP/1.1\r\nHost: x\r\nUpgrade: websocket\r\n'
+                  f'Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n'
+                  'Sec-WebSocket-Version: 13\r\n\r\n').encode('ascii'))
+    return sock, sock.makefile('rb')
+
+def handshake(ws_server):
+    sock, reader = connect(ws_server)
+    head = b''
+    while not head.endswith(b'\r\n\r\n'):
+        head += reader.readline()
+    assert head.startswith(b'HTTP/1.1 101 ')
+    return sock, reader, head
+
+def frame(opcode, payload, fin=True, mask=None):
+    """A client frame; clients must mask"""
+    mask = mask or os.urandom(4)
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', opcode | (0x80 if fin else 0), 0x80 | length)
+    elif length < 0x10000:
+        header = struct.pack('!BBH', opcode | (0x80 if fin else 0), 0x80 | 126, length)
+    else:
+        header = struct.pack('!BBQ', opcode | (0x80 if fin else 0), 0x80 | 127, length)
+    return header + mask + unmask_slowly(payload, mask)
+
+def read_frame(reader):
+    first, second = reader.read(2)
+    assert not second & 0x80, "server frames are not masked"
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', reader.read(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', reader.read(8))[0]
+    return first & 0x80, first & 0x0F, reader.read(length)
+
+def command(**data):
+    return json.dumps(data).encode('utf-8')
+
+def test_handshake_accept_key(ws_server):
+    sock, reader, head = handshake(ws_server)
+    # The example from RFC 6455
+    assert b'Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=\r\n' in head
+    sock.close()
+
+def test_wrong_token_is_dropped(ws_server):
+    sock, reader = connect(ws_server, token='wrong')
+    assert reader.read() == b''
+    sock.close()
+
+def test_text_message_is_acknowledged(ws_server):
+    sock, reader, _ = handshake(ws_server)
+    sock.sendall(frame(server.WS_OP_TEXT, command(cmd='arrow', direction='up', id=1)))
+    fin, opcode, payload = read_frame(reader)
+    assert fin and opcode == server.WS_OP_TEXT
+    assert json.loads(payload) == {'status': 'ok', 'action': 'arrow_up', 'id': 1}
+    assert [r['action'] for r in ws_server.submitted] == ['arrow_up']
+    sock.close()
+
+def test_fragments_and_ping(ws_server):
+    sock, reader, _ = handshake(ws_server)
+    message = command(cmd='key', key='enter', id='k')
+    sock.sendall(frame(server.WS_OP_TEXT, message[:5], fin=False)
+                 + frame(server.WS_OP_PING, b'hi')
+                 + frame(server.WS_OP_CONTINUATION, message[5:12], fin=False)
+                 + frame(server.WS_OP_CONTINUATION, message[12:]))
+    # Control frames may arrive in the middle of a fragmented message
+    assert read_frame(reader) == (0x80, server.WS_OP_PONG, b'hi')
+    assert json.loads(read_frame(reader)[2])['id'] == 'k'
+    sock.close()
+
+def test_extended_lengths(ws_server):
+    sock, reader, _ = handshake(ws_server)
+    # Both the 126-byte request and its ack need a 16-bit length
+    message_id = 'x' * 200
+    sock.sendall(frame(server.WS_OP_TEXT, command(cmd='arrow', direction='down', id=message_id)))
+    assert json.loads(read_frame(reader)[2])['id'] == message_id
+    sock.close()
+
+def test_oversized_frame_closes_the_channel(ws_server):
+    sock, reader, _ = handshake(ws_server)
+    sock.sendall(struct.pack('!BBQ', 0x80 | server.WS_OP_TEXT, 0x80 | 127, server.WS_MAX_MESSAGE + 1))
+    assert reader.read() == b''
+    sock.close()
+
+def test_close_is_echoed(ws_server):
+    sock, reader, _ = handshake(ws_server)
+    sock.sendall(frame(server.WS_OP_CLOSE, struct.pack('!H', 1000) + b'bye'))
+    assert read_frame(reader) == (0x80, server.WS_OP_CLOSE, struct.pack('!H', 1000))
+    assert reader.read() == b''
+    sock.close()
+
+def test_server_frame_lengths():
+    sent = []
+    handler = server.WebSocketHandler.__new__(server.WebSocketHandler)
+    handler.send_lock = threading.Lock()
+    handler.wfile = type('Writer', (), {'write': staticmethod(sent.append)})
+    for size in (125, 126, 0xFFFF, 0x10000):
+        handler._send_frame(server.WS_OP_BINARY, bytes(size))
+    assert [len(frame) - size for frame, size in zip(sent, (125, 126, 0xFFFF, 0x10000))] == [2, 4, 4, 10]
+    assert sent[3][:2] == bytes([0x82, 127])